@@ -0,0 +1,409 @@
+"""Benchmarks of the banner rendering pipeline.
+
+Renders the bundled templates of `artefacts/` with their logo and graphics and
+synthetic actor images, then reports banners/sec, per-banner latency percentiles and a
+per-stage breakdown, along with the peak RSS of the whole run. The report is written
+as JSON, which can be compared with the one of another version:
+
+.. code-block:: bash
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+
+import generative_banner.constants as C
+from generative_banner.config import settings
+from generative_banner.model import Rendition
+from generative_banner.render import (
+    TEXT_LAYERS,
+    _create_marketing_banner_baseline,
+    _get_font_size,
+    _place_image_overlay_on_background,
+    compile_render_plan,
+    encode_image,
+    get_encoder,
+    submit_banner,
+)
+from generative_banner.utils.storage import MemoryStorage
+
+TEXT_INPUTS = {
+    "text_header1": "Unlimited data for your weekend",
+    "text_header2": "Stream, game and chat without limits",
+    "text_details": (
+        "Get 30 GB of data valid for 28 days, with unlimited access to your favourite "
+        "streaming and social media apps. Activate now from the app."
+    ),
+    "text_highlight1": "30 GB",
+    "text_highlight3": "Rp 59,000",
+    "text_tagline": "Terms and conditions apply",
+    "text_action": "BUY NOW",
+}
+IMAGE_INPUTS = {
+    "logo_path": "Logo/ctellogo.png",
+    "graphic1_path": "Graphics/Graphics1.png",
+    "graphic2_path": "Graphics/50GraphicV.png",
+    "graphic_highlight2_path": "Graphics/50GraphicH1.png",
+}
+
+
+def make_actor(path: str, size=(896, 1280), seed=0, background=None) -> None:
+    """Writes a synthetic actor, a noisy silhouette like a generated person.
+
+    Args:
+        path: Path of the PNG file.
+        size: Size of the image, the default is the one of Imagen 3:4 outputs.
+        seed: Seed of the noise, different actors have different content.
+        background: Opaque background color, transparent as after background
+            removal if None.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    mask = Image.new("L", size, 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((width * 0.3, height * 0.05, width * 0.7, height * 0.35), fill=255)
+    draw.rounded_rectangle(
+        (width * 0.15, height * 0.3, width * 0.85, height), radius=width // 8, fill=255
+    )
+    # Low resolution noise upsampled, smooth like a photo rather than incompressible.
+    noise = rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+    actor = Image.fromarray(noise, "RGB").resize(size, Image.BICUBIC).convert("RGBA")
+    if background is None:
+        actor.putalpha(mask)
+    else:
+        canvas = Image.new("RGBA", size, background)
+        canvas.paste(actor, (0, 0), mask)
+        actor = canvas
+    actor.save(path)
+
+
+def peak_rss_mib() -> float:
+    """Returns the peak resident set size of the process so far.
+
+    It is process-wide and never decreases, so it is reported once for the whole run.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in KiB elsewhere.
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Returns a percentile by nearest rank."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def summarize(durations: list[float], n_banners: int | None = None) -> dict:
+    """Summarizes the durations of the iterations of a benchmark, in milliseconds."""
+    total = sum(durations)
+    summary = {
+        "n": len(durations),
+        "total_s": round(total, 4),
+        "mean_ms": round(total / len(durations) * 1000, 3),
+        "p50_ms": round(percentile(durations, 50) * 1000, 3),
+        "p99_ms": round(percentile(durations, 99) * 1000, 3),
+    }
+    if n_banners is not None:
+        summary["banners_per_s"] = round(n_banners / total, 3)
+    return summary
+
+
+def measure(fn, n: int, warmup: int = 1) -> list[float]:
+    """Times `n` calls of a function after `warmup` untimed ones."""
+    durations = []
+    for i in range(warmup + n):
+        start = time.perf_counter()
+        fn(i)
+        if i >= warmup:
+            durations.append(time.perf_counter() - start)
+    return durations
+
+
+def run(args) -> dict:
+    """Runs all benchmarks.
+
+    Returns:
+        Dict of (benchmark name -> summary).
+    """
+    artefacts_dir = args.artefacts_dir
+    with open(os.path.join(artefacts_dir, "config.json")) as f:
+        templates = json.load(f)[C.DocKey.TEMPLATE]
+    if args.templates:
+        templates = [t for t in templates if t["bannertemplate"] in args.templates]
+    image_inputs = {k: os.path.join(artefacts_dir, v) for k, v in IMAGE_INPUTS.items()}
+    backgrounds = {
+        t["bannertemplate"]: os.path.join(
+            artefacts_dir, "Background", f"{t['bannertemplate']}.png"
+        )
+        for t in templates
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="banner-bench-")
+    actors = []
+    for i in range(args.n_actors):
+        actors.append(os.path.join(work_dir, f"NoBg_actor_{i}.png"))
+        make_actor(actors[-1], seed=i)
+
+    # Every (template, actor) pair is a banner, cycled through by the iterations.
+    jobs = [(t, a) for t in templates for a in actors]
+    results = {}
+
+    def log(name):
+        summary = results[name]
+        print(
+            f"{name:32s} n={summary['n']:4d}  p50 {summary['p50_ms']:9.2f} ms  "
+            f"p99 {summary['p99_ms']:9.2f} ms"
+            + (
+                f"  {summary['banners_per_s']:8.2f} banners/s"
+                if "banners_per_s" in summary
+                else ""
+            ),
+            file=sys.stderr,
+        )
+
+    # Stages
+
+    def font_size(i):
+        config = templates[i % len(templates)]
+        # As called by `_draw_multiline_text`, single line layers have a fixed size.
+        for name, style in TEXT_LAYERS.items():
+            if f"{name}_position" not in config or "font_size" in style:
+                continue
+            box = config[f"{name}_position"]
+            _get_font_size(
+                (box["width"], box["height"]),
+                TEXT_INPUTS[name],
+                style["font_name"],
+                style["margin"],
+            )
+
+    results["stage.font_size"] = summarize(measure(font_size, args.n))
+    log("stage.font_size")
+
+    overlay_path = os.path.join(work_dir, "overlay.png")
+
+    def place_overlay(i):
+        config, actor = jobs[i % len(jobs)]
+        _place_image_overlay_on_background(
+            actor,
+            backgrounds[config["bannertemplate"]],
+            config["actor_position"],
+            overlay_path,
+        )
+
+    results["stage.place_overlay"] = summarize(measure(place_overlay, args.n))
+    log("stage.place_overlay")
+
+    def compile_plan(i):
+        config = templates[i % len(templates)]
+        compile_render_plan(
+            backgrounds[config["bannertemplate"]], config, image_inputs, TEXT_INPUTS
+        )
+
+    results["stage.compile_plan"] = summarize(measure(compile_plan, args.n))
+    log("stage.compile_plan")
+
+    plans = {
+        t["bannertemplate"]: compile_render_plan(
+            backgrounds[t["bannertemplate"]], t, image_inputs, TEXT_INPUTS
+        )
+        for t in templates
+    }
+
+    def render(i):
+        config, actor = jobs[i % len(jobs)]
+        plans[config["bannertemplate"]].render(actor)
+
+    results["stage.render"] = summarize(measure(render, args.n))
+    log("stage.render")
+
+    banner = plans[templates[0]["bannertemplate"]].render(actors[0])
+    for encoding in args.encodings:
+        encoder = get_encoder(encoding)
+        try:
+            encode_image(banner, encoder)
+        except ValueError as e:
+            print(f"Skipping encoding {encoding}: {e}", file=sys.stderr)
+            continue
+        name = f"stage.encode.{encoding}"
+        results[name] = summarize(
+            measure(lambda i, encoder=encoder: encode_image(banner, encoder), args.n)
+        )
+        log(name)
+
+    if args.remove_background:
+        try:
+            from generative_banner.utils.imagen import remove_background
+        except ImportError as e:
+            print(f"Skipping background removal: {e}", file=sys.stderr)
+        else:
+            raw_actor = os.path.join(work_dir, "actor_raw.png")
+            make_actor(raw_actor, background=(255, 255, 255, 255))
+            results["stage.remove_background"] = summarize(
+                measure(
+                    lambda i: remove_background(
+                        raw_actor,
+                        os.path.join(work_dir, "NoBg_raw.png"),
+                        os.path.join(work_dir, "Mask_raw.png"),
+                    ),
+                    max(1, args.n // 10),
+                )
+            )
+            log("stage.remove_background")
+
+    # End to end, per banner
+
+    baseline_path = os.path.join(work_dir, "baseline.png")
+
+    def baseline(i):
+        config, actor = jobs[i % len(jobs)]
+        _create_marketing_banner_baseline(
+            backgrounds[config["bannertemplate"]],
+            config,
+            {**image_inputs, "actor_path": actor},
+            TEXT_INPUTS,
+            baseline_path,
+        )
+
+    n_baseline = max(1, args.n // 10)  # an order of magnitude slower
+    results["banner.baseline"] = summarize(
+        measure(baseline, n_baseline), n_banners=n_baseline
+    )
+    log("banner.baseline")
+
+    storage = MemoryStorage()
+    encoder = get_encoder(args.encodings[0])
+    renditions = [Rendition.from_name(name) for name in args.renditions]
+
+    def plan_banner(i):
+        config, actor = jobs[i % len(jobs)]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            futures = submit_banner(
+                executor,
+                plans[config["bannertemplate"]],
+                actor,
+                f"banner_{i}.png",
+                renditions=renditions,
+                encoder=encoder,
+                storage=storage,
+            )
+            for future in futures:
+                future.result()
+
+    results["banner.plan"] = summarize(measure(plan_banner, args.n), n_banners=args.n)
+    log("banner.plan")
+
+    # Throughput of a batch, outputs encoded concurrently with the renders
+
+    def batch(_):
+        with ThreadPoolExecutor(max_workers=settings.n_render_workers) as executor:
+            futures = []
+            for i, (config, actor) in enumerate(jobs):
+                futures.extend(
+                    submit_banner(
+                        executor,
+                        plans[config["bannertemplate"]],
+                        actor,
+                        f"batch_{i}.png",
+                        renditions=renditions,
+                        encoder=encoder,
+                        storage=storage,
+                    )
+                )
+            for future in futures:
+                future.result()
+        storage.files.clear()
+
+    durations = measure(batch, args.n_batches)
+    results["batch"] = summarize(durations, n_banners=len(jobs) * args.n_batches)
+    results["batch"]["n_banners"] = len(jobs)
+    log("batch")
+
+    return results
+
+
+def compare(results: dict, previous: dict) -> None:
+    """Prints the change of each benchmark relative to a previous report."""
+    print(f"\n{'benchmark':32s} {'p50 before':>12s} {'p50 after':>12s} {'change':>8s}")
+    for name, summary in results.items():
+        if name not in previous:
+            continue
+        before, after = previous[name]["p50_ms"], summary["p50_ms"]
+        change = (after - before) / before * 100 if before else float("nan")
+        print(f"{name:32s} {before:10.2f}ms {after:10.2f}ms {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--artefacts-dir", default=settings.local_artefacts_dir)
+    parser.add_argument(
+        "--templates", nargs="*", help="Names of the templates, all if omitted."
+    )
+    parser.add_argument(
+        "-n", type=int, default=50, help="Number of iterations per benchmark."
+    )
+    parser.add_argument("--n-actors", type=int, default=4)
+    parser.add_argument("--n-batches", type=int, default=3)
+    parser.add_argument(
+        "--encodings",
+        nargs="+",
+        default=[settings.banner_encoding],
+        choices=[e.value for e in C.Encoding],
+        help="Encodings to benchmark, the first one is used for the banners.",
+    )
+    parser.add_argument(
+        "--renditions",
+        nargs="*",
+        default=[],
+        help="Additional banner sizes as `<width>x<height>`.",
+    )
+    parser.add_argument(
+        "--remove-background",
+        action="store_true",
+        help="Also benchmark background removal, which downloads the U2Net model.",
+    )
+    parser.add_argument("--output", help="Path of the JSON report.")
+    parser.add_argument("--compare", help="Path of a previous JSON report.")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "n_render_workers": settings.n_render_workers,
+            "args": vars(args),
+        },
+        "results": run(args),
+        "peak_rss_mib": round(peak_rss_mib(), 1),
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report["results"], json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -13,11 +13,16 @@ from generative_banner.blocks import (
     ui_demo_tab_bannergen,
 )
 from generative_banner.config import settings
+from generative_banner.jobs import start_workers
 from generative_banner.utils.firestore import (
     cleanup_document_store,
     init_document_store,
 )
 from generative_banner.utils.io import makedir_if_not_exist
+from generative_banner.utils.log import setup_logging
+from generative_banner.utils.sync import sync_folder_with_gcs_bucket
+
+setup_logging()
 
 for d in [
     os.path.join(settings.local_artefacts_dir, settings.local_actor_dirname),
@@ -26,12 +31,23 @@ for d in [
 ]:
     makedir_if_not_exist(d)
 
+if settings.gcs_artefacts_bucket:
+    sync_folder_with_gcs_bucket(
+        settings.local_artefacts_dir,
+        settings.gcs_artefacts_bucket,
+        settings.gcs_artefacts_folder,
+    )
+
 if settings.is_init_backend:
     cleanup_document_store()
     init_document_store()
 
 os.environ["U2NET_HOME"] = settings.u2net_home
 
+# Long-running generations run as jobs, see `jobs.py`.
+if settings.job_workers > 0:
+    start_workers(settings.job_workers)
+
 tabs = [
     (ui_about_tab, C.BlockName.ABOUT),
     (ui_demo_tab_assetlibrary, C.BlockName.IMAGE),
@@ -0,0 +1,496 @@
+"""Headless batch rendering of banner campaigns.
+
+Renders every banner of a campaign spec without the Gradio app, e.g. from a cron job:
+
+.. code-block:: bash
+    python -m generative_banner.batch campaign.yaml
+
+The spec is a YAML or JSON :class:`~generative_banner.model.Campaign`:
+
+.. code-block:: yaml
+    name: summer-sale
+    templates: [Template1, Template2]
+    segments: [Gen Z Gamer]
+    texts:
+      text_header1: Summer Sale
+      text_action: Buy now
+    logo: logo.png
+    graphics:
+      graphic1: badge.png
+    renditions: [728x90, 300x250]
+    encoding: webp
+
+Banners are written to `<banner dir>/<template>/<actor>-<digest>` of the artefacts
+storage, named after the digest of everything they are rendered from. A banner whose
+outputs already exist, from any earlier run or campaign, is reused rather than
+rendered again, so that e.g. changing a text only renders the banners of the
+templates showing it. `--rerender` renders them all again. Finished banners are
+appended to a checkpoint file, so that running the same spec again after an
+interruption only goes through the remaining ones. `--restart` ignores the
+checkpoint, still reusing the existing outputs. A JSON summary is printed to stdout,
+logs go to stderr.
+
+Exit codes: 0 if all banners were rendered, 1 if some failed, 2 if the spec is
+invalid and 130 if interrupted.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from generative_banner.config import settings
+from generative_banner.jobs import list_processed_actors
+from generative_banner.model import Campaign, Rendition
+from generative_banner.render import (
+    banner_output_paths,
+    collect_banner_inputs,
+    file_digest,
+    get_encoder,
+    get_render_plan,
+    submit_banner,
+    template_digest,
+)
+from generative_banner.utils.log import ProgressLogger, setup_logging
+from generative_banner.utils.phash import get_actor_index
+from generative_banner.utils.storage import get_storage, local_copy
+from generative_banner.utils.tracing import span
+
+# Named explicitly, the module runs as `__main__`.
+logger = logging.getLogger("generative_banner.batch")
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_INVALID = 2
+EXIT_INTERRUPTED = 130
+
+
+def load_campaign(path: str) -> Campaign:
+    """Loads a campaign spec from a YAML or JSON file.
+
+    Args:
+        path: Path to the spec, YAML if its extension is `.yaml` or `.yml`.
+
+    Returns:
+        The validated campaign.
+
+    Raises:
+        ValueError: If the spec cannot be parsed or is not a valid campaign.
+    """
+    with open(path, "r") as f:
+        if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError as e:
+                raise ImportError(
+                    "YAML campaign specs require the `pyyaml` package."
+                ) from e
+            try:
+                data = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError(f"{path} is not valid YAML: {e}") from e
+        else:
+            data = json.load(f)
+    return Campaign.model_validate(data)
+
+
+def load_template_configs(config_file_path: str | None = None) -> dict[str, dict]:
+    """Loads the template documents by name.
+
+    Args:
+        config_file_path: Path to a configuration JSON file as used by
+            :func:`utils.firestore.init_document_store`, to read the templates
+            offline. Read from the document store if None.
+
+    Returns:
+        Dict of (template name -> template document).
+    """
+    if config_file_path is not None:
+        with open(config_file_path, "r") as f:
+            templates = json.load(f).get("banner_template", [])
+    else:
+        # Imported here, the client connects on import.
+        from generative_banner.database import db
+        from generative_banner.utils.firestore import get_bannertemplate_from_db
+
+        templates = get_bannertemplate_from_db(db)
+    return {template["bannertemplate"]: template for template in templates}
+
+
+def _fingerprint(campaign: Campaign) -> str:
+    return hashlib.sha256(campaign.model_dump_json().encode()).hexdigest()
+
+
+def _load_checkpoint(path: str, fingerprint: str) -> dict[str, list[str]]:
+    """Reads the outputs of the finished jobs, if checkpointed for the same spec."""
+    if not os.path.exists(path):
+        return {}
+
+    done = {}
+    with open(path, "r") as f:
+        lines = f.read().splitlines()
+    try:
+        header = json.loads(lines[0]) if lines else {}
+    except json.JSONDecodeError:
+        header = {}
+    if header.get("fingerprint") != fingerprint:
+        logger.warning("Ignoring checkpoint %s of a different campaign spec", path)
+        return {}
+
+    for line in lines[1:]:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # The last line is incomplete if the run was killed while writing it.
+            continue
+        done[record["job"]] = record["outputs"]
+    return done
+
+
+class _Checkpoint:
+    """Appends finished jobs to the checkpoint file, durably one line at a time."""
+
+    def __init__(self, path: str, fingerprint: str, done: dict[str, list[str]]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Rewritten so that a resumed run continues a consistent file.
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"fingerprint": fingerprint}) + "\n")
+            for job, outputs in done.items():
+                f.write(json.dumps({"job": job, "outputs": outputs}) + "\n")
+        os.replace(tmp_path, path)
+        self._file = open(path, "a")
+
+    def add(self, job: str, outputs: list[str]) -> None:
+        self._file.write(json.dumps({"job": job, "outputs": outputs}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _list_jobs(campaign: Campaign) -> list[tuple[str, str, str]]:
+    """Lists the (job ID, template, actor path) of a campaign, in rendering order."""
+    library = get_storage(settings.local_artefacts_dir)
+    # Actors processed before their source was flagged a near-duplicate are skipped.
+    get_actor_index().sync()
+    duplicates = {
+        f"NoBg_{os.path.basename(path)}" for path in get_actor_index().duplicates()
+    }
+    actors = []
+    for segment in campaign.segments:
+        segment_actors = [
+            key
+            for key in sorted(list_processed_actors(segment))
+            if key.rpartition("/")[2] not in duplicates
+        ]
+        if not segment_actors:
+            logger.warning("No processed actors found for segment '%s'", segment)
+        actors.extend(segment_actors)
+
+    # Actors of a bucket are rendered from their local copies.
+    actor_paths = {
+        key: local_copy(library, key, settings.local_artefacts_dir) for key in actors
+    }
+    return [
+        (f"{template}/{key.rpartition('/')[2]}", template, actor_paths[key])
+        for template in campaign.templates
+        for key in actors
+    ]
+
+
+def _output_key(template: str, actor_path: str, digest: str) -> str:
+    actor_name = os.path.splitext(os.path.basename(actor_path))[0]
+    return "/".join(
+        [
+            settings.local_banner_dirname,
+            template,
+            f"{actor_name.removeprefix('NoBg_')}-{digest[:16]}",
+        ]
+    )
+
+
+def _template_key(
+    background_dir,
+    template,
+    template_configs,
+    layouts,
+    image_inputs,
+    text_inputs,
+    renditions,
+    encoder,
+):
+    """Digest of the inputs of the banners of a template, but the actor."""
+    digests = {
+        name: template_digest(
+            f"{background_dir}/{name}.png",
+            template_configs[name],
+            image_inputs,
+            text_inputs,
+        )
+        for name in [template] + [f"{template}_{name}" for name in layouts]
+    }
+    data = [
+        digests,
+        [rendition.model_dump() for rendition in renditions],
+        encoder.model_dump(),
+    ]
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_campaign(
+    campaign: Campaign,
+    template_configs: dict[str, dict],
+    checkpoint_path: str,
+    restart: bool = False,
+    rerender: bool = False,
+    on_progress: Callable[[int, int], None] | None = None,
+) -> dict:
+    """Renders all banners of a campaign, skipping the ones already checkpointed.
+
+    Args:
+        campaign: Campaign to render.
+        template_configs: Dict of (template name -> template document), including
+            the layouts of the renditions if any.
+        checkpoint_path: Path to the checkpoint file.
+        restart: Whether to ignore the checkpoint. Banners whose outputs exist are
+            still reused unless `rerender`.
+        rerender: Whether to render banners again even if their outputs exist.
+        on_progress: Called with the number of banners rendered so far, including
+            the checkpointed ones, and the total number of banners.
+
+    Returns:
+        Summary of the run.
+    """
+    start = time.perf_counter()
+    missing = [name for name in campaign.templates if name not in template_configs]
+    if missing:
+        raise ValueError(f"Unknown templates: {missing}")
+
+    image_inputs, text_inputs = collect_banner_inputs(
+        {"logo": campaign.logo, **campaign.graphics}, campaign.texts
+    )
+    renditions = [Rendition.from_name(name) for name in campaign.renditions]
+    encoder = get_encoder(campaign.encoding)
+    library = get_storage(settings.local_artefacts_dir)
+    background_dir = os.path.join(settings.local_artefacts_dir, "Background")
+
+    fingerprint = _fingerprint(campaign)
+    done = {} if restart else _load_checkpoint(checkpoint_path, fingerprint)
+    jobs = _list_jobs(campaign)
+    pending_jobs = [job for job in jobs if job[0] not in done]
+    logger.info(
+        "Campaign '%s': %d banners, %d already rendered",
+        campaign.name,
+        len(jobs),
+        len(jobs) - len(pending_jobs),
+    )
+
+    checkpoint = _Checkpoint(checkpoint_path, fingerprint, done)
+    failed = []
+    n_reused = 0
+    n_bytes = 0
+    interrupted = False
+
+    def finish(job_id, futures):
+        nonlocal n_bytes
+        try:
+            outputs = [future.result() for future in futures]
+        except Exception as e:
+            logger.error("Failed to render %s: %s", job_id, e)
+            failed.append({"job": job_id, "error": repr(e)})
+            return
+        n_bytes += sum(output.n_bytes for output in outputs)
+        add_done(job_id, [output.path for output in outputs])
+
+    def add_done(job_id, paths):
+        done[job_id] = paths
+        checkpoint.add(job_id, paths)
+        progress_log.update()
+        if on_progress is not None:
+            on_progress(len(done), len(jobs))
+
+    plans = {}
+    # Banners in flight hold their full size image, so their number is bounded.
+    in_flight = deque()
+    max_in_flight = 2 * settings.n_render_workers
+    progress_log = ProgressLogger(logger, "Rendering banners", total=len(pending_jobs))
+    with span("batch.run_campaign", campaign=campaign.name, jobs=len(pending_jobs)):
+        executor = ThreadPoolExecutor(max_workers=settings.n_render_workers)
+        try:
+            for job_id, template, actor_path in pending_jobs:
+                try:
+                    if template not in plans:
+                        # Logo, graphics and texts are the same for every actor.
+                        plan = get_render_plan(
+                            f"{background_dir}/{template}.png",
+                            template_configs[template],
+                            image_inputs,
+                            text_inputs,
+                        )
+                        layouts = {
+                            rendition.name: get_render_plan(
+                                f"{background_dir}/{template}_{rendition.name}.png",
+                                template_configs[f"{template}_{rendition.name}"],
+                                image_inputs,
+                                text_inputs,
+                            )
+                            for rendition in renditions
+                            if f"{template}_{rendition.name}" in template_configs
+                        }
+                        plans[template] = (
+                            plan,
+                            layouts,
+                            _template_key(
+                                background_dir,
+                                template,
+                                template_configs,
+                                layouts,
+                                image_inputs,
+                                text_inputs,
+                                renditions,
+                                encoder,
+                            ),
+                        )
+                    plan, layouts, template_key = plans[template]
+                    digest = hashlib.sha256(
+                        f"{template_key}:{file_digest(actor_path)}".encode()
+                    ).hexdigest()
+                    output_key = _output_key(template, actor_path, digest)
+                    paths = banner_output_paths(output_key, encoder, renditions)
+                    if not rerender and all(library.exists(path) for path in paths):
+                        logger.debug("Reusing the outputs of %s", job_id)
+                        n_reused += 1
+                        add_done(job_id, paths)
+                        continue
+                    futures = submit_banner(
+                        executor,
+                        plan,
+                        actor_path,
+                        output_key,
+                        renditions=renditions,
+                        layouts=layouts,
+                        encoder=encoder,
+                        storage=library,
+                    )
+                except Exception as e:
+                    logger.error("Failed to render %s: %s", job_id, e)
+                    failed.append({"job": job_id, "error": repr(e)})
+                    continue
+
+                in_flight.append((job_id, futures))
+                # Checkpointed in order, as soon as the oldest banners are written.
+                while in_flight and (
+                    len(in_flight) > max_in_flight
+                    or all(future.done() for future in in_flight[0][1])
+                ):
+                    finish(*in_flight.popleft())
+
+            while in_flight:
+                finish(*in_flight.popleft())
+        except KeyboardInterrupt:
+            interrupted = True
+            logger.warning(
+                "Interrupted, %d banners left to render", len(jobs) - len(done)
+            )
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            checkpoint.close()
+            progress_log.close()
+
+    if interrupted:
+        status = "interrupted"
+    elif failed:
+        status = "failed"
+    else:
+        status = "completed"
+    return {
+        "campaign": campaign.name,
+        "status": status,
+        "banners": len(jobs),
+        "rendered": len(done) - (len(jobs) - len(pending_jobs)) - n_reused,
+        "reused": n_reused,
+        "resumed": len(jobs) - len(pending_jobs),
+        "failed": failed,
+        "outputs": [path for outputs in done.values() for path in outputs],
+        "n_bytes": n_bytes,
+        "seconds": round(time.perf_counter() - start, 3),
+        "checkpoint": checkpoint_path,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m generative_banner.batch",
+        description="Renders all banners of a campaign spec.",
+    )
+    parser.add_argument("spec", help="Campaign spec, a YAML or JSON file.")
+    parser.add_argument(
+        "--templates",
+        metavar="CONFIG_JSON",
+        help="Read the templates from a configuration JSON file, e.g. "
+        "artefacts/config.json, instead of Firestore.",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="Checkpoint file, defaults to <tmp dir>/banner-batch-<campaign>.jsonl.",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the checkpoint, banners whose outputs exist are still reused.",
+    )
+    parser.add_argument(
+        "--rerender",
+        action="store_true",
+        help="Render all banners again, even those whose outputs exist.",
+    )
+    parser.add_argument("--log-level", help="Defaults to the LOG_LEVEL setting.")
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log_level)
+    # Interrupted the same way by a scheduler stopping the job.
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+
+    try:
+        campaign = load_campaign(args.spec)
+        template_configs = load_template_configs(args.templates)
+        checkpoint_path = args.checkpoint or os.path.join(
+            settings.local_tmp_dir, f"banner-batch-{campaign.name}.jsonl"
+        )
+        summary = run_campaign(
+            campaign,
+            template_configs,
+            checkpoint_path,
+            restart=args.restart or args.rerender,
+            rerender=args.rerender,
+        )
+    except (OSError, ValueError) as e:
+        logger.error("Invalid campaign: %s", e)
+        json.dump({"status": "invalid", "error": str(e)}, sys.stdout)
+        sys.stdout.write("\n")
+        return EXIT_INVALID
+
+    json.dump(summary, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return {
+        "completed": EXIT_OK,
+        "failed": EXIT_FAILED,
+        "interrupted": EXIT_INTERRUPTED,
+    }[summary["status"]]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
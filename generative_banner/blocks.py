@@ -1,5 +1,6 @@
 """Gradio frontend blocks."""
 
+import logging
 import os
 
 import gradio as gr
@@ -7,13 +8,17 @@ from gradio_image_annotation import image_annotator
 
 import generative_banner.constants as C
 from generative_banner.callbacks import (
+    actor_processing_status,
     create_bounding_box_annotator,
     create_new_segment,
     display_image,
     generate_assets,
     generate_banner,
+    keep_duplicate_actors,
+    list_preview_actors,
     move_images_to_library,
     preprocess_assets_in_library,
+    preview_banner,
     save_template_configuration,
     select_folder,
     update_segment_config,
@@ -22,10 +27,13 @@ from generative_banner.config import settings
 from generative_banner.database import db
 from generative_banner.utils.firestore import (
     fetch_visual_segment_names,
+    fetch_visual_segment_names_async,
     get_bannertemplate_list,
 )
 from generative_banner.utils.io import create_file_map
 
+logger = logging.getLogger(__name__)
+
 gallery_dirname_list = []  # FIXME: Use session state instead.
 
 
@@ -75,6 +83,8 @@ with gr.Blocks() as ui_demo_tab_assetlibrary:
 
     with gr.Column(variant="panel"):
         preprocess_assets_button = gr.Button("Preprocess newly created visuals")
+        # Near-duplicate actors are skipped until kept, see `utils/phash.py`.
+        keep_duplicates_button = gr.Button("Keep selected near-duplicates")
 
     # Event handler for folder selection
     file_explorer.change(
@@ -92,6 +102,10 @@ with gr.Blocks() as ui_demo_tab_assetlibrary:
         outputs=[file_explorer, thumbnail_gallery, displayed_image],
     )
 
+    keep_duplicates_button.click(
+        keep_duplicate_actors, inputs=[file_explorer], outputs=[]
+    )
+
 
 with gr.Blocks() as ui_demo_tab_assetcreation:
     # The state of selected segment. This is used when clicking the asset creation btn.
@@ -176,6 +190,11 @@ with gr.Blocks() as ui_demo_tab_assetcreation:
 
     with gr.Row(visible=False) as approve_visual_assets:
         with gr.Column(variant="panel"):
+            kept_duplicates = gr.CheckboxGroup(
+                label="Near-duplicates of library actors",
+                info="Unticked ones are saved but skipped by preprocessing and banners.",
+                visible=False,
+            )
             approve_button = gr.Button("Save images to library")
 
     gr.on(
@@ -247,7 +266,7 @@ with gr.Blocks() as ui_demo_tab_assetcreation:
             model_input,
             selected_visual_segment,
         ],
-        outputs=[gallery, generate_assets_button, prompt_text],
+        outputs=[gallery, generate_assets_button, prompt_text, kept_duplicates],
     ).then(
         fn=lambda: [
             gr.update(visible=True),
@@ -259,10 +278,11 @@ with gr.Blocks() as ui_demo_tab_assetcreation:
         ],
     )
 
-    approve_button.click(
+    approve_event = approve_button.click(
         move_images_to_library,
         inputs=[
             selected_visual_segment,
+            kept_duplicates,
             # subject_input,
             # age_input,
             # clothing_input,
@@ -282,15 +302,20 @@ with gr.Blocks() as ui_demo_tab_assetcreation:
             review_visual_assets,
             approve_visual_assets,
         ],
-    ).then(
-        fn=lambda: [
-            gr.update(choices=fetch_visual_segment_names(db)),
+    )
+
+    async def reset_segment_inputs():
+        return [
+            gr.update(choices=await fetch_visual_segment_names_async(db)),
             gr.update(value=None),  # Reset the dropdown value
             gr.update(value=None),
             gr.update(value=None),
             gr.update(value=None),
             gr.update(value=None),
-        ],
+        ]
+
+    approve_event.then(
+        fn=reset_segment_inputs,
         outputs=[
             visual_segment_dropdown,
             new_segment_input,
@@ -352,6 +377,9 @@ with gr.Blocks() as ui_demo_tab_bannergen:
         preprocess_visualsegments_button = gr.Button(
             "Update Newly Added Visual Segments"
         )
+        actor_status = gr.Markdown(actor_processing_status)
+        # Backgrounds of new actors are removed by job workers, see `jobs.py`.
+        actor_status_timer = gr.Timer(settings.actor_status_interval)
 
     with gr.Row():
         with gr.Column(scale=1, variant="panel"):
@@ -429,6 +457,29 @@ with gr.Blocks() as ui_demo_tab_bannergen:
                     interactive=True,
                 )
 
+        with gr.Row():
+            rendition_input = gr.CheckboxGroup(
+                choices=[r.value for r in C.Rendition],
+                label="Additional Output Sizes",
+                interactive=True,
+            )
+            encoding_input = gr.Dropdown(
+                choices=[e.value for e in C.Encoding],
+                value=settings.banner_encoding,
+                label="Output Format",
+                interactive=True,
+            )
+
+    with gr.Row(variant="panel"):
+        with gr.Column(scale=1):
+            preview_actor_dropdown = gr.Dropdown(
+                label="Preview Actor", interactive=True
+            )
+        with gr.Column(scale=3):
+            preview_gallery = gr.Gallery(
+                label="Live Preview", columns=[3], height="auto"
+            )
+
     with gr.Row(visible=False) as generate_banner_assets:
         generate_bannerassets_button = gr.Button("Generate banners")
 
@@ -463,8 +514,10 @@ with gr.Blocks() as ui_demo_tab_bannergen:
         global selected_bannertemplate_list
         selected_bannertemplate_list = selected_bannertemplates
 
-        print(
-            f"Selected Visual Segment - {selected_visual_segment_list}; Banner Templates - {selected_bannertemplate_list}"
+        logger.debug(
+            "Selected visual segments %s, banner templates %s",
+            selected_visual_segment_list,
+            selected_bannertemplate_list,
         )
 
         return
@@ -496,6 +549,39 @@ with gr.Blocks() as ui_demo_tab_bannergen:
         outputs=[generate_banner_assets, review_banner_assets],
     )
 
+    visual_segment_dropdown.change(
+        list_preview_actors,
+        inputs=[visual_segment_dropdown],
+        outputs=[preview_actor_dropdown],
+    )
+
+    # Low resolution preview while editing, full resolution only on generation.
+    preview_inputs = [
+        text_header1_input,
+        text_header2_input,
+        text_details_input,
+        text_highlight1_input,
+        text_highlight3_input,
+        text_tagline_input,
+        text_action_input,
+        logo_path_input,
+        graphic1_path_input,
+        graphic2_path_input,
+        graphic_highlight2_path_input,
+    ]
+    gr.on(
+        triggers=[
+            bannertemplate_dropdown.change,
+            preview_actor_dropdown.change,
+            *[component.change for component in preview_inputs],
+        ],
+        fn=preview_banner,
+        inputs=[bannertemplate_dropdown, preview_actor_dropdown, *preview_inputs],
+        outputs=[preview_gallery],
+        trigger_mode="always_last",
+        show_progress="hidden",
+    )
+
     # Event listener for the "Generate Visual Assets" button
     generate_bannerassets_button.click(
         fn=lambda: gr.update(visible=True), outputs=review_banner_assets
@@ -515,6 +601,8 @@ with gr.Blocks() as ui_demo_tab_bannergen:
             graphic1_path_input,
             graphic2_path_input,
             graphic_highlight2_path_input,
+            rendition_input,
+            encoding_input,
         ],
         outputs=[
             banner_gallery,
@@ -530,12 +618,12 @@ with gr.Blocks() as ui_demo_tab_bannergen:
         outputs=[success_banner_assets, banner_prompt_text],
     )
 
-    def update_dropdown():  # No input needed here
+    async def update_dropdown():  # No input needed here
         """
         This function updates the choices of the visual_segment_dropdown.
         """
         return gr.Dropdown(
-            choices=fetch_visual_segment_names(db),
+            choices=await fetch_visual_segment_names_async(db),
             label="Select Visual Segment",
             multiselect=True,
         )
@@ -543,3 +631,11 @@ with gr.Blocks() as ui_demo_tab_bannergen:
     preprocess_visualsegments_button.click(
         fn=update_dropdown, outputs=visual_segment_dropdown
     )
+
+    gr.on(
+        triggers=[actor_status_timer.tick, visual_segment_dropdown.change],
+        fn=actor_processing_status,
+        inputs=visual_segment_dropdown,
+        outputs=actor_status,
+        show_progress="hidden",
+    )
@@ -1,38 +1,50 @@
 """Callback functions for event listeners."""
 
-import base64
-import datetime
+import contextlib
+import hashlib
 import io
+import json
+import logging
 import os
 import shutil
-from string import ascii_letters
+import threading
+import time
 
 import gradio as gr
 import numpy as np
 from gradio_image_annotation import image_annotator
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 
 import generative_banner.constants as C
 from generative_banner.config import settings
 from generative_banner.database import db
-from generative_banner.model import SegmentProfile
-from generative_banner.utils.firestore import (
-    add_or_update_bannertemplate,
-    add_or_update_visual_segment,
-    fetch_visual_segment_names,
-    get_bannertemplate_config_by_name,
-    get_template_configuration,
-    get_visual_segment_config_by_name,
+from generative_banner.jobs import (
+    get_job_queue,
+    job_id,
+    list_processed_actors,
+    list_unprocessed_actors,
+    wait_for_job,
 )
-from generative_banner.utils.imagen import (
-    generate_imagen_outputs,
-    remove_background,
-    rewrite_prompt,
+from generative_banner.model import Campaign, Job, SegmentProfile
+from generative_banner.render import (
+    collect_banner_inputs,
+    get_render_plan,
+    load_image,
 )
-from generative_banner.utils.io import (
-    find_files_with_prefix,
-    get_filepath_in_folder_nested,
+from generative_banner.utils.firestore import (
+    add_or_update_bannertemplate_async,
+    add_or_update_visual_segment_async,
+    fetch_visual_segment_names_async,
+    get_bannertemplate_config_by_name,
+    get_bannertemplate_config_by_name_async,
+    get_template_configuration_async,
+    get_visual_segment_config_by_name_async,
 )
+from generative_banner.utils.phash import get_actor_index
+from generative_banner.utils.storage import get_storage, local_copy, move_file
+from generative_banner.utils.tracing import traced
+
+logger = logging.getLogger(__name__)
 
 
 def _get_image_files(dir: str):
@@ -62,13 +74,13 @@ def _update_thumbnails(selected_folder):
 
 def display_image(evt: gr.SelectData):
     global gallery_dirname_list
-    print(f"all_thumbnails positional data {gallery_dirname_list[evt.index]}")
+    logger.debug("Displaying image %s", gallery_dirname_list[evt.index])
     return Image.open(gallery_dirname_list[evt.index])
 
 
 def select_folder(selected_files):
     global gallery_dirname_list
-    print(f"Selection - {selected_files}")
+    logger.debug("Selected files %s", selected_files)
 
     if selected_files:
         dirnames = []
@@ -95,7 +107,7 @@ def select_folder(selected_files):
     return None, None  # Return None if no files are selected
 
 
-def update_segment_config(name: str):
+async def update_segment_config(name: str):
     """Updates frontend inputs for a visual segment.
 
     Args:
@@ -104,15 +116,13 @@ def update_segment_config(name: str):
     Returns:
        Values of all segment attributes and the selected name itself for UI updates.
     """
-    global db
-
-    config = get_visual_segment_config_by_name(db, name)
+    config = await get_visual_segment_config_by_name_async(db, name)
     profile = SegmentProfile(**config)
 
     return tuple(profile.model_dump().values())
 
 
-def create_new_segment(
+async def create_new_segment(
     age: str,
     background: str,
     clothing: str,
@@ -129,12 +139,10 @@ def create_new_segment(
     Returns:
         Updated selected segment state and the segment dropdown.
     """
-    global db
-
     if (not name) or name == "":
         raise gr.Error(f"Visual segment is empty!", duration=3)
 
-    existing_segments = fetch_visual_segment_names(db)
+    existing_segments = await fetch_visual_segment_names_async(db)
     if name in existing_segments:
         raise gr.Error(f"Visual segment '{name}' already exists!", duration=3)
 
@@ -147,19 +155,27 @@ def create_new_segment(
         theme=theme,
         visualsegment=name,
     )
-    add_or_update_visual_segment(db, new_profile.model_dump())
+    await add_or_update_visual_segment_async(db, new_profile.model_dump())
     gr.Info(f"New segment '{name}' saved!", duration=5)
 
-    updated_segments = fetch_visual_segment_names(db)
+    updated_segments = await fetch_visual_segment_names_async(db)
 
     return name, gr.Dropdown(choices=updated_segments)
 
 
-def _generate_image_filename(directory, image_count):
-    now = datetime.datetime.now()
-    datetime_str = now.strftime("%d%m%H%M%S")
-    filename = f"{directory}_{image_count}_{datetime_str}.png"
-    return filename
+def _wait_for_job(job: Job, progress) -> Job:
+    """Shows the progress of a job until it finishes, raising its error if it failed."""
+
+    def on_progress(job):
+        if job.status == C.JobStatus.QUEUED:
+            progress(0, desc="Waiting for a job worker...")
+        else:
+            progress(job.progress, desc=job.message or "Running...")
+
+    job = wait_for_job(job.id, on_progress)
+    if job.status == C.JobStatus.FAILED:
+        raise gr.Error(f"Job {job.id} failed: {job.error}")
+    return job
 
 
 def generate_assets(
@@ -173,6 +189,7 @@ def generate_assets(
     aspectratio,
     model,
     selected_visual_segment,
+    progress=gr.Progress(),
 ):
     """Generates images given visual segment attributes."""
 
@@ -181,6 +198,7 @@ def generate_assets(
         [],
         gr.update(value="Processing...", interactive=False),
         None,
+        gr.update(visible=False),
     )
 
     segment_profile = SegmentProfile(
@@ -192,122 +210,228 @@ def generate_assets(
         theme=theme,
         visualsegment=selected_visual_segment,
     )
-
-    print(f"User Input : {segment_profile.prompt()}")
-
-    imagen_prompt = rewrite_prompt(segment_profile)
-
-    print(f"Generated prompt:")
-    print(imagen_prompt)
-
-    image_list = generate_imagen_outputs(imagen_prompt, imagecount, aspectratio, model)
-
-    # Save in temp folder
-    LOCAL_TEMP_DIR = "/tmp"
-    image_file_dir = os.path.join(LOCAL_TEMP_DIR, selected_visual_segment)
-    print(
-        f"Retrieved {len(image_list)} images to be saved in in image_file_dir - {image_file_dir}"
+    params = {
+        "segment": segment_profile.model_dump(),
+        "number_of_images": imagecount,
+        "aspect_ratio": aspectratio,
+        "model": model,
+    }
+    # Generated again on each click, since the images differ, but not twice at once.
+    # A click shortly after the same generation succeeded, e.g. after a disconnect,
+    # shows its staged images rather than paying for new ones.
+    queue = get_job_queue()
+    staging = get_storage(settings.local_tmp_dir)
+    job = queue.get(job_id(C.JobKind.GENERATE_ASSETS, params))
+    reuse = (
+        job is not None
+        and job.status == C.JobStatus.SUCCEEDED
+        and time.time() - job.updated_at < settings.job_reuse_seconds
+        and all(staging.exists(key) for key in job.result["keys"])
     )
-
-    if os.path.exists(image_file_dir):
-        shutil.rmtree(image_file_dir)  # Delete the existing directory and its contents
-    os.makedirs(image_file_dir)  # Recreate the directory
-
-    # Convert GeneratedImage object
-    processed_images = []
-    image_count = 1
-    for generated_image in image_list:
-        generated_image_data = base64.b64decode(generated_image._as_base64_string())
-        pil_image = Image.open(io.BytesIO(generated_image_data))
-        pil_file = os.path.join(
-            image_file_dir,
-            _generate_image_filename(selected_visual_segment, image_count),
+    if reuse:
+        gr.Info(
+            f"Showing the images generated {time.time() - job.updated_at:.0f} "
+            "seconds ago for the same attributes.",
+            duration=5,
         )
-        pil_image.save(os.path.join(pil_file), "PNG")
-        print(f"Saved image {image_count} @ {pil_file}")
-        processed_images.append(pil_image)  # Add the PIL Image to the list
-        image_count += 1
+    else:
+        job = queue.submit(C.JobKind.GENERATE_ASSETS, params, rerun=True)
+    job = _wait_for_job(job, progress)
+
+    # Images without a local file are shown from their content.
+    processed_images = [
+        staging.local_path(key) or Image.open(io.BytesIO(staging.read_bytes(key)))
+        for key in job.result["keys"]
+    ]
 
     yield (
         processed_images,
         gr.update(value="Generate visuals", interactive=True),
-        gr.Markdown(imagen_prompt),
+        gr.Markdown(job.result["prompt"]),
+        _duplicate_choices(dict(zip(job.result["keys"], processed_images))),
     )
 
 
-def move_images_to_library(selected_segment: str) -> None:
-    """Moves generated images from temporary dir to local artefacts dir.
+def _duplicate_choices(images: dict) -> dict:
+    """Lists the generated images that are near-duplicates, for the user to keep.
+
+    Args:
+        images: Dict of (staging key -> file path or image).
+
+    Returns:
+        Update of the checkbox group of the duplicates, hidden if there are none.
+    """
+    with contextlib.ExitStack() as stack:
+        opened = {
+            key: stack.enter_context(Image.open(image))
+            if isinstance(image, str)
+            else image
+            for key, image in images.items()
+        }
+        matches = get_actor_index().matches(opened)
+    choices = [
+        (f"{os.path.basename(key)} (like {os.path.basename(original)})", key)
+        for key, original in matches.items()
+    ]
+    return gr.update(choices=choices, value=[], visible=bool(choices))
+
+
+@traced()
+def move_images_to_library(
+    selected_segment: str, kept_keys: list[str] | None = None
+) -> None:
+    """Moves generated images from the staging storage to the artefacts storage.
 
     Args:
         selected_segment: Name of the selected segment.
+        kept_keys: Staging keys of the near-duplicates the user chose to keep, the
+            other near-duplicates are flagged and skipped by preprocessing and banners.
     """
-    source_folder = os.path.join(settings.local_tmp_dir, selected_segment)
-    destination_folder = os.path.join(
-        settings.local_artefacts_dir, settings.local_actor_dirname, selected_segment
+    staging = get_storage(settings.local_tmp_dir)
+    library = get_storage(settings.local_artefacts_dir)
+    keys = staging.list_files(f"{selected_segment}/")
+    moved_keys = []
+    kept_keys = {f"{settings.local_actor_dirname}/{key}" for key in kept_keys or []}
+    for key in keys:
+        target_key = f"{settings.local_actor_dirname}/{key}"
+        move_file(staging, key, library, target_key)
+        logger.debug("Moved asset from %s to %s", key, target_key)
+        moved_keys.append(target_key)
+
+    source_folder = staging.local_path(selected_segment)
+    if source_folder is not None and os.path.isdir(source_folder):
+        shutil.rmtree(source_folder)  # Remove the now empty staging folder
+    logger.info(
+        "Moved %d images of %s to the Marketing Library", len(keys), selected_segment
     )
-    print(f"Move images - source {source_folder}, target {destination_folder}!")
-
-    # Check if the destination folder exists
-    if os.path.exists(destination_folder):
-        # Loop through all files and subdirectories in the source folder
-        for item in os.listdir(source_folder):
-            s = os.path.join(source_folder, item)
-            d = os.path.join(destination_folder, item)
-
-            # If the item is a file, move it
-            if os.path.isfile(s):
-                shutil.move(s, d)
-                print(f"Moving asset from {s} to {d}")
-            # If the item is a directory, use shutil.move for the whole subdirectory
-            elif os.path.isdir(s):
-                shutil.move(s, d)
-
-        # Remove the source folder (now empty)
-        shutil.rmtree(source_folder)
-        print(f"Files moved and source folder '{source_folder}' deleted.")
-    else:
-        # If the destination doesn't exist, simply move the whole source folder
-        shutil.move(source_folder, destination_folder)
-        print(
-            f"Images moved to Marketing Library successfully into {destination_folder}!"
+
+    # Images moved to a bucket are downloaded for the index and the job workers.
+    moved_paths = {
+        key: local_copy(library, key, settings.local_artefacts_dir)
+        for key in moved_keys
+    }
+    duplicates = get_actor_index().update(
+        list(moved_paths.values()),
+        keep=[path for key, path in moved_paths.items() if key in kept_keys],
+    )
+    if duplicates:
+        gr.Info(
+            f"{len(duplicates)} of the {len(keys)} images are near-duplicates you "
+            "did not keep, they are skipped by preprocessing and banners.",
+            duration=5,
         )
+    moved_keys = [
+        key
+        for key, path in moved_paths.items()
+        if os.path.normpath(path) not in duplicates
+    ]
 
+    # Backgrounds are removed by a job worker while the user carries on, rather than
+    # all at once when pressing "Preprocess".
+    if moved_keys:
+        get_job_queue().submit(
+            C.JobKind.REMOVE_BACKGROUND, {"keys": sorted(moved_keys)}
+        )
+    _forget_actor_names()
 
-def preprocess_assets_in_library(progress=gr.Progress()):
-    LOCAL_OUTPUT_DIR_ACTOR = os.path.join(
-        settings.local_artefacts_dir, settings.local_actor_processed_dirname
+
+_actor_names_lock = threading.Lock()
+_actor_names: tuple[float, dict[str, list[str]]] | None = None
+
+
+def _forget_actor_names() -> None:
+    """Lists the actors again on the next status, e.g. after adding some."""
+    global _actor_names
+    with _actor_names_lock:
+        _actor_names = None
+
+
+def _list_actor_names(max_age: float) -> dict[str, list[str]]:
+    """Lists the names of the actors by status, shared by all the open tabs.
+
+    Args:
+        max_age: Seconds during which the names listed by another call are reused.
+
+    Returns:
+        Dict of (status -> file names) for the `processed`, `pending` and
+        `duplicates` actors.
+    """
+    global _actor_names
+    with _actor_names_lock:
+        if _actor_names is None or time.monotonic() - _actor_names[0] > max_age:
+            names = {
+                "processed": list_processed_actors(),
+                "pending": list_unprocessed_actors(),
+                "duplicates": list(get_actor_index().duplicates()),
+            }
+            names = {
+                status: [os.path.basename(path).removeprefix("NoBg_") for path in paths]
+                for status, paths in names.items()
+            }
+            _actor_names = (time.monotonic(), names)
+        return _actor_names[1]
+
+
+def actor_processing_status(visual_segments: list[str] | None = None) -> str:
+    """Counts the actors with and without their background removed.
+
+    The actors are listed at most once per `settings.actor_status_interval`, however
+    many tabs poll the status.
+
+    Args:
+        visual_segments: Segments to count the actors of, all segments if empty.
+
+    Returns:
+        Markdown of the counts.
+    """
+    prefixes = tuple(visual_segments or [""])
+    names = _list_actor_names(settings.actor_status_interval)
+    n_processed, n_pending, n_duplicates = (
+        sum(name.startswith(prefixes) for name in names[status])
+        for status in ("processed", "pending", "duplicates")
     )
+    status = f"**Actors ready:** {n_processed} processed"
+    if n_pending:
+        status += f", {n_pending} pending background removal"
+    if n_duplicates:
+        status += f", {n_duplicates} near-duplicates skipped"
+    return status
+
 
-    progress(0.1, desc="Step 1: Checking for unprocessed assets...")
+def keep_duplicate_actors(selected_files: list[str] | None) -> None:
+    """Keeps the selected near-duplicate actors, and removes their backgrounds.
 
-    list_input_files = get_filepath_in_folder_nested(
-        os.path.join(settings.local_artefacts_dir, settings.local_actor_dirname)
+    Args:
+        selected_files: Paths selected in the library explorer.
+    """
+    index = get_actor_index()
+    duplicates = index.duplicates()
+    paths = [
+        os.path.normpath(path)
+        for path in selected_files or []
+        if os.path.normpath(path) in duplicates
+    ]
+    if not paths:
+        gr.Warning("None of the selected files is a near-duplicate actor.")
+        return
+    index.keep(paths)
+    keys = sorted(
+        os.path.relpath(path, settings.local_artefacts_dir).replace(os.sep, "/")
+        for path in paths
     )
-    unprocessed_input_files = []
-    print(list_input_files)
-    for input_path in list_input_files:
-        input_file = os.path.basename(input_path)
-        output_path = os.path.join(LOCAL_OUTPUT_DIR_ACTOR, f"NoBg_{input_file}")
-        if os.path.exists(output_path):
-            print(f"The file {output_path} exists.")
-        else:
-            print(f"The file {output_path} does not exist.")
-            unprocessed_input_files.append(input_path)
-
-    count_unprocessed = len(unprocessed_input_files)
-    count_processed = 1
-    for input_path in unprocessed_input_files:
-        progress(
-            round((count_processed / count_unprocessed) * 0.8, 2),
-            desc="Step 2: Processing unprocessed assets...",
-        )
-        input_file = os.path.basename(input_path)
-        output_path = os.path.join(LOCAL_OUTPUT_DIR_ACTOR, f"NoBg_{input_file}")
-        mask_path = os.path.join(LOCAL_OUTPUT_DIR_ACTOR, f"Mask_{input_file}")
-        remove_background(input_path, output_path, mask_path)
-        count_processed += 1
+    get_job_queue().submit(C.JobKind.REMOVE_BACKGROUND, {"keys": keys})
+    _forget_actor_names()
+    gr.Info(f"Kept {len(paths)} actors, their backgrounds are being removed.")
 
-    progress(0.95, desc="Step 3: Almost done...")
+
+@traced()
+def preprocess_assets_in_library(progress=gr.Progress()):
+    # Run again on each click, assets may have been added since the last run.
+    job = get_job_queue().submit(C.JobKind.REMOVE_BACKGROUND, {}, rerun=True)
+    _wait_for_job(job, progress)
+    _forget_actor_names()
+
+    progress(0.95, desc="Almost done...")
 
     return (
         gr.update(
@@ -320,7 +444,9 @@ def preprocess_assets_in_library(progress=gr.Progress()):
     )
 
 
-def create_bounding_box_annotator(image_data: list[dict], key: str) -> image_annotator:
+async def create_bounding_box_annotator(
+    image_data: list[dict], key: str
+) -> image_annotator:
     """Creates annotator with colored bounding boxes.
 
     Args:
@@ -330,21 +456,17 @@ def create_bounding_box_annotator(image_data: list[dict], key: str) -> image_ann
     Returns:
         Image annotator UI component.
     """
-    global db
-
     annotator = image_annotator(
         value={
             "image": image_data.get(key),
-            "boxes": get_template_configuration(db, key),
+            "boxes": await get_template_configuration_async(db, key),
         },
     )
     return annotator
 
 
-def save_template_configuration(annotations: dict, template_name: str) -> dict:
-    global db
-
-    result = get_bannertemplate_config_by_name(db, template_name)
+async def save_template_configuration(annotations: dict, template_name: str) -> dict:
+    result = await get_bannertemplate_config_by_name_async(db, template_name)
     elements = annotations["boxes"]
     for element in elements:
         label = element["label"]
@@ -356,410 +478,168 @@ def save_template_configuration(annotations: dict, template_name: str) -> dict:
             "color": element["color"],
         }
 
-    add_or_update_bannertemplate(db, result)
+    await add_or_update_bannertemplate_async(db, result)
+    _template_configs.pop(template_name, None)
 
     return result
 
 
-def _generate_banner_filename(visual_segment, image_count):
-    now = datetime.datetime.now()
-    datetime_str = now.strftime("%d%m%H%M%S")
-    filename = f"{visual_segment}_{image_count}_{datetime_str}.png"
-    return filename
-
-
-def _place_image_overlay_on_background(
-    overlay_image_path, background_image_path, overlay_config, output_path
-):
-    # Placement config
-    target_x = overlay_config["x"]
-    target_y = overlay_config["y"]
-    target_width = overlay_config["width"]
-    target_height = overlay_config["height"]
-
-    # Open images
-    background_image = Image.open(background_image_path).convert("RGBA")
-    overlay_image = Image.open(overlay_image_path).convert("RGBA")
-
-    # Calculate aspect ratio
-    overlay_image_aspect_ratio = overlay_image.width / overlay_image.height
+def _collect_banner_inputs(
+    text_header1_input,
+    text_header2_input,
+    text_details_input,
+    text_highlight1_input,
+    text_highlight3_input,
+    text_tagline_input,
+    text_action_input,
+    logo_path_input,
+    graphic1_path_input,
+    graphic2_path_input,
+    graphic_highlight2_path_input,
+) -> tuple[dict, dict]:
+    """Collects the non-empty banner inputs.
 
-    print(
-        f"Original size of overlay image {overlay_image_path}, Aspect Ratio - {overlay_image_aspect_ratio}, Size - {background_image.size}"
+    Returns:
+        Image layer paths and texts by layer, for :func:`render.compile_render_plan`.
+    """
+    return collect_banner_inputs(
+        {
+            "logo": logo_path_input,
+            "graphic1": graphic1_path_input,
+            "graphic2": graphic2_path_input,
+            "graphic_highlight2": graphic_highlight2_path_input,
+        },
+        {
+            "text_header1": text_header1_input,
+            "text_header2": text_header2_input,
+            "text_details": text_details_input,
+            "text_highlight1": text_highlight1_input,
+            "text_highlight3": text_highlight3_input,
+            "text_tagline": text_tagline_input,
+            "text_action": text_action_input,
+        },
     )
 
-    # Resize to meet target height, maintaining aspect ratio, using LANCZOS
-    new_width = int(target_height * overlay_image_aspect_ratio)
-    resized_overlay_image = overlay_image.resize(
-        (new_width, target_height), Image.LANCZOS
-    )
-    print(f"Resized overlay image to Size - {resized_overlay_image.size}")
 
-    # Check if resized width exceeds target width, and resize again if needed
-    if new_width > target_width:
-        new_height = int(target_width / overlay_image_aspect_ratio)
-        resized_overlay_image = overlay_image.resize(
-            (target_width, new_height), Image.LANCZOS
-        )
-        print(
-            f"Width exceeds boundary, adjusting overlay image with width / height - {target_width} / {new_height} to Size - {resized_overlay_image.size}"
-        )
+# Template documents by name, cached for the live preview.
+_template_configs: dict[str, dict] = {}
 
-    # Calculate centered coordinates
-    final_x = target_x + (target_width - resized_overlay_image.width) // 2
-    final_y = target_y + (target_height - resized_overlay_image.height) // 2
 
-    # Paste actor image onto background
-    background_image.paste(
-        resized_overlay_image, (final_x, final_y), resized_overlay_image
-    )  # Use mask for transparency
+def _get_cached_template_config(name: str) -> dict:
+    if name not in _template_configs:
+        _template_configs[name] = get_bannertemplate_config_by_name(db, name)
+    return _template_configs[name]
 
-    # Save the result (optional)
-    background_image.save(output_path)  # Save as PNG to preserve transparency
 
-    return background_image
+def list_preview_actors(visual_segments: list[str] | None) -> gr.Dropdown:
+    """Lists the processed actors of the selected segments for the preview.
 
+    Args:
+        visual_segments: Names of the selected visual segments.
 
-def _get_font_metrics(font):
-    ascent, descent = font.getmetrics()
-    avg_char_width = sum(font.getbbox(char)[2] for char in ascii_letters) / len(
-        ascii_letters
+    Returns:
+        The actor dropdown, with the first actor selected.
+    """
+    actors = sorted(
+        key.rpartition("/")[2]
+        for visual_segment in visual_segments or []
+        for key in list_processed_actors(visual_segment)
     )
-    return ascent, descent, avg_char_width
-
-
-def _wrap_text_custom(text, font, max_width):
-    words = text.split()
-    lines = []
-    current_line = []
-    current_width = 0
-
-    for word in words:
-        word_width = font.getbbox(word)[2]
-        space_width = font.getbbox(" ")[2]
-
-        if current_width + word_width <= max_width:
-            current_line.append(word)
-            current_width += word_width + space_width
-        else:
-            if current_line:
-                lines.append(" ".join(current_line))
-            current_line = [word]
-            current_width = word_width + space_width
-
-    if current_line:
-        lines.append(" ".join(current_line))
-
-    return lines
-
-
-def _get_font_size(textarea, text, font_name, pixel_gap=2):
-    text_width, text_height = int(textarea[0]), int(textarea[1])
-
-    for point_size in range(5, 300):
-        font = ImageFont.truetype(font_name, point_size)
-        ascent, descent, avg_char_width = _get_font_metrics(font)
-
-        wrapped_lines = _wrap_text_custom(text, font, text_width)
-
-        total_height = (ascent + descent + pixel_gap) * len(wrapped_lines) - pixel_gap
-
-        if total_height >= text_height:
-            point_size -= 1
-            font = ImageFont.truetype(font_name, point_size)
-            wrapped_lines = _wrap_text_custom(text, font, text_width)
-            break
-
-    return wrapped_lines, point_size
-
-
-def _place_singleline_text_overlay_on_background(
-    overlay_image_path,
-    text,
-    initial_font_size,
-    overlay_config,
-    font_name,
-    text_color,
-    alignment,
-    margin=10,
-):
-    x, y = overlay_config["x"], overlay_config["y"]
-    width, height = overlay_config["width"], overlay_config["height"]
-
-    with Image.open(overlay_image_path) as img:
-        draw = ImageDraw.Draw(img)
-
-        # Function to get text width
-        def get_text_width(font):
-            return draw.textbbox((0, 0), text, font=font)[2]
-
-        # Start with the initial font size and decrease if necessary
-        font_size = initial_font_size
-        font = ImageFont.truetype(font_name, font_size)
-        text_width = get_text_width(font)
-        print(f"Processing text {text} with initial font size {initial_font_size}")
-
-        # Decrease font size until text fits within max_width (including margin)
-        while text_width > (width - 2 * margin) and font_size > 1:
-            print(f"Optimizing fontsize to fit, reducing.. ")
-            font_size -= 1
-            font = ImageFont.truetype(font_name, font_size)
-            text_width = get_text_width(font)
-        print(f"Final text {text} with font size {font_size}")
-
-        # Calculate text position and use Pillow's built-in alignment
-        if alignment == "center":
-            anchor = "mm"  # middle-middle
-            text_x = x + width // 2
-        elif alignment == "right":
-            anchor = "rm"  # right-middle
-            text_x = x + width - margin
-        else:  # left alignment
-            anchor = "lm"  # left-middle
-            text_x = x + margin
-
-        # Calculate vertical position (center of the height)
-        text_y = y + height // 2
-
-        # Draw the text using Pillow's alignment feature
-        draw.text((text_x, text_y), text, font=font, fill=text_color, anchor=anchor)
-
-        # Save the result
-        img.save(overlay_image_path)
-        return img
-
-
-def _place_multiline_text_overlay_on_background(
-    overlay_image_path,
-    text,
-    overlay_config,
-    font_name,
-    text_color,
-    alignment,
-    margin=10,
-):
-    x, y = overlay_config["x"], overlay_config["y"]
-    width, height = overlay_config["width"], overlay_config["height"]
-
-    with Image.open(overlay_image_path) as img:
-        draw = ImageDraw.Draw(img)
-
-        wrapped_lines, font_size = _get_font_size(
-            (width, height), text, font_name, margin
-        )
-        font = ImageFont.truetype(font_name, font_size)
-
-        ascent, descent, _ = _get_font_metrics(font)
-        line_height = ascent + descent + margin
-
-        current_y = y
-        for line in wrapped_lines:
-            if alignment == "center":
-                line_bbox = draw.textbbox((0, 0), line, font=font)
-                line_width = line_bbox[2] - line_bbox[0]
-                line_x = x + (width - line_width) // 2
-            elif alignment == "right":
-                line_bbox = draw.textbbox((0, 0), line, font=font)
-                line_width = line_bbox[2] - line_bbox[0]
-                line_x = x + width - line_width
-            else:  # left alignment
-                line_x = x
-
-            draw.text((line_x, current_y), line, font=font, fill=text_color)
-            current_y += line_height
-
-        # Save the result
-        img.save(overlay_image_path)
-        return img
-
-
-def _create_marketing_banner_baseline(
-    background_path,
-    background_config,
-    image_inputs: dict,
-    text_inputs: dict,
-    output_path,
-):
-    if "actor_position" in background_config and "actor_path" in image_inputs:
-        # Process Actor overlay
-        _place_image_overlay_on_background(
-            image_inputs["actor_path"],
-            background_path,
-            background_config["actor_position"],
-            output_path,
-        )
-
-    if "logo_position" in background_config and "logo_path" in image_inputs:
-        # Process Logo overlay
-        _place_image_overlay_on_background(
-            image_inputs["logo_path"],
-            output_path,
-            background_config["logo_position"],
-            output_path,
-        )
-
-    if "graphic1_position" in background_config and "graphic1_path" in image_inputs:
-        # Process Logo overlay
-        _place_image_overlay_on_background(
-            image_inputs["graphic1_path"],
-            output_path,
-            background_config["graphic1_position"],
-            output_path,
-        )
+    return gr.Dropdown(choices=actors, value=actors[0] if actors else None)
 
-    if "graphic2_position" in background_config and "graphic2_path" in image_inputs:
-        # Process Logo overlay
-        _place_image_overlay_on_background(
-            image_inputs["graphic2_path"],
-            output_path,
-            background_config["graphic2_position"],
-            output_path,
-        )
-
-    if (
-        "graphic_highlight2_position" in background_config
-        and "graphic_highlight2_path" in image_inputs
-    ):
-        # Process Logo overlay
-        _place_image_overlay_on_background(
-            image_inputs["graphic_highlight2_path"],
-            output_path,
-            background_config["graphic_highlight2_position"],
-            output_path,
-        )
-
-    if "text_header1_position" in background_config and "text_header1" in text_inputs:
-        # Process Text Header overlay
-        text_header = text_inputs["text_header1"]
-        text_color = (0, 0, 0)
-        text_alignment = "left"
-        text_margin = 25
-        font_name = C.Font.sans_bold
-        _place_multiline_text_overlay_on_background(
-            output_path,
-            text_header,
-            background_config["text_header1_position"],
-            font_name=font_name,
-            text_color=text_color,
-            alignment=text_alignment,
-            margin=text_margin,
-        )
 
-    if "text_header2_position" in background_config and "text_header2" in text_inputs:
-        # Process Text Header overlay
-        text_header = text_inputs["text_header2"]
-        text_color = (0, 0, 0)
-        text_alignment = "left"
-        text_margin = 25
-        font_name = C.Font.sans_regular
-        _place_multiline_text_overlay_on_background(
-            output_path,
-            text_header,
-            background_config["text_header2_position"],
-            font_name=font_name,
-            text_color=text_color,
-            alignment=text_alignment,
-            margin=text_margin,
-        )
+@traced()
+def preview_banner(
+    bannertemplate_dropdown,
+    preview_actor,
+    text_header1_input,
+    text_header2_input,
+    text_details_input,
+    text_highlight1_input,
+    text_highlight3_input,
+    text_tagline_input,
+    text_action_input,
+    logo_path_input,
+    graphic1_path_input,
+    graphic2_path_input,
+    graphic_highlight2_path_input,
+) -> list[tuple]:
+    """Renders a low resolution banner preview of one actor per template.
 
-    if "text_details_position" in background_config and "text_details" in text_inputs:
-        # Process Text Detail overlay
-        text_header = text_inputs["text_details"]
-        text_color = (0, 0, 0)
-        text_alignment = "left"
-        text_margin = 25
-        font_name = C.Font.sans_regular
-        _place_multiline_text_overlay_on_background(
-            output_path,
-            text_header,
-            background_config["text_details_position"],
-            font_name=font_name,
-            text_color=text_color,
-            alignment=text_alignment,
-            margin=text_margin,
-        )
+    No banner is written to disk. Fonts, assets, template documents and compiled
+    templates are cached, so a text edit only re-renders the texts.
 
-    if (
-        "text_highlight1_position" in background_config
-        and "text_highlight1" in text_inputs
-    ):
-        # Process Text Highlight overlay
-        text_header = text_inputs["text_highlight1"]
-        text_color = (0, 0, 0)
-        text_alignment = "center"
-        text_margin = 5
-        # font_name = "LiberationSansNarrow-Bold.ttf"
-        font_name = C.Font.sans_bold
-        _place_singleline_text_overlay_on_background(
-            output_path,
-            text_header,
-            100,
-            background_config["text_highlight1_position"],
-            font_name=font_name,
-            text_color=text_color,
-            alignment=text_alignment,
-            margin=text_margin,
-        )
+    Returns:
+        Gallery items of (preview image, template name).
+    """
+    if not bannertemplate_dropdown:
+        return []
 
-    if (
-        "text_highlight3_position" in background_config
-        and "text_highlight3" in text_inputs
-    ):
-        # Process Text Highlight overlay
-        text_header = text_inputs["text_highlight3"]
-        text_color = (0, 0, 0)
-        text_alignment = "center"
-        text_margin = 20
-        # font_name = "LiberationSansNarrow-Bold.ttf"
-        font_name = C.Font.sans_bold
-        _place_singleline_text_overlay_on_background(
-            output_path,
-            text_header,
-            120,
-            background_config["text_highlight3_position"],
-            font_name=font_name,
-            text_color=text_color,
-            alignment=text_alignment,
-            margin=text_margin,
-        )
+    LOCAL_INPUT_DIR_BG = os.path.join(settings.local_artefacts_dir, "Background")
 
-    if "text_tagline_position" in background_config and "text_tagline" in text_inputs:
-        # Process Text Tagline overlay
-        text_header = text_inputs["text_tagline"]
-        text_color = (255, 0, 0)
-        text_alignment = "center"
-        text_margin = 25
-        font_name = C.Font.mono_italic
-        _place_singleline_text_overlay_on_background(
-            output_path,
-            text_header,
-            25,
-            background_config["text_tagline_position"],
-            font_name=font_name,
-            text_color=text_color,
-            alignment=text_alignment,
-            margin=text_margin,
+    image_inputs, text_inputs = _collect_banner_inputs(
+        text_header1_input,
+        text_header2_input,
+        text_details_input,
+        text_highlight1_input,
+        text_highlight3_input,
+        text_tagline_input,
+        text_action_input,
+        logo_path_input,
+        graphic1_path_input,
+        graphic2_path_input,
+        graphic_highlight2_path_input,
+    )
+    # Asset names may be incomplete while being typed.
+    image_inputs = {k: v for k, v in image_inputs.items() if os.path.isfile(v)}
+
+    actor = None
+    if preview_actor:
+        actor_key = f"{settings.local_actor_processed_dirname}/{preview_actor}"
+        actor = load_image(
+            local_copy(
+                get_storage(settings.local_artefacts_dir),
+                actor_key,
+                settings.local_artefacts_dir,
+            ),
+            settings.preview_scale,
         )
 
-    if "text_action_position" in background_config and "text_action" in text_inputs:
-        # Process Text Tagline overlay
-        text_header = text_inputs["text_action"]
-        text_color = (255, 255, 255)
-        text_alignment = "center"
-        text_margin = 25
-        font_name = C.Font.mono_bold
-        _place_singleline_text_overlay_on_background(
-            output_path,
-            text_header,
-            35,
-            background_config["text_action_position"],
-            font_name=font_name,
-            text_color=text_color,
-            alignment=text_alignment,
-            margin=text_margin,
+    previews = []
+    for bannertemplate in bannertemplate_dropdown:
+        plan = get_render_plan(
+            f"{LOCAL_INPUT_DIR_BG}/{bannertemplate}.png",
+            _get_cached_template_config(bannertemplate),
+            image_inputs,
+            text_inputs,
+            scale=settings.preview_scale,
         )
-
-    return output_path
+        previews.append((plan.render(actor), bannertemplate))
+
+    return previews
+
+
+def _banner_campaign(
+    visual_segments,
+    bannertemplates,
+    texts,
+    logo,
+    graphics,
+    rendition_names,
+    encoding,
+) -> Campaign:
+    """Creates the campaign of the banner inputs, named after their digest."""
+    fields = {
+        "templates": list(bannertemplates),
+        "segments": list(visual_segments),
+        "texts": {k: v for k, v in texts.items() if v is not None and v.strip()},
+        "logo": logo if logo is not None and logo.strip() else None,
+        "graphics": {k: v for k, v in graphics.items() if v is not None and v.strip()},
+        "renditions": list(rendition_names or []),
+        "encoding": encoding,
+    }
+    digest = hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+    return Campaign(name=f"banners-{digest[:12]}", **fields)
 
 
 def generate_banner(
@@ -776,129 +656,53 @@ def generate_banner(
     graphic1_path_input,
     graphic2_path_input,
     graphic_highlight2_path_input,
+    rendition_names=None,
+    encoding=None,
     progress=gr.Progress(),
 ):
     # Show a "processing" state while generating images
     yield [], gr.update(value="Processing...", interactive=False)
 
-    LOCAL_INPUT_DIR_GRAPHICS = os.path.join(settings.local_artefacts_dir, "Graphics")
-    LOCAL_INPUT_DIR_LOGO = os.path.join(settings.local_artefacts_dir, "Logo")
-    LOCAL_OUTPUT_DIR_ACTOR = os.path.join(
-        settings.local_artefacts_dir, "Actors_Processed"
-    )
-    LOCAL_INPUT_DIR_BG = os.path.join(settings.local_artefacts_dir, "Background")
-    LOCAL_OUTPUT_DIR_BANNER = os.path.join(
-        settings.local_artefacts_dir, settings.local_banner_dirname
+    campaign = _banner_campaign(
+        visual_segment_dropdown,
+        bannertemplate_dropdown,
+        {
+            "text_header1": text_header1_input,
+            "text_header2": text_header2_input,
+            "text_details": text_details_input,
+            "text_highlight1": text_highlight1_input,
+            "text_highlight3": text_highlight3_input,
+            "text_tagline": text_tagline_input,
+            "text_action": text_action_input,
+        },
+        logo_path_input,
+        {
+            "graphic1": graphic1_path_input,
+            "graphic2": graphic2_path_input,
+            "graphic_highlight2": graphic_highlight2_path_input,
+        },
+        rendition_names,
+        encoding,
     )
+    logger.debug("Banner campaign: %s", campaign)
 
-    print(f"""
-        {visual_segment_dropdown},
-        {bannertemplate_dropdown},
-        {text_header1_input},
-        {text_header2_input},
-        {text_details_input},
-        {text_highlight1_input},
-        {text_highlight3_input},
-        {text_tagline_input},
-        {text_action_input},
-        {logo_path_input},
-        {graphic1_path_input},
-        {graphic2_path_input},
-        {graphic_highlight2_path_input}""")
-
-    image_inputs = {}
-
-    if graphic1_path_input is not None and graphic1_path_input.strip() != "":
-        image_inputs["graphic1_path"] = (
-            f"{LOCAL_INPUT_DIR_GRAPHICS}/{graphic1_path_input}"
-        )
-
-    if graphic2_path_input is not None and graphic2_path_input.strip() != "":
-        image_inputs["graphic2_path"] = (
-            f"{LOCAL_INPUT_DIR_GRAPHICS}/{graphic2_path_input}"
-        )
-
-    if (
-        graphic_highlight2_path_input is not None
-        and graphic_highlight2_path_input.strip() != ""
-    ):
-        image_inputs["graphic_highlight2_path"] = (
-            f"{LOCAL_INPUT_DIR_GRAPHICS}/{graphic_highlight2_path_input}"
-        )
+    progress(0.05, desc="Step 1: Checking banner configuration and assets...")
+    job = get_job_queue().submit(
+        C.JobKind.RENDER_BANNERS, campaign.model_dump(), rerun=True
+    )
+    job = _wait_for_job(job, progress)
+    logger.info(
+        "Wrote %d banner outputs, %.0f KiB in total",
+        len(job.result["outputs"]),
+        job.result["n_bytes"] / 1024,
+    )
 
-    if logo_path_input is not None and logo_path_input.strip() != "":
-        image_inputs["logo_path"] = f"{LOCAL_INPUT_DIR_LOGO}/{logo_path_input}"
-
-    text_inputs = {}
-
-    if text_header1_input is not None and text_header1_input.strip() != "":
-        text_inputs["text_header1"] = text_header1_input
-
-    if text_header2_input is not None and text_header2_input.strip() != "":
-        text_inputs["text_header2"] = text_header2_input
-
-    if text_details_input is not None and text_details_input.strip() != "":
-        text_inputs["text_details"] = text_details_input
-
-    if text_highlight1_input is not None and text_highlight1_input.strip() != "":
-        text_inputs["text_highlight1"] = text_highlight1_input
-
-    if text_highlight3_input is not None and text_highlight3_input.strip() != "":
-        text_inputs["text_highlight3"] = text_highlight3_input
-
-    if text_tagline_input is not None and text_tagline_input.strip() != "":
-        text_inputs["text_tagline"] = text_tagline_input
-
-    if text_action_input is not None and text_action_input.strip() != "":
-        text_inputs["text_action"] = text_action_input
-
-    bannertemplate_list = bannertemplate_dropdown
-    visual_segments_list = visual_segment_dropdown
-
-    progress(0.1, desc="Step 1: Checking banner configuration and assets...")
-
-    total_banner_count = 0
-    for bannertemplate in bannertemplate_list:
-        for visual_segment in visual_segments_list:
-            for image_input in find_files_with_prefix(
-                LOCAL_OUTPUT_DIR_ACTOR, f"NoBg_{visual_segment}"
-            ):
-                total_banner_count += 1
-
-    generated_banner_images = []
-    current_banner_count = 0
-    for bannertemplate in bannertemplate_list:
-        background_path = f"{LOCAL_INPUT_DIR_BG}/{bannertemplate}.png"
-        background_config = get_bannertemplate_config_by_name(db, bannertemplate)
-        for visual_segment in visual_segments_list:
-            for image_input in find_files_with_prefix(
-                LOCAL_OUTPUT_DIR_ACTOR, f"NoBg_{visual_segment}"
-            ):
-                current_banner_count += 1
-                progress(
-                    round((current_banner_count / total_banner_count) * 0.9, 2),
-                    desc="Step 2: Generating banners dynamically ...",
-                )
-                image_inputs["actor_path"] = image_input
-                output_filename = _generate_banner_filename(
-                    visual_segment, current_banner_count
-                )
-                output_path = f"{LOCAL_OUTPUT_DIR_BANNER}/{output_filename}"
-                print(
-                    f"Generating banner count {current_banner_count} of {total_banner_count}... {output_path}"
-                )
-                # Create the banner with Actor & Logo overlaid
-                generated_banner_image = _create_marketing_banner_baseline(
-                    background_path,
-                    background_config,
-                    image_inputs,
-                    text_inputs,
-                    output_path,
-                )
-                print(
-                    f"Generated banner count {current_banner_count} of {total_banner_count}... {output_path}"
-                )
-                generated_banner_images.append(generated_banner_image)
+    # Banners without a local file are shown from their content.
+    library = get_storage(settings.local_artefacts_dir)
+    generated_banner_images = [
+        library.local_path(key) or Image.open(io.BytesIO(library.read_bytes(key)))
+        for key in job.result["outputs"]
+    ]
 
     progress(0.95, desc="Step 3: Almost done...")
 
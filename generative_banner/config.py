@@ -8,21 +8,112 @@ class Settings(BaseSettings):
 
     gcp_project: str = ""
     firestore_id: str = "(default)"
+    # Backend of the segment and template documents, one of the
+    # `constants.DocumentBackend` values. With `sqlite` they are in `document_db_path`.
+    document_backend: str = "firestore"
+    document_db_path: str = "./documents.sqlite3"
 
     # This model is used for prompt rewriting.
     # https://ai.google.dev/gemini-api/docs/models/gemini
     text_model: str = "gemini-2.0-flash-lite-001"
+    # Seconds to wait for a prompt rewrite, the unrewritten prompt is used after.
+    prompt_rewrite_timeout: float = 20.0
+    # Whether to send a duplicate rewrite request if the first one is slower than 95%
+    # of the recent ones, or than `prompt_rewrite_hedge_delay` seconds until there
+    # are enough of them.
+    prompt_rewrite_hedging: bool = False
+    prompt_rewrite_hedge_delay: float = 5.0
+
+    # Requests per minute by model name, e.g. {"imagen-3.0-generate-001": 20}, calls
+    # wait for their turn beyond it. Models not listed are not limited.
+    model_rate_limits: dict[str, float] = {}
+    # Calls of a model allowed in a burst, as a number of seconds of its rate.
+    rate_limit_burst_seconds: float = 10.0
+    # SQLite file of the rate limits shared by the processes of a host, limits of
+    # the current process only if blank.
+    rate_limit_db_path: str = "./ratelimit.sqlite3"
 
     # This model is used for background removal.
     u2net_home: str = "./u2net"
+    # Longest side of the image segmented for background removal, the mask is refined
+    # along its edge at full resolution. 0 to segment at full resolution.
+    rembg_working_size: int = 0
+
+    # Number of concurrent transfers of bulk GCS operations.
+    gcs_max_workers: int = 8
+    # Endpoint of a GCS emulator such as fake-gcs-server, e.g. http://localhost:4443
+    gcs_emulator_host: str = ""
+    # Bucket the artefacts folder is synced with on startup, no sync if blank.
+    gcs_artefacts_bucket: str = ""
+    gcs_artefacts_folder: str = "artefacts"
+
+    # Backend of generated images and banners, one of the `constants.StorageBackend`
+    # values. With `gcs` the local folders below map to folders in `storage_bucket`.
+    storage_backend: str = "local"
+    storage_bucket: str = ""
 
     local_artefacts_dir: str = "./artefacts"
     local_tmp_dir: str = "/tmp"
     local_actor_dirname: str = "Actors"
     local_actor_processed_dirname: str = "Actors_Processed"
     local_banner_dirname: str = "Banner_Generated"
+    # SQLite file of the perceptual hashes of the actors, see `utils/phash.py`.
+    actor_index_path: str = "./actor_index.sqlite3"
+    # Maximum number of differing bits, out of 64, for an actor to be flagged as a
+    # near-duplicate of an earlier one and skipped. Negative to flag none.
+    actor_duplicate_distance: int = 6
 
     n_image_generated: int = 3
+    # Seed of the Imagen generations, which makes them deterministic: a repeated
+    # generation of a segment is served from `imagen_cache_dir` rather than paid
+    # again. New images on each generation if None.
+    imagen_seed: int | None = None
+    imagen_cache_dir: str = "./imagen_cache"
+    # Size of the cache above which the least recently used images are evicted.
+    imagen_cache_mib: int = 512
+
+    # Number of threads to resize and encode banner outputs.
+    n_render_workers: int = 4
+    # Default encoding of banner outputs, one of the `constants.Encoding` values.
+    banner_encoding: str = "png"
+    # Memory budget of the actors resized to their template boxes, shared across the
+    # templates of a batch.
+    actor_cache_mib: int = 256
+    # Folder of the decoded pixels of actors, memory mapped by later runs instead of
+    # decoding their PNG files, no store if blank. The pages are shared by processes.
+    actor_pixel_dir: str = ""
+    # Seconds between two refreshes of the actor counts of the banner tab.
+    actor_status_interval: float = 10.0
+    # Scale of the live banner preview relative to the template size.
+    preview_scale: float = 0.25
+
+    # SQLite file of the persistent job queue, see `jobs.py`.
+    job_db_path: str = "./jobs.sqlite3"
+    # Number of job workers started by the app, 0 to only run them separately with
+    # `python -m generative_banner.jobs`.
+    job_workers: int = 1
+    # Seconds after an asset generation succeeded during which the same generation
+    # shows its images again, e.g. after a browser disconnect, rather than a new one.
+    job_reuse_seconds: float = 600.0
+    # Latency budget in seconds of an asset generation, shared by its prompt rewrite,
+    # Imagen call and their waits for the rate limits.
+    generate_assets_budget: float = 90.0
+    # Seconds between two polls of the queue by idle workers and of a job by the UI.
+    job_poll_interval: float = 1.0
+    # Seconds without heartbeat after which a running job is resumed by another worker.
+    job_heartbeat_timeout: float = 120.0
+    # Number of starts after which a job that keeps losing its worker is failed.
+    job_max_attempts: int = 3
+
+    # Level of the package logs, e.g. DEBUG for per-item messages.
+    log_level: str = "INFO"
+    # Minimum number of seconds between two progress logs of a loop.
+    log_progress_interval: float = 5.0
+
+    # Exporter of the timing spans, one of the `constants.TracingExporter` values.
+    tracing_exporter: str = "none"
+    # File the console and JSON exporters append to, stderr if blank.
+    tracing_file: str = ""
 
     # This is for easier background removal if the background is irrelevant.
     default_background: str = "White background"
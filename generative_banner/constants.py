@@ -23,6 +23,57 @@ class ImageModel(str, Enum):
     IMAGEN_4_PREVIEW = "imagen-4.0-generate-preview-06-06"
 
 
+class Rendition(str, Enum):
+    """Preset additional banner output sizes as `<width>x<height>`."""
+
+    SQUARE = "1080x1080"
+    LEADERBOARD = "728x90"
+    APP_POPUP = "720x1280"
+
+
+class Encoding(str, Enum):
+    """Preset banner output encodings, see `ENCODERS` in the `render` module."""
+
+    PNG = "png"
+    PNG_FAST = "png-fast"  # low zlib level for previews
+    PNG_FINAL = "png-final"  # smallest lossless file for export
+    WEBP = "webp"
+    JPEG = "jpeg"
+    AVIF = "avif"
+
+
+class StorageBackend(str, Enum):
+    """Backend of the files written by the app, see the `utils.storage` module."""
+
+    LOCAL = "local"
+    GCS = "gcs"
+    MEMORY = "memory"  # for tests, nothing persists
+
+
+class JobKind(str, Enum):
+    """Kind of a job of the persistent job queue, see the `jobs` module."""
+
+    GENERATE_ASSETS = "generate_assets"
+    REMOVE_BACKGROUND = "remove_background"
+    RENDER_BANNERS = "render_banners"
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class TracingExporter(str, Enum):
+    """Exporter of the timing spans, see the `utils.tracing` module."""
+
+    NONE = "none"
+    CONSOLE = "console"
+    JSON = "json"
+    OTEL = "otel"
+
+
 class BlockName(str, Enum):
     """Gradio block (tab) name."""
 
@@ -33,6 +84,13 @@ class BlockName(str, Enum):
     BANNER = "Banner Generation"
 
 
+class DocumentBackend(str, Enum):
+    """Backend of the segment and template documents, see `utils.documents`."""
+
+    FIRESTORE = "firestore"
+    SQLITE = "sqlite"
+
+
 class DocKey(str, Enum):
     """Document collection keys for Firestore."""
 
@@ -1,7 +1,5 @@
 """Database connection singleton."""
 
-from google.cloud import firestore
+from generative_banner.utils.documents import get_document_store
 
-from generative_banner.config import settings
-
-db = firestore.Client(project=settings.gcp_project, database=settings.firestore_id)
+db = get_document_store()
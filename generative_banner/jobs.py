@@ -0,0 +1,636 @@
+"""Persistent job queue of long-running generations.
+
+Imagen generations, background removals and banner batches run as jobs, so that they
+outlive a browser disconnect or an app restart. The UI submits a job and polls its
+status while workers take jobs from a SQLite queue.
+
+The app starts `settings.job_workers` worker threads. Workers can also run in their
+own processes, on the same `settings.job_db_path`, to be scaled separately:
+
+.. code-block:: bash
+    python -m generative_banner.jobs --workers 2
+
+A job ID is derived from its kind and parameters, so submitting the same job twice,
+e.g. after a disconnect, returns the pending one rather than running it again. A
+running job sends heartbeats. If its worker dies, the job is resumed by another one,
+and handlers skip the work already done.
+"""
+
+import argparse
+import base64
+import contextlib
+import datetime
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+from PIL import Image
+
+import generative_banner.constants as C
+from generative_banner.config import settings
+from generative_banner.model import Campaign, Job, SegmentProfile
+from generative_banner.utils.deadline import deadline
+from generative_banner.utils.log import ProgressLogger, setup_logging
+from generative_banner.utils.phash import get_actor_index
+from generative_banner.utils.storage import get_storage, local_copy, save_local_copy
+from generative_banner.utils.tracing import span
+
+# Named explicitly, the module runs as `__main__`.
+logger = logging.getLogger("generative_banner.jobs")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    heartbeat_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+_FINISHED = (C.JobStatus.SUCCEEDED, C.JobStatus.FAILED)
+
+
+def job_id(kind: str, params: dict) -> str:
+    """Derives the ID of a job from its kind and parameters."""
+    digest = hashlib.sha256(
+        json.dumps([kind, params], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"{kind}-{digest[:16]}"
+
+
+def _to_job(row: sqlite3.Row) -> Job:
+    return Job(
+        id=row["id"],
+        kind=row["kind"],
+        status=row["status"],
+        params=json.loads(row["params"]),
+        progress=row["progress"],
+        message=row["message"],
+        result=json.loads(row["result"]) if row["result"] else None,
+        error=row["error"],
+        attempts=row["attempts"],
+        created_at=row["created_at"],
+        updated_at=row["updated_at"],
+    )
+
+
+class JobQueue:
+    """Job queue in a SQLite file, shared by the processes of the same host.
+
+    Each call uses its own connection, so a queue can be used from any thread.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or settings.job_db_path
+        with contextlib.closing(self._connect()) as conn:
+            # Readers do not block the writer, e.g. the UI polling a running job.
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        try:
+            # Takes the write lock upfront, so that two workers never claim a job.
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def get(self, id: str) -> Job | None:
+        with contextlib.closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (id,)).fetchone()
+        return _to_job(row) if row else None
+
+    def list_jobs(self, status: str | None = None, limit: int = 50) -> list[Job]:
+        """Lists the most recently updated jobs, optionally of a status."""
+        query = "SELECT * FROM jobs"
+        args = []
+        if status is not None:
+            query += " WHERE status = ?"
+            args.append(status)
+        query += " ORDER BY updated_at DESC LIMIT ?"
+        with contextlib.closing(self._connect()) as conn:
+            rows = conn.execute(query, (*args, limit)).fetchall()
+        return [_to_job(row) for row in rows]
+
+    def submit(self, kind: str, params: dict, rerun: bool = False) -> Job:
+        """Queues a job, unless the same one is pending.
+
+        Args:
+            kind: One of the `constants.JobKind` values.
+            params: Keyword arguments of the job handler, JSON serializable.
+            rerun: Whether to run the job again if it already succeeded. A failed job
+                always runs again.
+
+        Returns:
+            The queued job, or the existing one.
+        """
+        kind = C.JobKind(kind).value
+        id = job_id(kind, params)
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (id,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, status, params, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (id, kind, C.JobStatus.QUEUED, json.dumps(params), now, now),
+                )
+            elif row["status"] == C.JobStatus.FAILED or (
+                row["status"] == C.JobStatus.SUCCEEDED and rerun
+            ):
+                conn.execute(
+                    "UPDATE jobs SET status = ?, progress = 0, message = NULL, "
+                    "result = NULL, error = NULL, attempts = 0, worker = NULL, "
+                    "created_at = ?, updated_at = ? WHERE id = ?",
+                    (C.JobStatus.QUEUED, now, now, id),
+                )
+        logger.info("Submitted job %s", id)
+        return self.get(id)
+
+    def claim(self, worker: str) -> Job | None:
+        """Starts the oldest queued job, if any, on a worker."""
+        now = time.time()
+        stale = now - settings.job_heartbeat_timeout
+        with self._transaction() as conn:
+            # Jobs of dead workers are resumed, unless they keep losing their worker.
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (
+                    C.JobStatus.FAILED,
+                    "Worker lost too many times",
+                    now,
+                    C.JobStatus.RUNNING,
+                    stale,
+                    settings.job_max_attempts,
+                ),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? "
+                "WHERE status = ? AND heartbeat_at < ?",
+                (C.JobStatus.QUEUED, now, C.JobStatus.RUNNING, stale),
+            )
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (C.JobStatus.QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, "
+                "heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                (C.JobStatus.RUNNING, worker, now, now, row["id"]),
+            )
+        return self.get(row["id"])
+
+    def _update_running(self, id: str, worker: str, **values) -> None:
+        # A job resumed by another worker is no longer updated by the lost one.
+        columns = ", ".join(f"{column} = ?" for column in values)
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ? AND worker = ? AND status = ?",
+                (*values.values(), id, worker, C.JobStatus.RUNNING),
+            )
+
+    def heartbeat(self, id: str, worker: str) -> None:
+        self._update_running(id, worker, heartbeat_at=time.time())
+
+    def set_progress(
+        self, id: str, worker: str, progress: float, message: str | None = None
+    ) -> None:
+        now = time.time()
+        self._update_running(
+            id, worker, progress=progress, message=message, heartbeat_at=now
+        )
+
+    def complete(self, id: str, worker: str, result: dict) -> None:
+        self._update_running(
+            id,
+            worker,
+            status=C.JobStatus.SUCCEEDED,
+            progress=1.0,
+            message=None,
+            result=json.dumps(result),
+            updated_at=time.time(),
+        )
+
+    def fail(self, id: str, worker: str, error: str) -> None:
+        self._update_running(
+            id, worker, status=C.JobStatus.FAILED, error=error, updated_at=time.time()
+        )
+
+
+@functools.cache
+def get_job_queue() -> JobQueue:
+    """Returns the job queue of `settings.job_db_path`."""
+    return JobQueue()
+
+
+def wait_for_job(id: str, on_progress=None, queue: JobQueue | None = None) -> Job:
+    """Polls a job until it finishes.
+
+    Args:
+        id: ID of the job.
+        on_progress: Called with each polled unfinished job, e.g. to show its progress.
+        queue: Queue of the job, defaults to :func:`get_job_queue`.
+
+    Returns:
+        The finished job, either succeeded or failed.
+    """
+    queue = queue or get_job_queue()
+    job = queue.get(id)
+    while job.status not in _FINISHED:
+        if on_progress is not None:
+            on_progress(job)
+        time.sleep(settings.job_poll_interval)
+        job = queue.get(id)
+    return job
+
+
+class JobContext:
+    """Running job passed to its handler, to report its progress."""
+
+    def __init__(self, queue: JobQueue, job: Job, worker: str):
+        self.queue = queue
+        self.job = job
+        self.worker = worker
+
+    @property
+    def resumed(self) -> bool:
+        """Whether the job was started before by a worker that died."""
+        return self.job.attempts > 1
+
+    def progress(self, progress: float, message: str | None = None) -> None:
+        self.queue.set_progress(self.job.id, self.worker, progress, message)
+
+
+def _generate_image_filename(directory, image_count):
+    now = datetime.datetime.now()
+    datetime_str = now.strftime("%d%m%H%M%S")
+    filename = f"{directory}_{image_count}_{datetime_str}.png"
+    return filename
+
+
+def _generate_assets(
+    ctx: JobContext,
+    segment: dict,
+    number_of_images: int,
+    aspect_ratio: str,
+    model: str,
+) -> dict:
+    # Imported here, only workers need the model clients.
+    from generative_banner.utils.imagen import generate_imagen_outputs, rewrite_prompt
+
+    segment_profile = SegmentProfile(**segment)
+    logger.info("User input: %s", segment_profile.prompt())
+
+    # The model calls and their waits for the rate limits share the budget. The
+    # prompt rewrite falls back to the unrewritten prompt, Imagen fails the job.
+    with deadline(settings.generate_assets_budget):
+        ctx.progress(0.1, "Rewriting the prompt...")
+        imagen_prompt = rewrite_prompt(segment_profile, seed=settings.imagen_seed)
+        logger.info("Generated prompt: %s", imagen_prompt)
+
+        ctx.progress(0.3, "Generating images...")
+        image_list = generate_imagen_outputs(
+            imagen_prompt, number_of_images, aspect_ratio, model, settings.imagen_seed
+        )
+
+    # Stage the images until they are moved to the library
+    staging = get_storage(settings.local_tmp_dir)
+    folder = segment_profile.visualsegment
+    logger.info(
+        "Retrieved %d images to be staged in %s/%s",
+        len(image_list),
+        settings.local_tmp_dir,
+        folder,
+    )
+    staging.delete_many(staging.list_files(f"{folder}/"))
+
+    keys = []
+    for image_count, generated_image in enumerate(image_list, start=1):
+        with span("image.decode"):
+            generated_image_data = base64.b64decode(generated_image._as_base64_string())
+            pil_image = Image.open(io.BytesIO(generated_image_data))
+        image_key = f"{folder}/{_generate_image_filename(folder, image_count)}"
+        with span("image.save", key=image_key):
+            if pil_image.format == "PNG":
+                # Already encoded as PNG, stored as is rather than re-encoded.
+                staging.write_bytes(image_key, generated_image_data)
+            else:
+                with staging.open(image_key, "wb") as f:
+                    pil_image.save(f, "PNG")
+        logger.debug("Saved image %d @ %s", image_count, image_key)
+        keys.append(image_key)
+
+    return {"prompt": imagen_prompt, "keys": keys}
+
+
+def _processed_actor_key(key: str) -> str:
+    return f"{settings.local_actor_processed_dirname}/NoBg_{key.rpartition('/')[2]}"
+
+
+def _local_actor_path(key: str) -> str:
+    # Path of an actor of the artefacts storage on the local filesystem, or of its
+    # local copy, see `local_copy`. Also the path in the actor index.
+    return os.path.normpath(os.path.join(settings.local_artefacts_dir, *key.split("/")))
+
+
+def list_processed_actors(prefix: str = "") -> list[str]:
+    """Lists the actors of the library with their background removed.
+
+    Args:
+        prefix: Prefix of the actor names, e.g. a segment name.
+
+    Returns:
+        Keys of the processed actors in the artefacts storage.
+    """
+    library = get_storage(settings.local_artefacts_dir)
+    return library.list_files(f"{settings.local_actor_processed_dirname}/NoBg_{prefix}")
+
+
+def list_unprocessed_actors(keys: list[str] | None = None) -> list[str]:
+    """Lists the actors of the library without their background removed yet.
+
+    Args:
+        keys: Keys of the actors to check, all the actors of the library if None.
+
+    Returns:
+        Keys of the unprocessed actors, but the ones flagged near-duplicates.
+    """
+    library = get_storage(settings.local_artefacts_dir)
+    actors = [
+        key
+        for key in library.list_files(f"{settings.local_actor_dirname}/")
+        if key.endswith(".png")
+    ]
+    if keys is not None:
+        existing = set(actors)
+        actors = [key for key in keys if key in existing]
+    processed = set(library.list_files(f"{settings.local_actor_processed_dirname}/"))
+    duplicates = get_actor_index().duplicates()
+    return [
+        key
+        for key in actors
+        if _processed_actor_key(key) not in processed
+        and _local_actor_path(key) not in duplicates
+    ]
+
+
+def _create_claim(claim_path: str) -> bool:
+    try:
+        os.close(os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        pass
+    # The claim of a job that lost its worker expires.
+    try:
+        if time.time() - os.stat(claim_path).st_mtime < settings.job_heartbeat_timeout:
+            return False
+        os.remove(claim_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.close(os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+
+@contextlib.contextmanager
+def _claim(path: str):
+    """Claims the creation of a file among the jobs of the host.
+
+    Yields:
+        Whether the file is claimed, False if another job is creating it.
+    """
+    claim_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.claim")
+    claimed = _create_claim(claim_path)
+    try:
+        yield claimed
+    finally:
+        if claimed:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(claim_path)
+
+
+def _remove_backgrounds(ctx: JobContext, keys: list[str] | None = None) -> dict:
+    from generative_banner.utils.imagen import remove_background
+
+    ctx.progress(0.1, "Checking for unprocessed assets...")
+    library = get_storage(settings.local_artefacts_dir)
+    if keys is None:
+        get_actor_index().sync()
+
+    # Assets processed before a restart, or by another job, are skipped.
+    unprocessed_keys = list_unprocessed_actors(keys)
+    # Actors of a bucket are downloaded, and their near-duplicates flagged then
+    # skipped.
+    input_paths = {
+        key: local_copy(library, key, settings.local_artefacts_dir)
+        for key in unprocessed_keys
+    }
+    duplicates = get_actor_index().update(list(input_paths.values()))
+    unprocessed_keys = [
+        key for key in unprocessed_keys if _local_actor_path(key) not in duplicates
+    ]
+    logger.info("%d assets to process", len(unprocessed_keys))
+
+    processed = []
+    count_unprocessed = len(unprocessed_keys)
+    with ProgressLogger(
+        logger, "Removing backgrounds", total=count_unprocessed
+    ) as progress_log:
+        for i, key in enumerate(unprocessed_keys):
+            ctx.progress(
+                0.1 + 0.9 * i / count_unprocessed,
+                f"Processing asset {i + 1}/{count_unprocessed}...",
+            )
+            output_key = _processed_actor_key(key)
+            mask_key = output_key.replace("/NoBg_", "/Mask_")
+            output_path = _local_actor_path(output_key)
+            mask_path = _local_actor_path(mask_key)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            # Another job may remove the same backgrounds, e.g. the one queued when
+            # the actors entered the library and a "Preprocess" click.
+            with _claim(output_path) as claimed:
+                if claimed and not library.exists(output_key):
+                    remove_background(input_paths[key], output_path, mask_path)
+                    save_local_copy(library, mask_key, mask_path)
+                    save_local_copy(library, output_key, output_path)
+                    processed.append(output_key)
+                else:
+                    logger.debug("Skipping %s, processed by another job", key)
+            progress_log.update()
+
+    return {"processed": processed}
+
+
+def _render_banners(ctx: JobContext, **campaign) -> dict:
+    from generative_banner.batch import load_template_configs, run_campaign
+
+    campaign = Campaign(**campaign)
+    ctx.progress(0.05, "Checking banner configuration and assets...")
+
+    def on_progress(n_done, n_total):
+        ctx.progress(
+            0.05 + 0.95 * n_done / n_total, f"Rendered {n_done}/{n_total} banners..."
+        )
+
+    # A resumed job continues from the checkpoint of the previous attempt.
+    summary = run_campaign(
+        campaign,
+        load_template_configs(),
+        os.path.join(settings.local_tmp_dir, f"banner-job-{ctx.job.id}.jsonl"),
+        restart=not ctx.resumed,
+        on_progress=on_progress,
+    )
+    if summary["failed"]:
+        raise RuntimeError(
+            f"{len(summary['failed'])} banners failed, "
+            f"e.g. {summary['failed'][0]['job']}: {summary['failed'][0]['error']}"
+        )
+    return summary
+
+
+# Handlers by job kind, called with the job context and parameters.
+HANDLERS = {
+    C.JobKind.GENERATE_ASSETS: _generate_assets,
+    C.JobKind.REMOVE_BACKGROUND: _remove_backgrounds,
+    C.JobKind.RENDER_BANNERS: _render_banners,
+}
+
+
+def run_job(queue: JobQueue, job: Job, worker: str) -> None:
+    """Runs a claimed job, sending heartbeats until it finishes."""
+    handler = HANDLERS[C.JobKind(job.kind)]
+    finished = threading.Event()
+
+    def send_heartbeats():
+        while not finished.wait(settings.job_heartbeat_timeout / 4):
+            queue.heartbeat(job.id, worker)
+
+    threading.Thread(target=send_heartbeats, daemon=True).start()
+    logger.info("Running job %s (attempt %d) on %s", job.id, job.attempts, worker)
+    try:
+        with span("jobs.run", kind=job.kind, job_id=job.id, attempt=job.attempts):
+            result = handler(JobContext(queue, job, worker), **job.params)
+    except Exception as e:
+        logger.exception("Job %s failed", job.id)
+        queue.fail(job.id, worker, f"{type(e).__name__}: {e}")
+    else:
+        queue.complete(job.id, worker, result)
+        logger.info("Job %s succeeded", job.id)
+    finally:
+        finished.set()
+
+
+def _work(queue: JobQueue, worker: str, stop: threading.Event) -> None:
+    while not stop.is_set():
+        job = queue.claim(worker)
+        if job is None:
+            stop.wait(settings.job_poll_interval)
+        else:
+            run_job(queue, job, worker)
+
+
+def start_workers(n_workers: int, queue: JobQueue | None = None) -> threading.Event:
+    """Starts worker threads taking jobs from the queue.
+
+    Args:
+        n_workers: Number of workers, i.e. jobs run concurrently.
+        queue: Queue to take jobs from, defaults to :func:`get_job_queue`.
+
+    Returns:
+        Event to set to stop the workers after their current job.
+    """
+    queue = queue or get_job_queue()
+    stop = threading.Event()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    for i in range(n_workers):
+        threading.Thread(
+            target=_work,
+            args=(queue, f"{prefix}:{i}", stop),
+            name=f"job-worker-{i}",
+            daemon=True,
+        ).start()
+    logger.info("Started %d job workers on %s", n_workers, queue.path)
+    return stop
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m generative_banner.jobs",
+        description="Runs job workers until interrupted.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=max(1, settings.job_workers),
+        help="Number of jobs run concurrently, defaults to the JOB_WORKERS setting.",
+    )
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="Print the recent jobs as JSON lines instead of running workers.",
+    )
+    parser.add_argument("--log-level", help="Defaults to the LOG_LEVEL setting.")
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log_level)
+    if args.list:
+        for job in get_job_queue().list_jobs():
+            sys.stdout.write(job.model_dump_json() + "\n")
+        return 0
+
+    os.environ["U2NET_HOME"] = settings.u2net_home
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    stop = start_workers(args.workers)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        logger.info("Stopping, waiting for the running jobs to finish")
+        stop.set()
+        for thread in threading.enumerate():
+            if thread.name.startswith("job-worker-"):
+                thread.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
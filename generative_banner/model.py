@@ -1,6 +1,10 @@
 """Data models."""
 
-from pydantic import BaseModel
+import re
+from typing import Literal
+
+from PIL import ImageColor
+from pydantic import BaseModel, Field, PositiveInt, field_validator
 
 from generative_banner.config import settings
 
@@ -48,4 +52,119 @@ class Offer(BaseModel):
         return "\n".join(lines)
 
 
+class Encoder(BaseModel):
+    """Data model for the image encoding of a banner output.
+
+    Options not applicable to the format are ignored, unset ones use Pillow defaults.
+    """
+
+    format: Literal["PNG", "WEBP", "AVIF", "JPEG"] = "PNG"
+    # Lossy quality from 0 to 100, for WEBP, AVIF and JPEG.
+    quality: int | None = Field(default=None, ge=0, le=100)
+    # zlib level from 0 (none) to 9 (best), for PNG.
+    compress_level: int | None = Field(default=None, ge=0, le=9)
+    # Extra pass for a smaller file at the cost of encoding time, for PNG and JPEG.
+    optimize: bool = False
+    # Color the transparent pixels, e.g. the padding of `contain` renditions, are
+    # composited onto for JPEG, which has no alpha channel.
+    background: str = "white"
+
+    @field_validator("background")
+    @classmethod
+    def _check_background(cls, value: str) -> str:
+        ImageColor.getrgb(value)  # raises a ValueError if not a color
+        return value
+
+    @property
+    def extension(self) -> str:
+        return {"PNG": ".png", "WEBP": ".webp", "AVIF": ".avif", "JPEG": ".jpg"}[
+            self.format
+        ]
+
+
+class Rendition(BaseModel):
+    """Data model for an additional output size of a banner.
+
+    A banner is rendered at its template size first. A rendition is re-laid out if a
+    template document named `<template>_<width>x<height>` exists, otherwise it is
+    scaled from the full size banner to either fit within (`contain`, padded with
+    transparency) or fill (`cover`, center cropped) the target size.
+    """
+
+    width: PositiveInt
+    height: PositiveInt
+    fit: Literal["contain", "cover"] = "contain"
+    # Defaults to the encoder of the full size banner.
+    encoder: Encoder | None = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.width}x{self.height}"
+
+    @classmethod
+    def from_name(cls, name: str, **kwargs) -> "Rendition":
+        """Creates a rendition from a `<width>x<height>` string."""
+        width, height = name.lower().split("x")
+        return cls(width=int(width), height=int(height), **kwargs)
+
+
+class BannerOutput(BaseModel):
+    """Data model for a banner output written to a file or a storage."""
+
+    path: str
+    width: int
+    height: int
+    format: str
+    n_bytes: int
+    encode_seconds: float
+
+
+class Campaign(BaseModel):
+    """Data model for a banner campaign rendered by `python -m generative_banner.batch`.
+
+    A banner is rendered for each template and each processed actor of the segments.
+    """
+
+    name: str = Field(pattern=r"^[\w.-]+$")
+    templates: list[str] = Field(min_length=1)
+    segments: list[str] = Field(min_length=1)
+    # Texts by layer, e.g. `text_header1`.
+    texts: dict[str, str] = {}
+    # File name of the logo in `artefacts/Logo`.
+    logo: str | None = None
+    # File names in `artefacts/Graphics` by layer, e.g. `graphic1`.
+    graphics: dict[str, str] = {}
+    # Additional output sizes as `<width>x<height>`.
+    renditions: list[str] = []
+    # Defaults to `settings.banner_encoding`.
+    encoding: str | None = None
+
+    @field_validator("renditions")
+    @classmethod
+    def _check_renditions(cls, value: list[str]) -> list[str]:
+        for name in value:
+            if not re.fullmatch(r"[1-9]\d*x[1-9]\d*", name, re.IGNORECASE):
+                raise ValueError(f"Rendition {name!r} is not a size such as `300x250`.")
+        return value
+
+
+class Job(BaseModel):
+    """Data model for a job of the persistent job queue, see the `jobs` module."""
+
+    id: str
+    kind: str
+    status: str
+    # Keyword arguments of the job handler, from which the job ID is derived.
+    params: dict
+    # Fraction done from 0 to 1, with a message of the current step.
+    progress: float = 0.0
+    message: str | None = None
+    result: dict | None = None
+    error: str | None = None
+    # Number of times the job was started, more than 1 if resumed.
+    attempts: int = 0
+    created_at: float
+    updated_at: float
+
+
 # TODO: Data models for template documents.
@@ -0,0 +1,1019 @@
+"""Banner rendering.
+
+A banner template places a set of layers (actor, logo, graphics and texts) on a
+background image. Within a batch all layers but the actor are the same, so they are
+compiled once into a :class:`RenderPlan` and each banner only composites its actor.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass
+from functools import lru_cache
+from string import ascii_letters
+
+from PIL import Image, ImageDraw, ImageFont, features
+
+import generative_banner.constants as C
+from generative_banner.config import settings
+from generative_banner.model import BannerOutput, Encoder, Rendition
+from generative_banner.utils.pixels import get_pixel_store
+from generative_banner.utils.storage import AtomicWriter, Storage
+from generative_banner.utils.tracing import span, submit_in_context, traced
+
+logger = logging.getLogger(__name__)
+
+# Downscaling first reduces by an integer factor then resamples the remaining ratio
+# of at least this gap, which is indistinguishable from a full LANCZOS resampling.
+RESIZE_REDUCING_GAP = 3.0
+
+# Part of the banner digests, so that banners of a previous rendering are not reused.
+# Increment on any change of the rendered pixels.
+RENDERER_VERSION = 1
+
+# Image layers drawn above the actor, in drawing order.
+IMAGE_LAYERS = ("logo", "graphic1", "graphic2", "graphic_highlight2")
+
+# Text layers drawn above the image layers, in drawing order.
+# A layer without `font_size` is wrapped into multiple lines sized to fill its box,
+# otherwise it is a single line shrunk from `font_size` until it fits.
+TEXT_LAYERS = {
+    "text_header1": {
+        "font_name": C.Font.sans_bold,
+        "text_color": (0, 0, 0),
+        "alignment": "left",
+        "margin": 25,
+    },
+    "text_header2": {
+        "font_name": C.Font.sans_regular,
+        "text_color": (0, 0, 0),
+        "alignment": "left",
+        "margin": 25,
+    },
+    "text_details": {
+        "font_name": C.Font.sans_regular,
+        "text_color": (0, 0, 0),
+        "alignment": "left",
+        "margin": 25,
+    },
+    "text_highlight1": {
+        "font_name": C.Font.sans_bold,
+        "text_color": (0, 0, 0),
+        "alignment": "center",
+        "margin": 5,
+        "font_size": 100,
+    },
+    "text_highlight3": {
+        "font_name": C.Font.sans_bold,
+        "text_color": (0, 0, 0),
+        "alignment": "center",
+        "margin": 20,
+        "font_size": 120,
+    },
+    "text_tagline": {
+        "font_name": C.Font.mono_italic,
+        "text_color": (255, 0, 0),
+        "alignment": "center",
+        "margin": 25,
+        "font_size": 25,
+    },
+    "text_action": {
+        "font_name": C.Font.mono_bold,
+        "text_color": (255, 255, 255),
+        "alignment": "center",
+        "margin": 25,
+        "font_size": 35,
+    },
+}
+
+
+def collect_banner_inputs(
+    images: dict[str, str | None], texts: dict[str, str | None]
+) -> tuple[dict, dict]:
+    """Collects the non-empty banner inputs.
+
+    Args:
+        images: File names by image layer, e.g. `logo`. The logo is looked up in
+            `artefacts/Logo`, the graphics in `artefacts/Graphics`.
+        texts: Texts by text layer, e.g. `text_header1`.
+
+    Returns:
+        Image layer paths and texts by layer, for :func:`compile_render_plan`.
+
+    Raises:
+        ValueError: If a layer is not defined.
+    """
+    unknown = (set(images) - set(IMAGE_LAYERS)) | (set(texts) - set(TEXT_LAYERS))
+    if unknown:
+        raise ValueError(f"Unknown banner layers: {sorted(unknown)}")
+
+    image_inputs = {}
+    for layer, filename in images.items():
+        if filename is not None and filename.strip() != "":
+            folder = "Logo" if layer == "logo" else "Graphics"
+            image_inputs[f"{layer}_path"] = (
+                f"{settings.local_artefacts_dir}/{folder}/{filename}"
+            )
+
+    text_inputs = {
+        layer: text
+        for layer, text in texts.items()
+        if text is not None and text.strip() != ""
+    }
+    return image_inputs, text_inputs
+
+
+@lru_cache(maxsize=512)
+def load_font(font_name: str, size: int) -> ImageFont.FreeTypeFont:
+    """Loads a font at a given size, cached since text fitting tries many sizes."""
+    return ImageFont.truetype(font_name, size)
+
+
+@lru_cache(maxsize=32)
+def _load_image(path, mtime_ns, scale):
+    with Image.open(path) as img:
+        image = img.convert("RGBA")
+    if scale != 1.0:
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.LANCZOS,
+            reducing_gap=RESIZE_REDUCING_GAP,
+        )
+    return image
+
+
+def load_image(path: str, scale: float = 1.0) -> Image.Image:
+    """Loads an image in RGBA, cached until the file is modified.
+
+    Args:
+        path: Path to the image file.
+        scale: Scale of the returned image.
+
+    Returns:
+        The image, shared between callers so it must not be modified in place.
+    """
+    return _load_image(path, os.stat(path).st_mtime_ns, scale)
+
+
+@lru_cache(maxsize=64)
+def _fit_image(path, mtime_ns, width, height):
+    return _resize_overlay_to_box(
+        load_image(path), {"x": 0, "y": 0, "width": width, "height": height}
+    )
+
+
+def fit_image(path: str, overlay_config: dict) -> tuple[Image.Image, tuple[int, int]]:
+    """Resizes an image file to fit a box, cached by file and box size.
+
+    Returns:
+        The resized image, shared between callers, and its top-left position.
+    """
+    resized, (dx, dy) = _fit_image(
+        path,
+        os.stat(path).st_mtime_ns,
+        overlay_config["width"],
+        overlay_config["height"],
+    )
+    return resized, (overlay_config["x"] + dx, overlay_config["y"] + dy)
+
+
+def _decode_actor(path):
+    store = get_pixel_store()
+    if store is not None:
+        return store.load(path)
+    with Image.open(path) as img:
+        img.load()
+        return img if img.mode == "RGBA" else img.convert("RGBA")
+
+
+_actor_cache: OrderedDict[tuple, Image.Image] = OrderedDict()
+_actor_cache_lock = threading.Lock()
+_actor_cache_bytes = 0
+
+
+def fit_actor(path: str, actor_config: dict) -> tuple[Image.Image, tuple[int, int]]:
+    """Resizes an actor file to fit its box, cached by actor and box size.
+
+    Templates sharing an actor box size reuse the resized actor, so a batch resamples
+    each actor once per distinct box rather than once per template. The cache holds
+    up to `settings.actor_cache_mib` of resized actors, the full size ones are not
+    kept but memory mapped from `settings.actor_pixel_dir` if set.
+
+    Returns:
+        The resized actor, shared between callers, and its top-left position.
+    """
+    global _actor_cache_bytes
+
+    width, height = actor_config["width"], actor_config["height"]
+    key = (path, os.stat(path).st_mtime_ns, width, height)
+    with _actor_cache_lock:
+        resized = _actor_cache.get(key)
+        if resized is not None:
+            _actor_cache.move_to_end(key)
+
+    if resized is None:
+        image = _decode_actor(path)
+        resized = image.resize(
+            _fit_size(image.size, width, height),
+            Image.LANCZOS,
+            reducing_gap=RESIZE_REDUCING_GAP,
+        )
+        with _actor_cache_lock:
+            if key not in _actor_cache:
+                _actor_cache[key] = resized
+                _actor_cache_bytes += resized.width * resized.height * 4
+            while _actor_cache_bytes > settings.actor_cache_mib * 2**20:
+                _, evicted = _actor_cache.popitem(last=False)
+                _actor_cache_bytes -= evicted.width * evicted.height * 4
+
+    x = actor_config["x"] + (width - resized.width) // 2
+    y = actor_config["y"] + (height - resized.height) // 2
+    return resized, (x, y)
+
+
+def _scale_config(config, scale):
+    """Scales the bounding box of a layer."""
+    return {k: round(config[k] * scale) for k in ("x", "y", "width", "height")}
+
+
+def _scale_style(style, scale):
+    """Scales the sizes of a text layer style."""
+    scaled = {**style, "margin": max(1, round(style["margin"] * scale))}
+    if "font_size" in style:
+        scaled["font_size"] = max(1, round(style["font_size"] * scale))
+    return scaled
+
+
+def _fit_size(size, target_width, target_height):
+    """Size of an image fitted to a box, keeping its aspect ratio."""
+    aspect_ratio = size[0] / size[1]
+    # Fit to the box height, or to its width if then too wide.
+    new_width = int(target_height * aspect_ratio)
+    if new_width > target_width:
+        return target_width, max(1, int(target_width / aspect_ratio))
+    return max(1, new_width), target_height
+
+
+def _resize_overlay_to_box(overlay_image, overlay_config):
+    """Resizes an image to fit a box, keeping its aspect ratio.
+
+    Returns:
+        The resized image and its top-left position centered in the box.
+    """
+    target_x = overlay_config["x"]
+    target_y = overlay_config["y"]
+    target_width = overlay_config["width"]
+    target_height = overlay_config["height"]
+
+    # Resized once to its final size, with a fast integer reduction first for large
+    # downscales.
+    resized_overlay_image = overlay_image.resize(
+        _fit_size(overlay_image.size, target_width, target_height),
+        Image.LANCZOS,
+        reducing_gap=RESIZE_REDUCING_GAP,
+    )
+
+    # Calculate centered coordinates
+    final_x = target_x + (target_width - resized_overlay_image.width) // 2
+    final_y = target_y + (target_height - resized_overlay_image.height) // 2
+
+    return resized_overlay_image, (final_x, final_y)
+
+
+def _clip_box(size, position, overlay_size):
+    """Clips an overlay placed at `position` to a canvas of `size`.
+
+    Returns:
+        The clipped box on the canvas and the matching box on the overlay, or None if
+        they do not intersect.
+    """
+    x, y = position
+    left, top = max(x, 0), max(y, 0)
+    right = min(x + overlay_size[0], size[0])
+    bottom = min(y + overlay_size[1], size[1])
+    if left >= right or top >= bottom:
+        return None
+    return (left, top, right, bottom), (left - x, top - y, right - x, bottom - y)
+
+
+def _add_layer(overlay, overlay_alpha, layer, position=(0, 0), alpha=None):
+    """Accumulates a layer pasted with its own alpha as mask.
+
+    Pasting with a mask blends all channels, alpha included. Successive pastes combine
+    into a single one of color `overlay` with mask `overlay.A` (which is what alpha
+    compositing computes), leaving the alpha carried in `overlay_alpha.R` behind.
+
+    Args:
+        overlay: Transparent RGBA accumulator of colors and mask.
+        overlay_alpha: Transparent RGBA accumulator of the resulting alpha.
+        layer: RGBA layer to add.
+        position: Top-left position of the layer, it may overflow the accumulators.
+        alpha: Alpha left by the layer where fully masked, defaults to the layer alpha.
+    """
+    boxes = _clip_box(overlay.size, position, layer.size)
+    if boxes is None:
+        return
+    dest, source = boxes
+    mask = layer.getchannel("A")
+    if alpha is None:
+        alpha = mask
+    overlay.alpha_composite(layer, dest[:2], source)
+    overlay_alpha.alpha_composite(
+        Image.merge("RGBA", (alpha, alpha, alpha, mask)), dest[:2], source
+    )
+
+
+def _place_image_overlay_on_background(
+    overlay_image_path, background_image_path, overlay_config, output_path
+):
+    # Open images
+    background_image = Image.open(background_image_path).convert("RGBA")
+    overlay_image = Image.open(overlay_image_path).convert("RGBA")
+
+    resized_overlay_image, position = _resize_overlay_to_box(
+        overlay_image, overlay_config
+    )
+    logger.debug(
+        "Resized overlay image %s from %s to %s",
+        overlay_image_path,
+        overlay_image.size,
+        resized_overlay_image.size,
+    )
+
+    # Paste actor image onto background
+    background_image.paste(
+        resized_overlay_image, position, resized_overlay_image
+    )  # Use mask for transparency
+
+    # Save the result (optional)
+    background_image.save(output_path)  # Save as PNG to preserve transparency
+
+    return background_image
+
+
+@lru_cache(maxsize=512)
+def _get_font_metrics(font):
+    ascent, descent = font.getmetrics()
+    avg_char_width = sum(font.getbbox(char)[2] for char in ascii_letters) / len(
+        ascii_letters
+    )
+    return ascent, descent, avg_char_width
+
+
+@lru_cache(maxsize=8192)
+def _get_text_width(font, text):
+    return font.getbbox(text)[2]
+
+
+def _wrap_text_custom(text, font, max_width):
+    words = text.split()
+    lines = []
+    current_line = []
+    current_width = 0
+
+    for word in words:
+        word_width = _get_text_width(font, word)
+        space_width = _get_text_width(font, " ")
+
+        if current_width + word_width <= max_width:
+            current_line.append(word)
+            current_width += word_width + space_width
+        else:
+            if current_line:
+                lines.append(" ".join(current_line))
+            current_line = [word]
+            current_width = word_width + space_width
+
+    if current_line:
+        lines.append(" ".join(current_line))
+
+    return lines
+
+
+def _get_font_size(textarea, text, font_name, pixel_gap=2):
+    text_width, text_height = int(textarea[0]), int(textarea[1])
+
+    for point_size in range(5, 300):
+        font = load_font(font_name, point_size)
+        ascent, descent, avg_char_width = _get_font_metrics(font)
+
+        wrapped_lines = _wrap_text_custom(text, font, text_width)
+
+        total_height = (ascent + descent + pixel_gap) * len(wrapped_lines) - pixel_gap
+
+        if total_height >= text_height:
+            point_size -= 1
+            font = load_font(font_name, point_size)
+            wrapped_lines = _wrap_text_custom(text, font, text_width)
+            break
+
+    return wrapped_lines, point_size
+
+
+def _draw_singleline_text(
+    draw,
+    text,
+    initial_font_size,
+    overlay_config,
+    font_name,
+    text_color,
+    alignment,
+    margin=10,
+):
+    x, y = overlay_config["x"], overlay_config["y"]
+    width, height = overlay_config["width"], overlay_config["height"]
+
+    # Function to get text width
+    def get_text_width(font):
+        return draw.textbbox((0, 0), text, font=font)[2]
+
+    # Start with the initial font size and decrease if necessary
+    font_size = initial_font_size
+    font = load_font(font_name, font_size)
+    text_width = get_text_width(font)
+
+    # Decrease font size until text fits within max_width (including margin)
+    while text_width > (width - 2 * margin) and font_size > 1:
+        font_size -= 1
+        font = load_font(font_name, font_size)
+        text_width = get_text_width(font)
+    logger.debug(
+        "Fitted text %r with font size %d (initially %d)",
+        text,
+        font_size,
+        initial_font_size,
+    )
+
+    # Calculate text position and use Pillow's built-in alignment
+    if alignment == "center":
+        anchor = "mm"  # middle-middle
+        text_x = x + width // 2
+    elif alignment == "right":
+        anchor = "rm"  # right-middle
+        text_x = x + width - margin
+    else:  # left alignment
+        anchor = "lm"  # left-middle
+        text_x = x + margin
+
+    # Calculate vertical position (center of the height)
+    text_y = y + height // 2
+
+    # Draw the text using Pillow's alignment feature
+    draw.text((text_x, text_y), text, font=font, fill=text_color, anchor=anchor)
+
+
+def _draw_multiline_text(
+    draw,
+    text,
+    overlay_config,
+    font_name,
+    text_color,
+    alignment,
+    margin=10,
+):
+    x, y = overlay_config["x"], overlay_config["y"]
+    width, height = overlay_config["width"], overlay_config["height"]
+
+    wrapped_lines, font_size = _get_font_size((width, height), text, font_name, margin)
+    font = load_font(font_name, font_size)
+
+    ascent, descent, _ = _get_font_metrics(font)
+    line_height = ascent + descent + margin
+
+    current_y = y
+    for line in wrapped_lines:
+        if alignment == "center":
+            line_bbox = draw.textbbox((0, 0), line, font=font)
+            line_width = line_bbox[2] - line_bbox[0]
+            line_x = x + (width - line_width) // 2
+        elif alignment == "right":
+            line_bbox = draw.textbbox((0, 0), line, font=font)
+            line_width = line_bbox[2] - line_bbox[0]
+            line_x = x + width - line_width
+        else:  # left alignment
+            line_x = x
+
+        draw.text((line_x, current_y), line, font=font, fill=text_color)
+        current_y += line_height
+
+
+def _draw_text_layer(draw, text, overlay_config, style, text_color):
+    """Draws a text layer given its style from `TEXT_LAYERS`."""
+    if "font_size" in style:
+        _draw_singleline_text(
+            draw,
+            text,
+            style["font_size"],
+            overlay_config,
+            font_name=style["font_name"],
+            text_color=text_color,
+            alignment=style["alignment"],
+            margin=style["margin"],
+        )
+    else:
+        _draw_multiline_text(
+            draw,
+            text,
+            overlay_config,
+            font_name=style["font_name"],
+            text_color=text_color,
+            alignment=style["alignment"],
+            margin=style["margin"],
+        )
+
+
+@traced()
+def _create_marketing_banner_baseline(
+    background_path,
+    background_config,
+    image_inputs: dict,
+    text_inputs: dict,
+    output_path,
+):
+    """Renders a single banner layer by layer, saving to disk after each layer.
+
+    This is the reference renderer. Batches should go through :class:`RenderPlan`.
+    """
+    if "actor_position" in background_config and "actor_path" in image_inputs:
+        # Process Actor overlay
+        with span("render.layer", layer="actor"):
+            _place_image_overlay_on_background(
+                image_inputs["actor_path"],
+                background_path,
+                background_config["actor_position"],
+                output_path,
+            )
+
+    for name in IMAGE_LAYERS:
+        position_key, path_key = f"{name}_position", f"{name}_path"
+        if position_key in background_config and path_key in image_inputs:
+            with span("render.layer", layer=name):
+                _place_image_overlay_on_background(
+                    image_inputs[path_key],
+                    output_path,
+                    background_config[position_key],
+                    output_path,
+                )
+
+    for name, style in TEXT_LAYERS.items():
+        position_key = f"{name}_position"
+        if position_key in background_config and name in text_inputs:
+            with span("render.layer", layer=name), Image.open(output_path) as img:
+                draw = ImageDraw.Draw(img)
+                _draw_text_layer(
+                    draw,
+                    text_inputs[name],
+                    background_config[position_key],
+                    style,
+                    style["text_color"],
+                )
+                img.save(output_path)
+
+    return output_path
+
+
+@dataclass
+class RenderPlan:
+    """Static layers of a banner template compiled for a batch of actors.
+
+    Attributes:
+        background: Background image, the only layer below the actor.
+        overlay: All static layers above the actor, to be pasted with `overlay_mask`.
+        overlay_mask: Coverage of the static layers.
+        base: Background with the overlay pasted, i.e. the banner without actor.
+        actor_config: Bounding box of the actor, None if the template has no actor.
+    """
+
+    background: Image.Image
+    overlay: Image.Image
+    overlay_mask: Image.Image
+    base: Image.Image
+    actor_config: dict | None = None
+
+    def render(self, actor: str | Image.Image | None = None) -> Image.Image:
+        """Renders a banner for an actor.
+
+        Only the actor box is redrawn on top of the cached base, so the cost does not
+        depend on the number of static layers.
+
+        Args:
+            actor: Path to the background-removed actor image, or the image itself.
+
+        Returns:
+            The banner image in RGBA.
+        """
+        with span("render.actor"):
+            return self._render(actor)
+
+    def _render(self, actor):
+        banner = self.base.copy()
+        if actor is None or self.actor_config is None:
+            return banner
+
+        if isinstance(actor, Image.Image):
+            actor, position = _resize_overlay_to_box(
+                actor.convert("RGBA") if actor.mode != "RGBA" else actor,
+                self.actor_config,
+            )
+        else:
+            actor, position = fit_actor(actor, self.actor_config)
+        box = (*position, position[0] + actor.width, position[1] + actor.height)
+
+        # Restore the background under the actor so that the static layers above it
+        # are applied exactly once.
+        banner.paste(self.background.crop(box), position)
+        banner.paste(actor, position, actor)
+        banner.paste(self.overlay.crop(box), position, self.overlay_mask.crop(box))
+        return banner
+
+
+@traced()
+def compile_render_plan(
+    background_path: str,
+    background_config: dict,
+    image_inputs: dict,
+    text_inputs: dict,
+    scale: float = 1.0,
+) -> RenderPlan:
+    """Composites all static layers of a template once.
+
+    Args:
+        background_path: Path to the template background image.
+        background_config: Template document with the layer bounding boxes.
+        image_inputs: Dict of (`<layer>_path` -> file path) for the image layers.
+        text_inputs: Dict of (layer name -> text) for the text layers.
+        scale: Scale of the banner relative to the template size, lower for a fast
+            preview.
+
+    Returns:
+        The compiled render plan.
+    """
+    background = load_image(background_path, scale)
+    if scale != 1.0:
+        background_config = {
+            k: _scale_config(v, scale)
+            for k, v in background_config.items()
+            if k.endswith("_position")
+        }
+
+    overlay = Image.new("RGBA", background.size, (0, 0, 0, 0))
+    overlay_alpha = Image.new("RGBA", background.size, (0, 0, 0, 0))
+
+    for name in IMAGE_LAYERS:
+        position_key, path_key = f"{name}_position", f"{name}_path"
+        if position_key in background_config and path_key in image_inputs:
+            with span("render.layer", layer=name):
+                resized, position = fit_image(
+                    image_inputs[path_key], background_config[position_key]
+                )
+                _add_layer(overlay, overlay_alpha, resized, position)
+
+    for name, style in TEXT_LAYERS.items():
+        position_key = f"{name}_position"
+        if position_key in background_config and name in text_inputs:
+            if scale != 1.0:
+                style = _scale_style(style, scale)
+            with span("render.layer", layer=name):
+                # Text is drawn as the glyph coverage of an opaque solid color.
+                mask = Image.new("L", background.size, 0)
+                _draw_text_layer(
+                    ImageDraw.Draw(mask),
+                    text_inputs[name],
+                    background_config[position_key],
+                    style,
+                    255,
+                )
+                layer = Image.new("RGBA", background.size, style["text_color"])
+                layer.putalpha(mask)
+                _add_layer(
+                    overlay,
+                    overlay_alpha,
+                    layer,
+                    alpha=Image.new("L", layer.size, 255),
+                )
+
+    overlay_mask = overlay.getchannel("A")
+    overlay.putalpha(overlay_alpha.getchannel("R"))
+    base = background.copy()
+    base.paste(overlay, (0, 0), overlay_mask)
+
+    return RenderPlan(
+        background=background,
+        overlay=overlay,
+        overlay_mask=overlay_mask,
+        base=base,
+        actor_config=background_config.get("actor_position"),
+    )
+
+
+_plan_cache: OrderedDict[str, RenderPlan] = OrderedDict()
+_plan_cache_lock = threading.Lock()
+PLAN_CACHE_SIZE = 16
+
+
+def _plan_cache_key(
+    background_path, background_config, image_inputs, text_inputs, scale
+):
+    # File modification times are part of the key so that replaced assets recompile.
+    paths = [background_path, *sorted(image_inputs.values())]
+    mtimes = [os.stat(p).st_mtime_ns if os.path.exists(p) else None for p in paths]
+    return json.dumps(
+        [background_config, image_inputs, text_inputs, paths, mtimes, scale],
+        sort_keys=True,
+        default=str,
+    )
+
+
+def get_render_plan(
+    background_path: str,
+    background_config: dict,
+    image_inputs: dict,
+    text_inputs: dict,
+    scale: float = 1.0,
+) -> RenderPlan:
+    """Returns the render plan of a template, compiling it on a cache miss.
+
+    See :func:`compile_render_plan` for the arguments.
+    """
+    key = _plan_cache_key(
+        background_path, background_config, image_inputs, text_inputs, scale
+    )
+    with _plan_cache_lock:
+        if key in _plan_cache:
+            _plan_cache.move_to_end(key)
+            return _plan_cache[key]
+
+    plan = compile_render_plan(
+        background_path, background_config, image_inputs, text_inputs, scale=scale
+    )
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        if len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+@lru_cache(maxsize=4096)
+def _file_digest(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of the content of a file, cached until the file is modified."""
+    stat = os.stat(path)
+    return _file_digest(path, stat.st_mtime_ns, stat.st_size)
+
+
+def template_digest(
+    background_path: str,
+    background_config: dict,
+    image_inputs: dict,
+    text_inputs: dict,
+) -> str:
+    """Digest of the inputs of a render plan, see :func:`compile_render_plan`.
+
+    Only the layers placed by the template are part of it, so that changing e.g. a
+    text only changes the digest of the templates showing that text. Files are
+    digested by content, not by path.
+    """
+    positions = {k: v for k, v in background_config.items() if k.endswith("_position")}
+    images = {
+        k: file_digest(path)
+        for k, path in image_inputs.items()
+        if f"{k.removesuffix('_path')}_position" in positions
+    }
+    texts = {k: v for k, v in text_inputs.items() if f"{k}_position" in positions}
+    data = [RENDERER_VERSION, file_digest(background_path), positions, images, texts]
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def scale_to_rendition(image: Image.Image, rendition: Rendition) -> Image.Image:
+    """Downsamples a banner to the size of a rendition, keeping its aspect ratio.
+
+    Args:
+        image: Full size banner.
+        rendition: Target size and fit.
+
+    Returns:
+        The scaled banner.
+    """
+    target = (rendition.width, rendition.height)
+    ratios = (target[0] / image.width, target[1] / image.height)
+
+    if rendition.fit == "cover":
+        scale = max(ratios)
+        crop_width, crop_height = target[0] / scale, target[1] / scale
+        left = (image.width - crop_width) / 2
+        top = (image.height - crop_height) / 2
+        return image.resize(
+            target,
+            Image.LANCZOS,
+            box=(left, top, left + crop_width, top + crop_height),
+            reducing_gap=RESIZE_REDUCING_GAP,
+        )
+
+    scale = min(ratios)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    scaled = image.resize(size, Image.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
+    canvas = Image.new(image.mode, target)
+    canvas.paste(scaled, ((target[0] - size[0]) // 2, (target[1] - size[1]) // 2))
+    return canvas
+
+
+# Encoder presets by encoding.
+ENCODERS = {
+    C.Encoding.PNG: Encoder(),
+    C.Encoding.PNG_FAST: Encoder(compress_level=1),
+    C.Encoding.PNG_FINAL: Encoder(compress_level=9, optimize=True),
+    C.Encoding.WEBP: Encoder(format="WEBP", quality=90),
+    C.Encoding.JPEG: Encoder(format="JPEG", quality=90, optimize=True),
+    C.Encoding.AVIF: Encoder(format="AVIF", quality=75),
+}
+
+
+def get_encoder(encoding: str | None = None) -> Encoder:
+    """Returns an encoder preset, defaulting to `settings.banner_encoding`."""
+    return ENCODERS[C.Encoding(encoding or settings.banner_encoding)]
+
+
+def encode_image(image: Image.Image, encoder: Encoder) -> bytes:
+    """Encodes an image in memory.
+
+    Args:
+        image: Image to encode.
+        encoder: Format and options of the encoding.
+
+    Returns:
+        The encoded file content.
+    """
+    if encoder.format == "AVIF" and not features.check("avif"):
+        raise ValueError("AVIF encoding requires Pillow built with libavif.")
+
+    options = {}
+    if encoder.format in ("PNG", "JPEG"):
+        options["optimize"] = encoder.optimize
+    if encoder.format == "PNG" and encoder.compress_level is not None:
+        options["compress_level"] = encoder.compress_level
+    if encoder.format != "PNG" and encoder.quality is not None:
+        options["quality"] = encoder.quality
+    if encoder.format == "JPEG" and image.mode != "RGB":
+        # JPEG has no alpha channel, transparent pixels would turn black.
+        background = Image.new("RGBA", image.size, encoder.background)
+        image = Image.alpha_composite(background, image.convert("RGBA"))
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, encoder.format, **options)
+    return buffer.getvalue()
+
+
+def write_image(
+    image: Image.Image,
+    encoder: Encoder,
+    output_path: str,
+    storage: Storage | None = None,
+) -> BannerOutput:
+    """Encodes an image to a file, recording the encoding cost.
+
+    Args:
+        image: Image to write.
+        encoder: Format and options of the encoding.
+        output_path: Path of the file, or its key if written to `storage`.
+        storage: Storage to write to, the local filesystem if None.
+
+    Returns:
+        The written output.
+    """
+    with span(
+        "image.encode", format=encoder.format, size=f"{image.width}x{image.height}"
+    ):
+        start = time.perf_counter()
+        data = encode_image(image, encoder)
+        encode_seconds = time.perf_counter() - start
+
+    # The encoded bytes go straight to the storage, without a local temporary file.
+    with span("image.save", path=output_path, n_bytes=len(data)):
+        # Written atomically, a banner is reused as soon as its outputs exist.
+        if storage is None:
+            with AtomicWriter(output_path) as f:
+                f.write(data)
+        else:
+            storage.write_bytes(output_path, data)
+
+    return BannerOutput(
+        path=output_path,
+        width=image.width,
+        height=image.height,
+        format=encoder.format,
+        n_bytes=len(data),
+        encode_seconds=encode_seconds,
+    )
+
+
+def rendition_path(output_path: str, rendition: Rendition, encoder: Encoder) -> str:
+    """Suffixes an output path with the rendition size and encoding extension."""
+    stem, _ = os.path.splitext(output_path)
+    return f"{stem}_{rendition.name}{encoder.extension}"
+
+
+def banner_output_paths(
+    output_path: str, encoder: Encoder, renditions: list[Rendition] | None = None
+) -> list[str]:
+    """Lists the paths written by :func:`submit_banner`, in the same order."""
+    stem, _ = os.path.splitext(output_path)
+    return [stem + encoder.extension] + [
+        rendition_path(output_path, rendition, rendition.encoder or encoder)
+        for rendition in renditions or []
+    ]
+
+
+def _scale_and_write(image, rendition, encoder, output_path, storage):
+    with span("render.scale", rendition=rendition.name):
+        scaled = scale_to_rendition(image, rendition)
+    return write_image(scaled, encoder, output_path, storage)
+
+
+def _render_and_write(plan, actor_path, encoder, output_path, storage):
+    return write_image(plan.render(actor_path), encoder, output_path, storage)
+
+
+def submit_banner(
+    executor: Executor,
+    plan: RenderPlan,
+    actor_path: str | None,
+    output_path: str,
+    renditions: list[Rendition] | None = None,
+    layouts: dict[str, RenderPlan] | None = None,
+    encoder: Encoder | None = None,
+    storage: Storage | None = None,
+) -> list[Future]:
+    """Renders a banner and writes all its outputs on an executor.
+
+    The full size banner is rendered once and each scaled rendition is downsampled
+    from it, so an extra rendition costs a resize and an encode rather than a render.
+
+    Args:
+        executor: Executor to resize and encode the outputs concurrently.
+        plan: Render plan of the template.
+        actor_path: Path to the background-removed actor image.
+        output_path: Output path of the full size banner, its extension is replaced
+            by the one of the encoding.
+        renditions: Additional output sizes, written next to the full size banner.
+        layouts: Dict of (rendition name -> render plan) for renditions with a
+            dedicated template layout.
+        encoder: Encoder of the full size banner and the renditions without one,
+            defaults to `settings.banner_encoding`.
+        storage: Storage to write the outputs to, in which `output_path` is a key,
+            the local filesystem if None.
+
+    Returns:
+        Futures of the :class:`BannerOutput`, starting with the full size banner.
+    """
+    layouts = layouts or {}
+    if encoder is None:
+        encoder = get_encoder()
+    banner = plan.render(actor_path)
+
+    stem, _ = os.path.splitext(output_path)
+    futures = [
+        submit_in_context(
+            executor, write_image, banner, encoder, stem + encoder.extension, storage
+        )
+    ]
+    for rendition in renditions or []:
+        rendition_encoder = rendition.encoder or encoder
+        path = rendition_path(output_path, rendition, rendition_encoder)
+        if rendition.name in layouts:
+            future = submit_in_context(
+                executor,
+                _render_and_write,
+                layouts[rendition.name],
+                actor_path,
+                rendition_encoder,
+                path,
+                storage,
+            )
+        else:
+            future = submit_in_context(
+                executor,
+                _scale_and_write,
+                banner,
+                rendition,
+                rendition_encoder,
+                path,
+                storage,
+            )
+        futures.append(future)
+    return futures
@@ -0,0 +1,104 @@
+"""Utility - Latency Budgets.
+
+An action such as generating assets has a latency budget, opened with
+:func:`deadline` around it. The calls it makes bound their own timeouts with
+:func:`remaining`, so that a slow step degrades the result rather than stalling the
+whole action. Calls without a timeout of their own, such as the Vertex AI SDK ones,
+are given up on with :func:`call_within_deadline`. The deadline is a context
+variable, carried to executor threads by
+:func:`~generative_banner.utils.tracing.submit_in_context`.
+
+.. code-block:: python
+    with deadline(60):
+        prompt = rewrite_prompt(segment_profile)  # times out within the 60 seconds
+"""
+
+import concurrent.futures
+import contextlib
+import contextvars
+import threading
+import time
+from concurrent.futures import Future
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+@contextlib.contextmanager
+def deadline(seconds: float | None):
+    """Bounds the time of the enclosed calls, within the enclosing deadline if any.
+
+    Args:
+        seconds: Budget from now, unbounded if None.
+    """
+    current = _deadline.get()
+    if seconds is not None:
+        at = time.monotonic() + seconds
+        current = at if current is None else min(current, at)
+    token = _deadline.set(current)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float | None:
+    """Seconds left before the current deadline, at least 0, None if unbounded."""
+    current = _deadline.get()
+    if current is None:
+        return None
+    return max(0.0, current - time.monotonic())
+
+
+def bounded_timeout(timeout: float | None) -> float | None:
+    """Bounds a timeout by the current deadline."""
+    left = remaining()
+    if left is None:
+        return timeout
+    return left if timeout is None else min(timeout, left)
+
+
+def run_in_thread(fn, *args, **kwargs) -> Future:
+    """Runs a call on its own daemon thread, within the current context.
+
+    Unlike in a bounded executor, a call abandoned after a timeout only holds its
+    own thread, so that hung calls never delay the later ones.
+    """
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = context.run(fn, *args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    threading.Thread(target=run, name=f"call-{fn.__name__}", daemon=True).start()
+    return future
+
+
+def call_within_deadline(fn, *args, **kwargs):
+    """Calls a function, giving up on it once the current deadline passes.
+
+    The abandoned call keeps running on its thread, its result is dropped.
+
+    Raises:
+        TimeoutError: If the call did not return before the deadline.
+    """
+    left = remaining()
+    if left is None:
+        return fn(*args, **kwargs)
+    future = run_in_thread(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=left)
+    except concurrent.futures.TimeoutError:
+        if future.done():
+            raise  # Raised by the call itself.
+        raise TimeoutError(
+            f"{fn.__name__} did not return within the deadline"
+        ) from None
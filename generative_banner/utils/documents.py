@@ -0,0 +1,258 @@
+"""Utility - Document Store Backends.
+
+Segment and template documents are small JSON objects addressed by a collection and
+an ID, and looked up by a name field. They are read and written through a
+:class:`DocumentStore`, either Firestore or a local SQLite file for single node
+deployments and tests, selected by `settings.document_backend`.
+"""
+
+import asyncio
+import contextlib
+import json
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+from google.cloud import firestore
+
+import generative_banner.constants as C
+from generative_banner.config import settings
+
+# Fields of the name lookups, indexed by the SQLite backend.
+NAME_FIELDS = ("visualsegment", "bannertemplate")
+
+
+class DocumentStore(ABC):
+    """Backend-agnostic document store.
+
+    The `*_async` methods are awaited by the callbacks running on the event loop of
+    the app. They run the blocking methods in a thread unless overridden.
+    """
+
+    @abstractmethod
+    def list_ids(self, collection: str) -> list[str]:
+        """Lists the document IDs of a collection."""
+
+    @abstractmethod
+    def list_documents(self, collection: str) -> list[dict]:
+        """Reads all documents of a collection."""
+
+    @abstractmethod
+    def get(self, collection: str, doc_id: str) -> dict | None:
+        """Reads a document, None if it does not exist."""
+
+    @abstractmethod
+    def find(self, collection: str, field: str, value) -> list[dict]:
+        """Reads the documents of a collection whose top-level field equals a value."""
+
+    @abstractmethod
+    def set(self, collection: str, doc_id: str, data: dict) -> None:
+        """Creates or replaces a document."""
+
+    @abstractmethod
+    def update(self, collection: str, doc_id: str, data: dict) -> None:
+        """Replaces top-level fields of an existing document."""
+
+    @abstractmethod
+    def delete(self, collection: str, doc_id: str) -> None:
+        """Deletes a document, if it exists."""
+
+    async def list_ids_async(self, collection: str) -> list[str]:
+        return await asyncio.to_thread(self.list_ids, collection)
+
+    async def list_documents_async(self, collection: str) -> list[dict]:
+        return await asyncio.to_thread(self.list_documents, collection)
+
+    async def get_async(self, collection: str, doc_id: str) -> dict | None:
+        return await asyncio.to_thread(self.get, collection, doc_id)
+
+    async def find_async(self, collection: str, field: str, value) -> list[dict]:
+        return await asyncio.to_thread(self.find, collection, field, value)
+
+    async def set_async(self, collection: str, doc_id: str, data: dict) -> None:
+        await asyncio.to_thread(self.set, collection, doc_id, data)
+
+    async def update_async(self, collection: str, doc_id: str, data: dict) -> None:
+        await asyncio.to_thread(self.update, collection, doc_id, data)
+
+
+class FirestoreDocumentStore(DocumentStore):
+    """Documents in Firestore, with the async methods on a Firestore async client."""
+
+    def __init__(self, project: str, database: str):
+        self.client = firestore.Client(project=project, database=database)
+        self.async_client = firestore.AsyncClient(project=project, database=database)
+
+    def list_ids(self, collection):
+        return [doc.id for doc in self.client.collection(collection).stream()]
+
+    def list_documents(self, collection):
+        return [doc.to_dict() for doc in self.client.collection(collection).stream()]
+
+    def get(self, collection, doc_id):
+        snapshot = self.client.collection(collection).document(doc_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def find(self, collection, field, value):
+        query_ref = self.client.collection(collection).where(
+            filter=firestore.FieldFilter(field, "==", value)
+        )
+        return [doc.to_dict() for doc in query_ref.stream()]
+
+    def set(self, collection, doc_id, data):
+        self.client.collection(collection).document(doc_id).set(data)
+
+    def update(self, collection, doc_id, data):
+        self.client.collection(collection).document(doc_id).update(data)
+
+    def delete(self, collection, doc_id):
+        self.client.collection(collection).document(doc_id).delete()
+
+    async def list_ids_async(self, collection):
+        collection_ref = self.async_client.collection(collection)
+        return [doc.id async for doc in collection_ref.stream()]
+
+    async def list_documents_async(self, collection):
+        collection_ref = self.async_client.collection(collection)
+        return [doc.to_dict() async for doc in collection_ref.stream()]
+
+    async def get_async(self, collection, doc_id):
+        doc_ref = self.async_client.collection(collection).document(doc_id)
+        snapshot = await doc_ref.get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    async def find_async(self, collection, field, value):
+        query_ref = self.async_client.collection(collection).where(
+            filter=firestore.FieldFilter(field, "==", value)
+        )
+        return [doc.to_dict() async for doc in query_ref.stream()]
+
+    async def set_async(self, collection, doc_id, data):
+        await self.async_client.collection(collection).document(doc_id).set(data)
+
+    async def update_async(self, collection, doc_id, data):
+        await self.async_client.collection(collection).document(doc_id).update(data)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (collection, id)
+);
+""" + "".join(
+    f"CREATE INDEX IF NOT EXISTS documents_{field} "
+    f"ON documents (collection, json_extract(data, '$.{field}'), id);\n"
+    for field in NAME_FIELDS
+)
+
+
+class SQLiteDocumentStore(DocumentStore):
+    """Documents as JSON in a local SQLite file, with the name lookups indexed.
+
+    Args:
+        path: Path to the SQLite file, created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def list_ids(self, collection):
+        with contextlib.closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id FROM documents WHERE collection = ? ORDER BY id",
+                (collection,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def list_documents(self, collection):
+        with contextlib.closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT data FROM documents WHERE collection = ? ORDER BY id",
+                (collection,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get(self, collection, doc_id):
+        with contextlib.closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT data FROM documents WHERE collection = ? AND id = ?",
+                (collection, doc_id),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find(self, collection, field, value):
+        # The field is part of the expression rather than a parameter, so that the
+        # query matches the expression of its index.
+        if not re.fullmatch(r"\w+", field):
+            raise ValueError(f"Invalid document field: {field!r}")
+        with contextlib.closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT data FROM documents WHERE collection = ? "
+                f"AND json_extract(data, '$.{field}') = ? ORDER BY id",
+                (collection, value),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def set(self, collection, doc_id, data):
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (collection, id, data) "
+                "VALUES (?, ?, ?)",
+                (collection, doc_id, json.dumps(data)),
+            )
+
+    def update(self, collection, doc_id, data):
+        with contextlib.closing(self._connect()) as conn:
+            # The read and the write are one transaction, as with Firestore.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT data FROM documents WHERE collection = ? AND id = ?",
+                    (collection, doc_id),
+                ).fetchone()
+                if row is None:
+                    raise KeyError(f"No document {collection}/{doc_id}")
+                conn.execute(
+                    "UPDATE documents SET data = ? WHERE collection = ? AND id = ?",
+                    (json.dumps({**json.loads(row[0]), **data}), collection, doc_id),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, collection, doc_id):
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute(
+                "DELETE FROM documents WHERE collection = ? AND id = ?",
+                (collection, doc_id),
+            )
+
+
+_document_store: DocumentStore | None = None
+_document_store_lock = threading.Lock()
+
+
+def get_document_store() -> DocumentStore:
+    """Returns the shared document store of `settings.document_backend`."""
+    global _document_store
+
+    with _document_store_lock:
+        if _document_store is None:
+            backend = C.DocumentBackend(settings.document_backend)
+            if backend == C.DocumentBackend.SQLITE:
+                _document_store = SQLiteDocumentStore(settings.document_db_path)
+            else:
+                _document_store = FirestoreDocumentStore(
+                    settings.gcp_project, settings.firestore_id
+                )
+        return _document_store
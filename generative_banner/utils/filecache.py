@@ -0,0 +1,82 @@
+"""Utility - Size-Capped File Cache.
+
+Results of paid model calls, such as seeded Imagen generations, are stored as files
+named by the digest of their request, so that a repeated request is served from
+disk. The least recently used files are evicted once the cache exceeds its size.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(*request) -> str:
+    """Digest of a JSON-serializable request, e.g. a model name and its parameters."""
+    data = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class FileCache:
+    """Files by key in a folder, evicted least recently used first.
+
+    Args:
+        root: Folder of the files, created if it does not exist.
+        max_bytes: Total size of the files above which the oldest ones are evicted.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str) -> bytes | None:
+        """Reads a file, None if not cached."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # The modification time orders the files by last use.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Writes a file, then evicts the least recently used ones over the size."""
+        path = self._path(key)
+        # Written to a temporary file then renamed, so that a reader never gets a
+        # partial file.
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.root):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                logger.debug("Evicted %s from the cache", path)
@@ -1,16 +1,23 @@
-"""Utilities to interact with Firestore."""
+"""Utilities to interact with the segment and template documents.
+
+The helpers take a :class:`~generative_banner.utils.documents.DocumentStore`, such as
+`database.db`, backed by Firestore or SQLite according to `settings.document_backend`.
+"""
 
 import json
+import logging
 import os
 
-from google.cloud import firestore
-
 import generative_banner.constants as C
 from generative_banner.config import settings
+from generative_banner.utils.documents import DocumentStore, get_document_store
+from generative_banner.utils.tracing import traced
+
+logger = logging.getLogger(__name__)
 
 
 def init_document_store(config_file_path: str | None = None) -> None:
-    """Inits contents in Firestore as the backend document storage.
+    """Inits contents in the backend document store.
 
     The initial contents include configurations for both visual segments and banner
     template layouts.
@@ -24,129 +31,104 @@ def init_document_store(config_file_path: str | None = None) -> None:
     with open(config_file_path, "r") as f:
         config_data = json.load(f)
 
-    db = firestore.Client(project=settings.gcp_project, database=settings.firestore_id)
+    db = get_document_store()
 
     banner_template = config_data.get(C.DocKey.TEMPLATE, [])
-    collection_ref = db.collection(C.DocKey.TEMPLATE)
     for banner in banner_template:
-        doc_ref = collection_ref.document(banner["bannertemplate"])
-        doc_ref.set(banner)
+        db.set(C.DocKey.TEMPLATE, banner["bannertemplate"], banner)
 
     visual_segments = config_data.get(C.DocKey.SEGMENT, [])
-    collection_ref = db.collection(C.DocKey.SEGMENT)
     for segment in visual_segments:
-        doc_ref = collection_ref.document(segment["visualsegment"])
-        doc_ref.set(segment)
+        db.set(C.DocKey.SEGMENT, segment["visualsegment"], segment)
 
 
 def cleanup_document_store() -> None:
-    """Removes all documents from the backend Firestore."""
-    db = firestore.Client(project=settings.gcp_project, database=settings.firestore_id)
+    """Removes all documents from the backend document store."""
+    db = get_document_store()
     collections_to_nuke = [C.DocKey.SEGMENT, C.DocKey.TEMPLATE]
     for collection in collections_to_nuke:
-        collection_ref = db.collection(collection)
-        if collection_ref.get():
-            docs = collection_ref.stream()
-            for doc in docs:
-                doc.reference.delete()
+        for doc_id in db.list_ids(collection):
+            db.delete(collection, doc_id)
 
 
 # FIXME: Do we need this at all?
-def get_visual_segments_from_db(db: firestore.Client) -> list[dict]:
+@traced()
+def get_visual_segments_from_db(db: DocumentStore) -> list[dict]:
     # This essentially fetches all documents to memory.
-    collection_ref = db.collection(C.DocKey.SEGMENT)
-    docs = collection_ref.stream()
-    visual_segments = []
-    for doc in docs:
-        visual_segments.append(doc.to_dict())
+    return db.list_documents(C.DocKey.SEGMENT)
 
-    return visual_segments
 
-
-def fetch_visual_segment_names(db: firestore.Client) -> list[str]:
-    """Fetches all segment names from Firestore.
+@traced()
+def fetch_visual_segment_names(db: DocumentStore) -> list[str]:
+    """Fetches all segment names from the document store.
 
     Args:
-        db: Firestore connection client.
+        db: Document store.
 
     Returns:
         Segment names.
     """
-    collection_ref = db.collection(C.DocKey.SEGMENT)
-    return [doc.id for doc in collection_ref.stream()]
+    return db.list_ids(C.DocKey.SEGMENT)
 
 
-def get_visual_segment_config_by_name(db: firestore.Client, name: str) -> dict:
+@traced()
+def get_visual_segment_config_by_name(db: DocumentStore, name: str) -> dict:
     """Fetches a single segment configuration given its name.
 
     Args:
-        db: Firestore connection client.
+        db: Document store.
         name: Segment name.
 
     Returns:
         Segment attribute document.
     """
-    collection_ref = db.collection(C.DocKey.SEGMENT)
-    query_ref = collection_ref.where(
-        filter=firestore.FieldFilter("visualsegment", "==", name)
-    )
-    docs = [d.to_dict() for d in query_ref.stream()]
+    docs = db.find(C.DocKey.SEGMENT, "visualsegment", name)
     return docs[0]  # return only the first match
 
 
-def add_or_update_visual_segment(db: firestore.Client, segment_data: dict):
+def add_or_update_visual_segment(db: DocumentStore, segment_data: dict):
     segment_name = segment_data["visualsegment"]
-    collection_ref = db.collection(C.DocKey.SEGMENT)
-    doc_ref = collection_ref.document(segment_name)
 
-    if doc_ref.get().exists:
-        doc_ref.update(segment_data)
-        print(f"Visual segment '{segment_name}' updated successfully.")
+    if db.get(C.DocKey.SEGMENT, segment_name) is not None:
+        db.update(C.DocKey.SEGMENT, segment_name, segment_data)
+        logger.info("Visual segment '%s' updated successfully.", segment_name)
         return "updated"
     else:
-        doc_ref.set(segment_data)
-        print(f"Visual segment '{segment_name}' created successfully.")
+        db.set(C.DocKey.SEGMENT, segment_name, segment_data)
+        logger.info("Visual segment '%s' created successfully.", segment_name)
         return "created"
 
 
 # FIXME: Do we need this function at all?
-def get_bannertemplate_from_db(db: firestore.Client) -> list[dict]:
+@traced()
+def get_bannertemplate_from_db(db: DocumentStore) -> list[dict]:
     """Fetches all template configurations at once."""
+    return db.list_documents(C.DocKey.TEMPLATE)
 
-    collection_banner_template = db.collection("banner_template")
-    collection_ref = collection_banner_template
-    docs = collection_ref.stream()
-
-    banner_template = []
-    for doc in docs:
-        banner_template.append(doc.to_dict())
 
-    return banner_template
-
-
-def get_bannertemplate_config_by_name(db: firestore.Client, name: str) -> dict:
+@traced()
+def get_bannertemplate_config_by_name(db: DocumentStore, name: str) -> dict:
     """Fetches a single template configuration given its name.
 
     Args:
-        db: Firestore connection client.
+        db: Document store.
         name: Template name.
 
     Returns:
         Template document.
     """
-    collection_ref = db.collection("banner_template")
-    query_ref = collection_ref.where(
-        filter=firestore.FieldFilter("bannertemplate", "==", name)
-    )
-    docs = [d.to_dict() for d in query_ref.stream()]
+    docs = db.find(C.DocKey.TEMPLATE, "bannertemplate", name)
     return docs[0]  # return only the first match
 
 
-def get_template_configuration(db: firestore.Client, template_name: str):
+@traced()
+def get_template_configuration(db: DocumentStore, template_name: str):
     # The configuration has bounding box format not compatible with the annotator.
     # So we need to convert its format.
-    existing_config = get_bannertemplate_config_by_name(db, template_name)
+    return _to_annotator_boxes(get_bannertemplate_config_by_name(db, template_name))
 
+
+def _to_annotator_boxes(existing_config: dict) -> list[dict]:
     del existing_config["bannertemplate"]
 
     # FIXME: Colors of bounding boxes. Why not set in the template document as well?
@@ -197,20 +179,98 @@ def get_template_configuration(db: firestore.Client, template_name: str):
     return output_list
 
 
-def add_or_update_bannertemplate(db: firestore.Client, template_data: dict) -> str:
-    collection_ref = db.collection(C.DocKey.TEMPLATE)
+def add_or_update_bannertemplate(db: DocumentStore, template_data: dict) -> str:
     template_key = template_data["bannertemplate"]
-    doc_ref = collection_ref.document(template_key)
 
-    if doc_ref.get().exists:
-        doc_ref.update(template_data)
-        print(f"Banner template '{template_key}' updated successfully.")
+    if db.get(C.DocKey.TEMPLATE, template_key) is not None:
+        db.update(C.DocKey.TEMPLATE, template_key, template_data)
+        logger.info("Banner template '%s' updated successfully.", template_key)
         return "updated"
     else:
-        doc_ref.set(template_data)
-        print(f"Banner template '{template_key}' created successfully.")
+        db.set(C.DocKey.TEMPLATE, template_key, template_data)
+        logger.info("Banner template '%s' created successfully.", template_key)
         return "created"
 
 
-def get_bannertemplate_list(db: firestore.Client) -> list[str]:
+@traced()
+def get_bannertemplate_list(db: DocumentStore) -> list[str]:
     return [template["bannertemplate"] for template in get_bannertemplate_from_db(db)]
+
+
+# Async variants for the callbacks running on the event loop of the app, so that
+# concurrent users wait on the document store together rather than in turn.
+
+
+@traced()
+async def fetch_visual_segment_names_async(db: DocumentStore) -> list[str]:
+    """See :func:`fetch_visual_segment_names`."""
+    return await db.list_ids_async(C.DocKey.SEGMENT)
+
+
+@traced()
+async def get_visual_segment_config_by_name_async(db: DocumentStore, name: str) -> dict:
+    """See :func:`get_visual_segment_config_by_name`."""
+    docs = await db.find_async(C.DocKey.SEGMENT, "visualsegment", name)
+    return docs[0]  # return only the first match
+
+
+async def add_or_update_visual_segment_async(
+    db: DocumentStore, segment_data: dict
+) -> str:
+    """See :func:`add_or_update_visual_segment`."""
+    segment_name = segment_data["visualsegment"]
+
+    if await db.get_async(C.DocKey.SEGMENT, segment_name) is not None:
+        await db.update_async(C.DocKey.SEGMENT, segment_name, segment_data)
+        logger.info("Visual segment '%s' updated successfully.", segment_name)
+        return "updated"
+    else:
+        await db.set_async(C.DocKey.SEGMENT, segment_name, segment_data)
+        logger.info("Visual segment '%s' created successfully.", segment_name)
+        return "created"
+
+
+@traced()
+async def get_bannertemplate_from_db_async(db: DocumentStore) -> list[dict]:
+    """See :func:`get_bannertemplate_from_db`."""
+    return await db.list_documents_async(C.DocKey.TEMPLATE)
+
+
+@traced()
+async def get_bannertemplate_config_by_name_async(db: DocumentStore, name: str) -> dict:
+    """See :func:`get_bannertemplate_config_by_name`."""
+    docs = await db.find_async(C.DocKey.TEMPLATE, "bannertemplate", name)
+    return docs[0]  # return only the first match
+
+
+@traced()
+async def get_template_configuration_async(
+    db: DocumentStore, template_name: str
+) -> list[dict]:
+    """See :func:`get_template_configuration`."""
+    return _to_annotator_boxes(
+        await get_bannertemplate_config_by_name_async(db, template_name)
+    )
+
+
+async def add_or_update_bannertemplate_async(
+    db: DocumentStore, template_data: dict
+) -> str:
+    """See :func:`add_or_update_bannertemplate`."""
+    template_key = template_data["bannertemplate"]
+
+    if await db.get_async(C.DocKey.TEMPLATE, template_key) is not None:
+        await db.update_async(C.DocKey.TEMPLATE, template_key, template_data)
+        logger.info("Banner template '%s' updated successfully.", template_key)
+        return "updated"
+    else:
+        await db.set_async(C.DocKey.TEMPLATE, template_key, template_data)
+        logger.info("Banner template '%s' created successfully.", template_key)
+        return "created"
+
+
+@traced()
+async def get_bannertemplate_list_async(db: DocumentStore) -> list[str]:
+    """See :func:`get_bannertemplate_list`."""
+    templates = await get_bannertemplate_from_db_async(db)
+    return [template["bannertemplate"] for template in templates]
@@ -1,22 +1,88 @@
-"""Utility - Assorted General GCS Related."""
+"""Utility - Assorted General GCS Related.
 
-import os
+All functions share a single lazily created client per project, so connections are
+pooled across calls. Bulk transfers run concurrently via the transfer manager.
+"""
 
-from google.api_core.exceptions import NotFound
+import logging
+import os
+import threading
+from http import HTTPStatus
+
+import google.auth
+import requests
+from google.api_core.exceptions import NotFound, from_http_response
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
-
-
-def list_files_in_gcs_bucket(bucket_name, project_id):
+from google.cloud.storage import transfer_manager
+
+from generative_banner.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of calls in a single batch request.
+_MAX_BATCH_SIZE = 100
+
+_clients: dict[str | None, storage.Client] = {}
+_clients_lock = threading.Lock()
+
+
+def _pooled_session(session: requests.Session) -> requests.Session:
+    """Sizes the HTTP connection pool of a session for concurrent transfers."""
+    pool_size = max(settings.gcs_max_workers, 10)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_storage_client(project_id: str | None = None) -> storage.Client:
+    """Returns the shared storage client of a project, created on first use.
+
+    The HTTP connection pool is sized for `settings.gcs_max_workers` concurrent
+    transfers. If `settings.gcs_emulator_host` is set the client connects to it
+    anonymously, e.g. to a local fake GCS server.
+
+    Args:
+        project_id: GCP project, defaults to `settings.gcp_project`.
+
+    Returns:
+        Storage client.
+    """
+    project_id = project_id or settings.gcp_project or None
+    with _clients_lock:
+        if project_id not in _clients:
+            if settings.gcs_emulator_host:
+                _clients[project_id] = storage.Client(
+                    project=project_id,
+                    credentials=AnonymousCredentials(),
+                    client_options={"api_endpoint": settings.gcs_emulator_host},
+                    _http=_pooled_session(requests.Session()),
+                )
+            else:
+                credentials, _ = google.auth.default(scopes=storage.Client.SCOPE)
+                _clients[project_id] = storage.Client(
+                    project=project_id,
+                    credentials=credentials,
+                    _http=_pooled_session(AuthorizedSession(credentials)),
+                )
+        return _clients[project_id]
+
+
+def list_files_in_gcs_bucket(bucket_name, project_id=None):
     """Lists all the blobs in the bucket."""
-    storage_client = storage.Client(project=project_id)
+    storage_client = get_storage_client(project_id)
     bucket = storage_client.bucket(bucket_name)
     blobs = bucket.list_blobs()  # Get all blobs
     return [blob.name for blob in blobs]  # Extract filenames
 
 
-def list_files_in_gcs_bucket_folder(bucket_name, folder, project_id):
+def list_files_in_gcs_bucket_folder(bucket_name, folder, project_id=None):
     """Lists all the files within a specified folder in the bucket."""
-    storage_client = storage.Client(project=project_id)
+    storage_client = get_storage_client(project_id)
     bucket = storage_client.bucket(bucket_name)
 
     # Use the prefix parameter to filter blobs within the folder
@@ -26,64 +92,143 @@ def list_files_in_gcs_bucket_folder(bucket_name, folder, project_id):
 
 
 def download_to_local_folder_from_gcs_bucket(
-    bucket_name, file_name, local_folder_path, project_id
+    bucket_name, file_name, local_folder_path, project_id=None
 ):
     """Downloads a blob from GCS and saves it locally"""
-    storage_client = storage.Client(project=project_id)
+    storage_client = get_storage_client(project_id)
 
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(file_name)
 
-    try:
-        # Check if blob exists before downloading
-        if blob.exists():
-            # Create destination directory if it doesn't exist
-            # Extract the GCS folder structure from the file name
-            gcs_folder_path = os.path.dirname(file_name)
+    # Extract the GCS folder structure from the file name
+    gcs_folder_path = os.path.dirname(file_name)
 
-            # Combine the local folder path with the GCS folder structure
-            full_local_path = os.path.join(local_folder_path, gcs_folder_path)
+    # Combine the local folder path with the GCS folder structure
+    full_local_path = os.path.join(local_folder_path, gcs_folder_path)
 
-            # Create the full local directory structure if it doesn't exist
-            os.makedirs(full_local_path, exist_ok=True)
+    # Create the full local directory structure if it doesn't exist
+    os.makedirs(full_local_path, exist_ok=True)
 
-            dst_file_path = os.path.join(full_local_path, os.path.basename(file_name))
+    dst_file_path = os.path.join(full_local_path, os.path.basename(file_name))
 
-            blob.download_to_filename(dst_file_path)
-            print(f"Downloaded {file_name} to {full_local_path}")
-        else:
-            print(f"Blob {file_name} does not exist in bucket {bucket_name}")
+    # A missing blob fails the download itself, no need for an extra existence check.
+    try:
+        blob.download_to_filename(dst_file_path)
+        logger.info("Downloaded %s to %s", file_name, full_local_path)
+    except NotFound:
+        logger.warning("Blob %s does not exist in bucket %s", file_name, bucket_name)
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error("An error occurred: %s", e)
 
 
 def download_to_local_folder_from_gcs_folder(
-    bucket_name, file_name, local_folder_path, project_id
+    bucket_name, file_name, local_folder_path, project_id=None
 ):
     """Downloads a blob from GCS and saves it locally"""
-    storage_client = storage.Client(project=project_id)
+    storage_client = get_storage_client(project_id)
 
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(file_name)
 
+    # Create destination directory if it doesn't exist
+    destination_directory = os.path.dirname(local_folder_path)
+    os.makedirs(destination_directory, exist_ok=True)
+
+    dst_file_path = os.path.join(local_folder_path, os.path.basename(file_name))
+
     try:
-        # Check if blob exists before downloading
-        if blob.exists():
-            # Create destination directory if it doesn't exist
-            destination_directory = os.path.dirname(local_folder_path)
-            os.makedirs(destination_directory, exist_ok=True)
-
-            dst_file_path = os.path.join(local_folder_path, os.path.basename(file_name))
-            blob.download_to_filename(dst_file_path)
-            print(f"Downloaded {file_name} to {local_folder_path}")
-        else:
-            print(f"Blob {file_name} does not exist in bucket {bucket_name}")
+        blob.download_to_filename(dst_file_path)
+        logger.info("Downloaded %s to %s", file_name, local_folder_path)
+    except NotFound:
+        logger.warning("Blob %s does not exist in bucket %s", file_name, bucket_name)
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error("An error occurred: %s", e)
+
+
+def download_many_from_gcs_bucket(
+    bucket_name: str,
+    blob_names: list[str],
+    local_folder_path: str,
+    project_id: str | None = None,
+    max_workers: int | None = None,
+) -> dict[str, Exception]:
+    """Downloads blobs concurrently, keeping their folder structure.
+
+    Args:
+        bucket_name: Name of the bucket.
+        blob_names: Names of the blobs to download.
+        local_folder_path: Local folder to download into.
+        project_id: GCP project, defaults to `settings.gcp_project`.
+        max_workers: Number of concurrent downloads, defaults to
+            `settings.gcs_max_workers`.
+
+    Returns:
+        Dict of (blob name -> error) for the failed downloads.
+    """
+    bucket = get_storage_client(project_id).bucket(bucket_name)
+    results = transfer_manager.download_many_to_path(
+        bucket,
+        blob_names,
+        destination_directory=local_folder_path,
+        create_directories=True,
+        worker_type=transfer_manager.THREAD,
+        max_workers=max_workers or settings.gcs_max_workers,
+    )
+    errors = {n: r for n, r in zip(blob_names, results) if isinstance(r, Exception)}
+    logger.info(
+        "Downloaded %d of %d blobs from bucket %s",
+        len(blob_names) - len(errors),
+        len(blob_names),
+        bucket_name,
+    )
+    return errors
+
+
+def upload_many_to_gcs_bucket(
+    bucket_name: str,
+    file_names: list[str],
+    local_folder_path: str,
+    gcs_folder: str = "",
+    project_id: str | None = None,
+    max_workers: int | None = None,
+) -> dict[str, Exception]:
+    """Uploads local files concurrently, keeping their folder structure.
+
+    Args:
+        bucket_name: Name of the bucket.
+        file_names: Paths of the files relative to `local_folder_path`.
+        local_folder_path: Local folder to upload from.
+        gcs_folder: Folder in the bucket to upload into.
+        project_id: GCP project, defaults to `settings.gcp_project`.
+        max_workers: Number of concurrent uploads, defaults to
+            `settings.gcs_max_workers`.
+
+    Returns:
+        Dict of (file name -> error) for the failed uploads.
+    """
+    bucket = get_storage_client(project_id).bucket(bucket_name)
+    prefix = f"{gcs_folder.rstrip('/')}/" if gcs_folder else ""
+    results = transfer_manager.upload_many_from_filenames(
+        bucket,
+        file_names,
+        source_directory=local_folder_path,
+        blob_name_prefix=prefix,
+        worker_type=transfer_manager.THREAD,
+        max_workers=max_workers or settings.gcs_max_workers,
+    )
+    errors = {n: r for n, r in zip(file_names, results) if isinstance(r, Exception)}
+    logger.info(
+        "Uploaded %d of %d files to gs://%s/%s",
+        len(file_names) - len(errors),
+        len(file_names),
+        bucket_name,
+        prefix,
+    )
+    return errors
 
 
 def copy_file_to_gcs(
-    localfilepath, gcs_bucket_name, gcs_folder, gcs_filename, project_id
+    localfilepath, gcs_bucket_name, gcs_folder, gcs_filename, project_id=None
 ):
     """Copies a local file to Google Cloud Storage."""
 
@@ -93,7 +238,7 @@ def copy_file_to_gcs(
             raise FileNotFoundError(f"File not found: {localfilepath}")
 
         # Upload to Google Cloud Storage
-        storage_client = storage.Client(project=project_id)
+        storage_client = get_storage_client(project_id)
         bucket = storage_client.bucket(gcs_bucket_name)
 
         # Create the bucket if it doesn't exist
@@ -106,68 +251,104 @@ def copy_file_to_gcs(
         # Upload the local file, overwriting if it exists
         blob.upload_from_filename(localfilepath)
 
-        print(f"File {localfilepath} uploaded to gs://{gcs_bucket_name}/{blob_name}")
+        logger.info(
+            "File %s uploaded to gs://%s/%s", localfilepath, gcs_bucket_name, blob_name
+        )
 
     except (
         FileNotFoundError,
         ValueError,
         Exception,
     ) as e:  # Use PyPDF2.utils.PdfReadError
-        print(f"Error: {e}")
+        logger.error("Error: %s", e)
 
 
-def delete_bucket_and_contents(bucket_name, project_id):
+def delete_blobs_in_gcs_bucket(
+    bucket_name: str, blob_names: list[str], project_id: str | None = None
+) -> None:
+    """Deletes blobs with batch requests, ignoring the missing ones.
+
+    Args:
+        bucket_name: Name of the bucket.
+        blob_names: Names of the blobs to delete.
+        project_id: GCP project, defaults to `settings.gcp_project`.
+
+    Raises:
+        GoogleAPICallError: If a blob failed to be deleted for another reason than
+            being missing, once all the batches are sent.
+    """
+    storage_client = get_storage_client(project_id)
+    bucket = storage_client.bucket(bucket_name)
+    errors = []
+    for i in range(0, len(blob_names), _MAX_BATCH_SIZE):
+        batch = storage_client.batch(raise_exception=False)
+        with batch:
+            for blob_name in blob_names[i : i + _MAX_BATCH_SIZE]:
+                bucket.blob(blob_name).delete()
+        # The responses returned by `finish`, called when exiting the batch.
+        errors += [
+            response
+            for response in batch._responses
+            if not 200 <= response.status_code < 300
+            and response.status_code != HTTPStatus.NOT_FOUND
+        ]
+    if errors:
+        logger.error(
+            "Failed to delete %d blobs from bucket %s", len(errors), bucket_name
+        )
+        raise from_http_response(errors[0])
+
+
+def delete_bucket_and_contents(bucket_name, project_id=None):
     """Deletes a GCS bucket and all its contents."""
 
-    storage_client = storage.Client(project=project_id)
+    storage_client = get_storage_client(project_id)
 
     try:
         # Get the bucket object
         bucket = storage_client.get_bucket(bucket_name)
 
         # Delete all blobs (objects) in the bucket
-        blobs = bucket.list_blobs()
-        for blob in blobs:
-            blob.delete()
-        print(f"Deleted all objects in bucket {bucket_name}")
+        blob_names = [blob.name for blob in bucket.list_blobs()]
+        delete_blobs_in_gcs_bucket(bucket_name, blob_names, project_id)
+        logger.info("Deleted all objects in bucket %s", bucket_name)
 
         # Delete the bucket itself
         bucket.delete()
-        print(f"Deleted bucket {bucket_name}")
+        logger.info("Deleted bucket %s", bucket_name)
 
     except NotFound:
-        print(f"Bucket {bucket_name} not found, ignoring.")
+        logger.info("Bucket %s not found, ignoring.", bucket_name)
 
 
-def delete_bucket_contents(bucket_name, project_id):
+def delete_bucket_contents(bucket_name, project_id=None):
     """Deletes all contents in GCS bucket."""
 
-    storage_client = storage.Client(project=project_id)
+    storage_client = get_storage_client(project_id)
 
     try:
         # Get the bucket object
         bucket = storage_client.get_bucket(bucket_name)
 
         # Delete all blobs (objects) in the bucket
-        blobs = bucket.list_blobs()
-        for blob in blobs:
-            blob.delete()
-        print(f"Deleted all objects in bucket {bucket_name}")
+        blob_names = [blob.name for blob in bucket.list_blobs()]
+        delete_blobs_in_gcs_bucket(bucket_name, blob_names, project_id)
+        logger.info("Deleted all objects in bucket %s", bucket_name)
 
     except NotFound:
-        print(f"Bucket {bucket_name} not found, ignoring.")
+        logger.info("Bucket %s not found, ignoring.", bucket_name)
 
 
 def create_bucket_if_not_exists(bucket_name, project_id, location):
     """Creates a GCS bucket if it doesn't already exist."""
 
-    storage_client = storage.Client(project=project_id)
+    storage_client = get_storage_client(project_id)
 
     try:
         bucket = storage_client.get_bucket(bucket_name)
-        print(f"Bucket {bucket_name} already exists.")  # Bucket found
+        logger.info("Bucket %s already exists.", bucket_name)  # Bucket found
     except:  # Bucket not found, so create it
         bucket = storage_client.bucket(bucket_name)
         bucket.storage_class = "STANDARD"
         new_bucket = storage_client.create_bucket(bucket, location=location)
-        print(f"Created bucket {new_bucket.name} in {new_bucket.location}.")
+        logger.info("Created bucket %s in %s.", new_bucket.name, new_bucket.location)
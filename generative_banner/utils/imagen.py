@@ -15,7 +15,14 @@
 """
 
 import base64
+import functools
 import io
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Literal
 
 import numpy as np
@@ -29,20 +36,95 @@ from vertexai.vision_models import GeneratedImage, ImageGenerationModel
 
 from generative_banner.config import settings
 from generative_banner.model import SegmentProfile
+from generative_banner.utils.deadline import (
+    bounded_timeout,
+    call_within_deadline,
+    run_in_thread,
+)
+from generative_banner.utils.filecache import FileCache, cache_key
+from generative_banner.utils.matting import upsample_alpha
+from generative_banner.utils.ratelimit import wait_for_quota
+from generative_banner.utils.singleflight import normalize_prompt, single_flight
+from generative_banner.utils.tracing import span, submit_in_context, traced
+
+logger = logging.getLogger(__name__)
+
 
+@functools.cache
+def _get_imagen_cache() -> FileCache:
+    return FileCache(settings.imagen_cache_dir, settings.imagen_cache_mib * 2**20)
 
+
+def _imagen_cache_key(model, prompt, aspect_ratio, seed, index):
+    return cache_key(
+        "imagen", model, normalize_prompt(prompt), aspect_ratio, seed, index
+    )
+
+
+@single_flight(normalize={"prompt": normalize_prompt})
 def generate_imagen_outputs(
     prompt: str,
     number_of_images: int = 1,
     aspect_ratio: Literal["1:1", "9:16", "16:9", "4:3", "3:4"] = "1:1",
     model: str = "imagen-3.0-generate-001",  # https://ai.google.dev/gemini-api/docs/imagen
+    seed: int | None = None,
 ) -> list[GeneratedImage]:
+    """Generates images with Imagen.
+
+    With a seed the generation is deterministic, its images are stored in
+    `settings.imagen_cache_dir` and the same request is served from there.
+
+    Raises:
+        TimeoutError: If the images were not generated before the current deadline,
+            see `utils/deadline.py`.
+    """
+    if seed is not None:
+        cache = _get_imagen_cache()
+        keys = [
+            _imagen_cache_key(model, prompt, aspect_ratio, seed, index)
+            for index in range(number_of_images)
+        ]
+        cached = [cache.get(key) for key in keys]
+        if all(data is not None for data in cached):
+            logger.info("Serving %d images from the Imagen cache", len(cached))
+            parameters = {"prompt": prompt, "seed": seed, "aspect_ratio": aspect_ratio}
+            return [
+                GeneratedImage(image_bytes=data, generation_parameters=parameters)
+                for data in cached
+            ]
+
+    with span(
+        "imagen.generate",
+        model=model,
+        number_of_images=number_of_images,
+        aspect_ratio=aspect_ratio,
+    ):
+        wait_for_quota(model)
+        # The SDK call has no timeout, it is given up on at the current deadline.
+        # A seeded generation given up on is still cached once it returns.
+        return call_within_deadline(
+            _generate_images, prompt, number_of_images, aspect_ratio, model, seed
+        )
+
+
+def _generate_images(prompt, number_of_images, aspect_ratio, model, seed):
     generation_model = ImageGenerationModel.from_pretrained(model)
+    options = {}
+    if seed is not None:
+        # Imagen only accepts a seed for images without watermark.
+        options = {"seed": seed, "add_watermark": False}
     image_list = generation_model.generate_images(
         prompt=prompt,
         number_of_images=number_of_images,
         aspect_ratio=aspect_ratio,
+        **options,
     )
+
+    if seed is not None:
+        cache = _get_imagen_cache()
+        for index, image in enumerate(image_list.images):
+            key = _imagen_cache_key(model, prompt, aspect_ratio, seed, index)
+            cache.put(key, base64.b64decode(image._as_base64_string()))
     return image_list.images
 
 
@@ -52,12 +134,15 @@ def show_image(image: GeneratedImage) -> None:
     pil_image.show()
 
 
+@single_flight(normalize={"prompt": normalize_prompt})
 def invoke_gemini_for_text(prompt: str, model: str | None = None) -> str:
     if model is None:
         model = settings.text_model
 
-    gemini_model = GenerativeModel(model)
-    response = gemini_model.generate_content(prompt)
+    with span("gemini.generate", model=model):
+        wait_for_quota(model)
+        gemini_model = GenerativeModel(model)
+        response = gemini_model.generate_content(prompt)
     return response.text
 
 
@@ -68,7 +153,89 @@ def invoke_gemini_multimodal_model_with_files(
     return response
 
 
-def rewrite_prompt(segment_profile: SegmentProfile) -> str:
+# Durations of the recent successful prompt rewrites, from which the delay of the
+# hedged requests is derived.
+_rewrite_seconds: deque[float] = deque(maxlen=100)
+_rewrite_seconds_lock = threading.Lock()
+
+
+def _timed_rewrite(invoke, prompt):
+    start = time.monotonic()
+    result = invoke(prompt)
+    with _rewrite_seconds_lock:
+        _rewrite_seconds.append(time.monotonic() - start)
+    return result
+
+
+def _hedge_delay() -> float:
+    """95th percentile of the recent rewrite durations, once there are enough."""
+    with _rewrite_seconds_lock:
+        durations = sorted(_rewrite_seconds)
+    if len(durations) < 20:
+        return settings.prompt_rewrite_hedge_delay
+    return durations[int(0.95 * (len(durations) - 1))]
+
+
+def _invoke_hedged(prompt: str, timeout: float) -> str:
+    """Invokes Gemini, sending a duplicate request if the first one is slow.
+
+    Raises:
+        TimeoutError: If no request succeeded within the timeout.
+    """
+    expires_at = time.monotonic() + timeout
+    # The SDK call has no timeout. Requests given up on finish on their own threads,
+    # rather than filling a pool that the next rewrites would wait for.
+    futures = [run_in_thread(_timed_rewrite, invoke_gemini_for_text, prompt)]
+    if settings.prompt_rewrite_hedging:
+        delay = _hedge_delay()
+        if delay < timeout and not wait(futures, timeout=delay).done:
+            logger.info("Sending a hedged prompt rewrite after %.1f s", delay)
+            # Bypasses the coalescing, which would join the request in flight.
+            futures.append(
+                run_in_thread(
+                    _timed_rewrite, invoke_gemini_for_text.__wrapped__, prompt
+                )
+            )
+
+    error = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(
+            pending,
+            timeout=max(0.0, expires_at - time.monotonic()),
+            return_when=FIRST_COMPLETED,
+        )
+        if not done:
+            raise TimeoutError(f"No prompt rewrite within {timeout:.1f} s")
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+@traced()
+def rewrite_prompt(
+    segment_profile: SegmentProfile,
+    timeout: float | None = None,
+    seed: int | None = None,
+) -> str:
+    """Rewrites the prompt of a segment for Imagen with Gemini.
+
+    Args:
+        segment_profile: Segment to generate images of.
+        timeout: Seconds to wait for Gemini, `settings.prompt_rewrite_timeout` if
+            None, bounded by the current deadline. With
+            `settings.prompt_rewrite_hedging` a duplicate request is sent if the
+            first one takes longer than most recent ones.
+        seed: Seed of the images the prompt is rewritten for. With a seed the rewrite
+            is stored in `settings.imagen_cache_dir` like the images, so that the
+            same segment gets the same prompt and then the same cached images.
+
+    Returns:
+        The rewritten prompt, or the unrewritten one if Gemini did not respond in
+        time.
+    """
     prompt_user_input = segment_profile.prompt()
 
     # TODO: Move this out.
@@ -89,19 +256,54 @@ def rewrite_prompt(segment_profile: SegmentProfile) -> str:
 
         OUTPUT -
     """
-    prompt = invoke_gemini_for_text(rewrite_prompt)
+    if seed is not None:
+        key = cache_key("rewrite", settings.text_model, rewrite_prompt, seed)
+        cached = _get_imagen_cache().get(key)
+        if cached is not None:
+            return cached.decode()
+
+    timeout = bounded_timeout(timeout or settings.prompt_rewrite_timeout)
+    try:
+        prompt = _invoke_hedged(rewrite_prompt, timeout)
+    except TimeoutError:
+        logger.warning("Prompt rewriting timed out, using the unrewritten prompt")
+        return prompt_user_input
+
+    if seed is not None:
+        _get_imagen_cache().put(key, prompt.encode())
     return prompt
 
 
+@traced()
 def remove_background(
     input_path: str,
     output_path: str,
     mask_path: str,
     margin=10,
     alpha_threshold=10,
+    working_size: int | None = None,
 ):
-    with open(input_path, "rb") as input_file:
-        input_data = input_file.read()
+    if working_size is None:
+        working_size = settings.rembg_working_size
+
+    with span("image.decode"):
+        input_image = Image.open(input_path)
+        input_image.load()
+
+    # Segmented at the working resolution, the mask is then refined along its edge at
+    # full resolution, see `utils.matting`.
+    full_image = None
+    scale = 1.0
+    if working_size and max(input_image.size) > working_size:
+        full_image = input_image.convert("RGB")
+        scale = working_size / max(input_image.size)
+        size = (
+            max(1, round(input_image.width * scale)),
+            max(1, round(input_image.height * scale)),
+        )
+        input_image.close()
+        with span("image.resize", size=f"{size[0]}x{size[1]}"):
+            input_image = full_image.resize(size, Image.LANCZOS, reducing_gap=3.0)
 
     # NOTE: U2Net excels at accurate and detailed salient object detection,
     #       enabling high-quality background removal with preserved fine details and
@@ -112,35 +314,39 @@ def remove_background(
     # NOTE: alpha_matting_foreground_threshold high value (close to 255, which is pure white) is chosen because: a) It ensures that only pixels that are very likely to be part of the foreground are immediately classified as such (b) ensure that the solid parts of the  dress and the actor's skin are definitely classified as foreground
     # NOTE: alpha_matting_background_threshold low value (close to 0, which is pure black) is chosen because: a) It ensures that only pixels that are very likely to be part of the background are immediately classified as such (b) we generate actor images with white background to optimize output, avoiding black or dark dress colors
     # NOTE: alpha_matting_erode_size=10 parameter in rembg controls the size of the transition area between definite foreground and background for alpha matting. Useful for preserving details around actor dress and the hair or held objects, ensuring smooth transitions and preserved details.
-    output_data = remove(
-        input_data,
-        session=session,
-        alpha_matting=True,
-        alpha_matting_foreground_threshold=230,
-        alpha_matting_background_threshold=10,
-        alpha_matting_erode_size=10,
-    )
-
-    # Open the output image and convert to numpy array
-    output_image = Image.open(io.BytesIO(output_data)).convert("RGBA")
-    output_array = np.array(output_image)
-
-    # Extract the alpha channel
-    alpha = output_array[:, :, 3]
+    # A PIL image in is a PIL image out, without encoding the output to PNG bytes.
+    with span("rembg.remove"):
+        output_image = remove(
+            input_image,
+            session=session,
+            alpha_matting=True,
+            alpha_matting_foreground_threshold=230,
+            alpha_matting_background_threshold=10,
+            alpha_matting_erode_size=max(1, round(10 * scale)),
+        )
+    input_image.close()
+    if output_image.mode != "RGBA":
+        output_image = output_image.convert("RGBA")
+
+    # Only the alpha channel is copied to numpy, a quarter of the RGBA image.
+    alpha = np.asarray(output_image.getchannel("A"))
+    if full_image is not None:
+        with span("matting.upsample_alpha"):
+            alpha = upsample_alpha(full_image, alpha)
+        output_image = full_image.convert("RGBA")
+        output_image.putalpha(Image.fromarray(alpha))
 
     # Apply threshold to alpha channel for a binary mask filter
     # NOTE: Using alpha_threshold to ensure excess white space in top or sides is removed. 2C had problem of excess white space in top
     alpha_threshold_mask = alpha > alpha_threshold
 
-    # Find the bounding box of the non-transparent area
-    rows = np.any(alpha_threshold_mask, axis=1)
-    cols = np.any(alpha_threshold_mask, axis=0)
-
-    if np.any(rows) and np.any(
-        cols
-    ):  # Check if there's any content left after thresholding
-        ymin, ymax = np.where(rows)[0][[0, -1]]
-        xmin, xmax = np.where(cols)[0][[0, -1]]
+    # Find the bounding box of the non-transparent area, the columns only within the
+    # rows with content.
+    rows = np.flatnonzero(alpha_threshold_mask.any(axis=1))
+    if rows.size:  # Check if there's any content left after thresholding
+        ymin, ymax = rows[0], rows[-1]
+        cols = np.flatnonzero(alpha_threshold_mask[ymin : ymax + 1].any(axis=0))
+        xmin, xmax = cols[0], cols[-1]
 
         # Add margin
         height, width = alpha.shape
@@ -149,20 +355,32 @@ def remove_background(
         xmin = max(0, xmin - margin)
         xmax = min(width, xmax + margin)
 
-        # Crop the image
-        cropped_image = output_image.crop((xmin, ymin, xmax, ymax))
-
-        # Save the cropped output image with transparent background
-        cropped_image.save(output_path)
-
-        # Crop and save the mask
+        # Crop the image, and the mask from a view of the alpha channel
+        output_image = output_image.crop((xmin, ymin, xmax, ymax))
+        mask_image = Image.fromarray(alpha[ymin:ymax, xmin:xmax])
+    else:
+        logger.warning(
+            "No content found in %s after applying threshold. Saving original image.",
+            input_path,
+        )
         mask_image = Image.fromarray(alpha)
-        cropped_mask = mask_image.crop((xmin, ymin, xmax, ymax))
-        cropped_mask.save(mask_path)
 
-        print(f"Background removed image saved to {output_path}")
-        print(f"Mask saved to {mask_path}")
-    else:
-        print("No content found after applying threshold. Saving original image.")
-        output_image.save(output_path)
-        Image.fromarray(alpha).save(mask_path)
+    # Written to temporary files then renamed, the output last, so that another job
+    # or the renderer never gets a partial file. Hidden, they match no actor prefix.
+    tmp_suffix = f".{os.getpid()}-{threading.get_ident()}.tmp"
+    tmp_output_path, tmp_mask_path = (
+        os.path.join(os.path.dirname(path), f".{os.path.basename(path)}{tmp_suffix}")
+        for path in (output_path, mask_path)
+    )
+    # The mask is encoded on another thread, zlib releases the GIL.
+    with span("image.save", path=output_path):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            mask_saved = submit_in_context(
+                executor, mask_image.save, tmp_mask_path, "PNG"
+            )
+            output_image.save(tmp_output_path, "PNG")
+            mask_saved.result()
+        os.replace(tmp_mask_path, mask_path)
+        os.replace(tmp_output_path, output_path)
+
+    logger.debug("Background removed image saved to %s", output_path)
@@ -1,9 +1,12 @@
 """Utility - Folder / File Mgmt. Functions."""
 
+import logging
 import os
 import shutil
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 
 def makedir_if_not_exist(path: str) -> None:
     Path(path).mkdir(parents=True, exist_ok=True)
@@ -39,9 +42,9 @@ def download_to_local_folder(src_folder_path, file_name, local_folder_path):
     if os.path.exists(src_file_path):  # Check if the file exists
         # Copy the file from Google Drive
         shutil.copy(src_file_path, dst_file_path)
-        print(f"Copied '{file_name}' to {dst_file_path}")
+        logger.info("Copied '%s' to %s", file_name, dst_file_path)
     else:
-        print(f"File not found: '{file_name}'")
+        logger.warning("File not found: '%s'", file_name)
 
 
 def copy_with_subfolders(src, dst):
@@ -65,9 +68,9 @@ def delete_all_files(directory):
             if os.path.isfile(file_path):
                 os.remove(file_path)
 
-                print(f"Deleted: {file_path}")
+                logger.debug("Deleted: %s", file_path)
         except Exception as e:
-            print(f"Error deleting {file_path}: {e}")
+            logger.error("Error deleting %s: %s", file_path, e)
 
 
 def get_filenames_in_folder(path):
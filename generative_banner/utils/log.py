@@ -0,0 +1,83 @@
+"""Utility - Logging Setup and Progress Summaries.
+
+Modules log to their own `logging.getLogger(__name__)`, all under the package logger
+configured by :func:`setup_logging`. Messages are formatted lazily, so debug messages
+in hot loops cost a level check when debug output is off.
+"""
+
+import logging
+import time
+
+from generative_banner.config import settings
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def setup_logging(level: str | None = None) -> None:
+    """Configures the package logger.
+
+    Args:
+        level: Name of the log level, defaults to `settings.log_level`.
+    """
+    logger = logging.getLogger("generative_banner")
+    logger.setLevel((level or settings.log_level).upper())
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
+        # Not duplicated by handlers of the root logger, e.g. configured by Gradio.
+        logger.propagate = False
+
+
+class ProgressLogger:
+    """Logs the progress of a loop at most once per interval, then a summary.
+
+    .. code-block:: python
+        with ProgressLogger(logger, "Rendering banners", total=len(jobs)) as progress:
+            for job in jobs:
+                ...
+                progress.update()
+    """
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        desc: str,
+        total: int | None = None,
+        interval: float | None = None,
+    ):
+        self.logger = logger
+        self.desc = desc
+        self.total = total
+        self.interval = settings.log_progress_interval if interval is None else interval
+        self.count = 0
+        self._start = self._last = time.monotonic()
+
+    def update(self, n: int = 1) -> None:
+        """Counts `n` more iterations, logging the progress if the interval elapsed."""
+        self.count += n
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.logger.info(
+                "%s: %d/%s done, %.1f/s",
+                self.desc,
+                self.count,
+                "?" if self.total is None else self.total,
+                self.count / (now - self._start),
+            )
+
+    def close(self) -> None:
+        """Logs the summary of the loop."""
+        self.logger.info(
+            "%s: %d done in %.1f s",
+            self.desc,
+            self.count,
+            time.monotonic() - self._start,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
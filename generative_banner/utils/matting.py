@@ -0,0 +1,121 @@
+"""Utility - Alpha Mask Upsampling.
+
+Segmenting an actor at full resolution costs in proportion to its pixel count, while
+only the pixels along its outline are uncertain. A mask computed at a reduced working
+resolution is upsampled, and refined at full resolution with a guided filter only in
+the tiles crossed by its edge, so the refinement costs in proportion to the edge
+length.
+"""
+
+import math
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# Side of the square tiles refined at full resolution.
+TILE_SIZE = 64
+
+
+def _box_filter(x: np.ndarray, r: int) -> np.ndarray:
+    """Mean over the (2r + 1) x (2r + 1) window around each pixel, edges replicated."""
+    padded = np.pad(x, ((r + 1, r), (r + 1, r)), mode="edge")
+    c = padded.cumsum(axis=0).cumsum(axis=1)
+    d = 2 * r + 1
+    total = c[d:, d:] - c[:-d, d:] - c[d:, :-d] + c[:-d, :-d]
+    return total / (d * d)
+
+
+def guided_filter(
+    guide: np.ndarray, src: np.ndarray, r: int, eps: float = 1e-3
+) -> np.ndarray:
+    """Filters an image so that its edges follow the ones of a guide image.
+
+    He et al., Guided Image Filtering, 2013.
+
+    Args:
+        guide: Grayscale guide image, floats from 0 to 1.
+        src: Image to filter, e.g. a blurry alpha mask, floats from 0 to 1.
+        r: Radius of the local windows.
+        eps: Regularization, a larger value smooths more.
+
+    Returns:
+        The filtered image, same shape as `src`.
+    """
+    mean_i = _box_filter(guide, r)
+    mean_p = _box_filter(src, r)
+    var_i = _box_filter(guide * guide, r) - mean_i * mean_i
+    cov_ip = _box_filter(guide * src, r) - mean_i * mean_p
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    return _box_filter(a, r) * guide + _box_filter(b, r)
+
+
+def _edge_tiles(coarse_alpha: np.ndarray, size: tuple[int, int]) -> set[tuple]:
+    """Lists the full resolution tiles crossed by the edge of a coarse mask."""
+    mask = Image.fromarray(coarse_alpha)
+    # A pixel is on the edge if partially transparent or next to a different one.
+    spread = np.asarray(mask.filter(ImageFilter.MaxFilter(3))).astype(np.int16)
+    spread -= np.asarray(mask.filter(ImageFilter.MinFilter(3)))
+    partial = (coarse_alpha > 0) & (coarse_alpha < 255)
+    ys, xs = np.nonzero((spread > 0) | partial)
+
+    height, width = coarse_alpha.shape
+    scale_y, scale_x = size[1] / height, size[0] / width
+    tiles = set()
+    # Both the first and the last full resolution pixel of a coarse one.
+    for y in (ys * scale_y, (ys + 1) * scale_y - 1):
+        for x in (xs * scale_x, (xs + 1) * scale_x - 1):
+            tiles.update(
+                zip(
+                    (y // TILE_SIZE).astype(int).tolist(),
+                    (x // TILE_SIZE).astype(int).tolist(),
+                )
+            )
+    return tiles
+
+
+def upsample_alpha(
+    image: Image.Image, coarse_alpha: np.ndarray, eps: float = 1e-3
+) -> np.ndarray:
+    """Upsamples a coarse alpha mask to the size of its image, refining its edge.
+
+    Args:
+        image: Full resolution image the mask was computed from a downscale of.
+        coarse_alpha: Alpha mask at the working resolution, uint8.
+        eps: Regularization of the guided filter, a smaller value keeps finer details
+            such as hair.
+
+    Returns:
+        The alpha mask at the size of the image, uint8.
+    """
+    width, height = image.size
+    upsampled = np.asarray(
+        Image.fromarray(coarse_alpha).resize((width, height), Image.BILINEAR)
+    )
+    alpha = upsampled.copy()
+    # The upsampled edge is blurred over about one coarse pixel, refined around it.
+    scale = max(width / coarse_alpha.shape[1], height / coarse_alpha.shape[0])
+    r = max(2, math.ceil(2 * scale))
+    pad = 2 * r  # the filter output at a pixel depends on guide pixels up to 2r away
+
+    for ty, tx in _edge_tiles(coarse_alpha, image.size):
+        top, left = ty * TILE_SIZE, tx * TILE_SIZE
+        bottom, right = min(height, top + TILE_SIZE), min(width, left + TILE_SIZE)
+        if top >= height or left >= width:
+            continue
+        box = (max(0, left - pad), max(0, top - pad))
+        box += (min(width, right + pad), min(height, bottom + pad))
+
+        guide = np.asarray(image.crop(box).convert("L"), dtype=np.float64) / 255
+        src = upsampled[box[1] : box[3], box[0] : box[2]] / 255
+        refined = guided_filter(guide, src, r, eps)
+        # Pixels away from the blurred edge keep their value, rather than the texture
+        # of the guide leaking into opaque or transparent areas.
+        uncertain = ((src > 0) & (src < 1)).astype(np.float64)
+        refined = np.where(_box_filter(uncertain, r) > 0, refined, src)
+        # The filter leaves a faint halo around edges, snapped to the nearest extreme.
+        refined = np.where(refined < 0.02, 0, np.where(refined > 0.98, 1, refined))
+
+        inner = refined[top - box[1] : bottom - box[1], left - box[0] : right - box[0]]
+        alpha[top:bottom, left:right] = np.clip(inner * 255 + 0.5, 0, 255)
+    return alpha
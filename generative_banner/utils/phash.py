@@ -0,0 +1,329 @@
+"""Utility - Perceptual Hash Index of Actors.
+
+Imagen often returns near-identical images, each of which would otherwise go through
+background removal and a render per template. Actors of the library are indexed by
+their difference hash (dHash): 64 bits telling whether each pixel of a 9x8 grayscale
+thumbnail is brighter than its right neighbour. Near-identical images differ by a few
+bits, so an actor within `settings.actor_duplicate_distance` bits of an earlier one
+is flagged as its duplicate, and skipped by preprocessing and banner generation.
+Actors the user chose to keep are never flagged, see :meth:`ActorIndex.keep`.
+
+The index is a SQLite file updated incrementally, an actor being hashed again only
+if its file was modified. Actors are listed from the artefacts storage and hashed from
+their local copies, so a host indexes the whole library whatever it has downloaded.
+"""
+
+import contextlib
+import functools
+import logging
+import os
+import sqlite3
+import time
+from collections.abc import Collection
+
+import numpy as np
+from PIL import Image
+
+from generative_banner.config import settings
+from generative_banner.utils.storage import Storage, get_storage, local_copy
+
+logger = logging.getLogger(__name__)
+
+# Side of the hash grid, the hash has HASH_SIZE * HASH_SIZE bits.
+HASH_SIZE = 8
+
+
+def dhash(image: Image.Image) -> int:
+    """Difference hash of an image, robust to rescaling and recompression."""
+    # Transparent pixels are hashed as black whatever their color.
+    if image.mode in ("RGBA", "LA", "PA"):
+        background = Image.new("RGBA", image.size, (0, 0, 0, 255))
+        image = Image.alpha_composite(background, image.convert("RGBA"))
+    thumbnail = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes."""
+    return (a ^ b).bit_count()
+
+
+def _hash_file(path: str) -> int:
+    with Image.open(path) as img:
+        # Decodes JPEG files at a reduced size, a no-op for other formats.
+        img.draft("RGB", (HASH_SIZE * 16, HASH_SIZE * 16))
+        return dhash(img)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS actors (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    duplicate_of TEXT,
+    keep INTEGER NOT NULL DEFAULT 0,
+    indexed_at REAL NOT NULL
+);
+"""
+
+
+class ActorIndex:
+    """Perceptual hashes of the actors of a folder, with their duplicates flagged.
+
+    Args:
+        path: Path to the SQLite file, created if it does not exist.
+        storage: Storage of the actors.
+        storage_root: Local folder of the storage, or of its local copies, see
+            :func:`utils.storage.local_copy`.
+        folder: Key of the folder of the actors in the storage. Paths are stored
+            relative to its local folder.
+        max_distance: Maximum number of differing bits for an actor to be a duplicate
+            of an earlier one, negative to flag none.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        storage: Storage,
+        storage_root: str,
+        folder: str,
+        max_distance: int,
+    ):
+        self.path = path
+        self.storage = storage
+        self.storage_root = storage_root
+        self.folder = folder
+        self.root = os.path.join(storage_root, *folder.split("/"))
+        self.max_distance = max_distance
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            # Indexes created before actors could be kept lack the column.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(actors)")}
+            if "keep" not in columns:
+                conn.execute(
+                    "ALTER TABLE actors ADD COLUMN keep INTEGER NOT NULL DEFAULT 0"
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _relpath(self, path: str) -> str:
+        return os.path.relpath(path, self.root)
+
+    def _abspath(self, relpath: str) -> str:
+        return os.path.normpath(os.path.join(self.root, relpath))
+
+    def _assign(self, conn, entries):
+        """Flags each entry as a duplicate of the nearest original, if near enough.
+
+        Entries are assigned in order, so that the first of near-identical ones
+        stays the original. Kept entries are never flagged.
+        """
+        assigned = {path for path, _ in entries}
+        kept = {path for (path,) in conn.execute("SELECT path FROM actors WHERE keep")}
+        originals = [
+            (path, int(hash_hex, 16))
+            for path, hash_hex in conn.execute(
+                "SELECT path, hash FROM actors WHERE duplicate_of IS NULL"
+            )
+            if path not in assigned
+        ]
+        duplicates = {}
+        for path, hash_value in entries:
+            candidates = [
+                (hamming_distance(hash_value, other_hash), other_path)
+                for other_path, other_hash in originals
+            ]
+            distance, original = min(candidates, default=(None, None))
+            if (
+                path not in kept
+                and distance is not None
+                and distance <= self.max_distance
+            ):
+                duplicates[path] = original
+            else:
+                originals.append((path, hash_value))
+                original = None
+            conn.execute(
+                "UPDATE actors SET duplicate_of = ? WHERE path = ?", (original, path)
+            )
+        return duplicates
+
+    @staticmethod
+    def _keep(conn, relpaths):
+        for relpath in relpaths:
+            conn.execute(
+                "UPDATE actors SET keep = 1, duplicate_of = NULL WHERE path = ?",
+                (relpath,),
+            )
+
+    def update(self, paths: list[str], keep: Collection[str] = ()) -> dict[str, str]:
+        """Indexes new or modified actors.
+
+        Args:
+            paths: Paths of the actors, within the root folder.
+            keep: Paths of the actors to keep even if near-duplicates.
+
+        Returns:
+            Dict of (path -> path of the original) for the actors flagged duplicates,
+            normalized with `os.path.normpath`.
+        """
+        with contextlib.closing(self._connect()) as conn:
+            indexed = dict(conn.execute("SELECT path, mtime_ns FROM actors"))
+
+        # Hashed outside of the transaction, which only holds the write lock briefly.
+        hashed = []
+        for path in sorted(paths):
+            mtime_ns = os.stat(path).st_mtime_ns
+            if indexed.get(self._relpath(path)) != mtime_ns:
+                hashed.append((self._relpath(path), mtime_ns, _hash_file(path)))
+
+        with self._transaction() as conn:
+            for relpath, mtime_ns, hash_value in hashed:
+                # Whether an actor is kept survives its file being modified.
+                conn.execute(
+                    "INSERT INTO actors (path, mtime_ns, hash, indexed_at) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET "
+                    "mtime_ns = excluded.mtime_ns, hash = excluded.hash, "
+                    "duplicate_of = NULL, indexed_at = excluded.indexed_at",
+                    (relpath, mtime_ns, f"{hash_value:016x}", time.time()),
+                )
+            self._keep(conn, [self._relpath(path) for path in keep])
+            duplicates = self._assign(
+                conn, [(relpath, hash_value) for relpath, _, hash_value in hashed]
+            )
+        if hashed:
+            logger.info(
+                "Indexed %d actors, %d near-duplicates", len(hashed), len(duplicates)
+            )
+        return {
+            self._abspath(relpath): self._abspath(original)
+            for relpath, original in duplicates.items()
+        }
+
+    def sync(self) -> dict[str, str]:
+        """Indexes all actors of the storage folder, forgetting the deleted ones.
+
+        Actors not indexed yet are downloaded to be hashed. Indexed actors are hashed
+        again only if their local copy was modified, and kept if they have none.
+
+        Returns:
+            See :meth:`update`, for the newly indexed actors.
+        """
+        keys = [
+            key
+            for key in self.storage.list_files(f"{self.folder}/")
+            if key.endswith(".png")
+        ]
+        local_paths = {
+            key: os.path.join(self.storage_root, *key.split("/")) for key in keys
+        }
+        existing = {self._relpath(path) for path in local_paths.values()}
+        with self._transaction() as conn:
+            removed = [
+                path
+                for (path,) in conn.execute("SELECT path FROM actors")
+                if path not in existing
+            ]
+            for path in removed:
+                conn.execute("DELETE FROM actors WHERE path = ?", (path,))
+            # Duplicates of a deleted actor are assigned again.
+            orphans = [
+                (path, int(hash_hex, 16))
+                for path, hash_hex in conn.execute(
+                    "SELECT path, hash FROM actors WHERE duplicate_of IS NOT NULL "
+                    "AND duplicate_of NOT IN (SELECT path FROM actors) "
+                    "ORDER BY indexed_at"
+                )
+            ]
+            if orphans:
+                self._assign(conn, orphans)
+            indexed = {path for (path,) in conn.execute("SELECT path FROM actors")}
+        paths = [
+            local_copy(self.storage, key, self.storage_root)
+            for key, path in local_paths.items()
+            if self._relpath(path) not in indexed or os.path.exists(path)
+        ]
+        return self.update(paths)
+
+    def keep(self, paths: list[str]) -> None:
+        """Unflags indexed actors, which are no longer flagged even if near-duplicates.
+
+        Args:
+            paths: Paths of the actors, within the root folder.
+        """
+        with self._transaction() as conn:
+            self._keep(conn, [self._relpath(path) for path in paths])
+        logger.info("Kept %d actors", len(paths))
+
+    def matches(self, images: dict[str, Image.Image]) -> dict[str, str]:
+        """Finds the near-duplicates among images not yet indexed, e.g. to approve.
+
+        Images are compared in the order of their names, as :meth:`update` would
+        flag them, but nothing is indexed.
+
+        Args:
+            images: Dict of (name -> image).
+
+        Returns:
+            Dict of (name -> path of the original actor, or name of an earlier image)
+            for the images that would be flagged duplicates.
+        """
+        with contextlib.closing(self._connect()) as conn:
+            originals = [
+                (self._abspath(path), int(hash_hex, 16))
+                for path, hash_hex in conn.execute(
+                    "SELECT path, hash FROM actors WHERE duplicate_of IS NULL"
+                )
+            ]
+        matches = {}
+        for name in sorted(images):
+            hash_value = dhash(images[name])
+            distance, original = min(
+                (
+                    (hamming_distance(hash_value, other_hash), other)
+                    for other, other_hash in originals
+                ),
+                default=(None, None),
+            )
+            if distance is not None and distance <= self.max_distance:
+                matches[name] = original
+            else:
+                originals.append((name, hash_value))
+        return matches
+
+    def duplicates(self) -> dict[str, str]:
+        """Lists the actors flagged duplicates, as (path -> path of the original)."""
+        with contextlib.closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT path, duplicate_of FROM actors WHERE duplicate_of IS NOT NULL"
+            ).fetchall()
+        return {self._abspath(path): self._abspath(original) for path, original in rows}
+
+
+@functools.cache
+def get_actor_index() -> ActorIndex:
+    """Gets the index of the actor folder of the artefacts."""
+    return ActorIndex(
+        settings.actor_index_path,
+        get_storage(settings.local_artefacts_dir),
+        settings.local_artefacts_dir,
+        settings.local_actor_dirname,
+        settings.actor_duplicate_distance,
+    )
@@ -0,0 +1,96 @@
+"""Utility - Decoded Pixel Store.
+
+Decoding a large transparent PNG is dominated by zlib, and a campaign decodes every
+processed actor again on each run. The store keeps the decoded RGBA pixels of an image
+file as a `.npy` sidecar, keyed by the file path and modification time, and memory
+maps it on later loads so that no decoding happens and the pages are shared through
+the OS page cache by every process rendering the same actors.
+"""
+
+import functools
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from generative_banner.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PixelStore:
+    """Decoded RGBA pixels of image files, as memory mapped `.npy` sidecars.
+
+    Args:
+        root: Folder of the sidecars, created if it does not exist.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _prefix(self, path: str) -> str:
+        digest = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+        return digest[:16]
+
+    def _sidecar(self, path: str, mtime_ns: int) -> str:
+        return os.path.join(self.root, f"{self._prefix(path)}-{mtime_ns}.npy")
+
+    def load(self, path: str) -> Image.Image:
+        """Loads an image in RGBA, decoding the file only if not stored yet.
+
+        Returns:
+            The image, read-only and backed by the memory mapped sidecar once stored.
+        """
+        sidecar = self._sidecar(path, os.stat(path).st_mtime_ns)
+        try:
+            pixels = np.load(sidecar, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return self._store(path, sidecar)
+        height, width, _ = pixels.shape
+        return Image.frombuffer("RGBA", (width, height), pixels, "raw", "RGBA", 0, 1)
+
+    def _store(self, path: str, sidecar: str) -> Image.Image:
+        with Image.open(path) as img:
+            image = img.convert("RGBA")
+
+        # Written to a temporary file then renamed, so that a concurrent process never
+        # maps a partial sidecar.
+        writer = f"{os.getpid()}-{threading.get_ident()}"
+        tmp = f"{sidecar[: -len('.npy')]}.{writer}.tmp.npy"
+        try:
+            np.save(tmp, np.asarray(image), allow_pickle=False)
+            os.replace(tmp, sidecar)
+        except OSError:
+            logger.warning(
+                "Failed to store the decoded pixels of %s", path, exc_info=True
+            )
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return image
+
+        # Sidecars of previous versions of the file are no longer reachable.
+        prefix = self._prefix(path)
+        for name in os.listdir(self.root):
+            stale = os.path.join(self.root, name)
+            if (
+                name.startswith(f"{prefix}-")
+                and ".tmp." not in name
+                and stale != sidecar
+            ):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+        return image
+
+
+@functools.cache
+def get_pixel_store() -> PixelStore | None:
+    """Gets the store in `settings.actor_pixel_dir`, None if not configured."""
+    if not settings.actor_pixel_dir:
+        return None
+    return PixelStore(settings.actor_pixel_dir)
@@ -0,0 +1,159 @@
+"""Utility - Rate Limiting of Model Calls.
+
+Vertex AI quotas are per project and model, shared by every replica of the app and
+every job worker. Each model call first takes a token from the bucket of its model,
+refilled at `settings.model_rate_limits` requests per minute, and waits for one if
+the bucket is empty rather than failing with a 429. With the default SQLite backend
+the buckets are shared by all processes using the same `settings.rate_limit_db_path`.
+
+The waits are recorded as `ratelimit.wait` spans with a `wait_seconds` attribute.
+"""
+
+import contextlib
+import functools
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from generative_banner.config import settings
+from generative_banner.utils.deadline import remaining
+from generative_banner.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter(ABC):
+    """Token buckets by name."""
+
+    def acquire(
+        self, bucket: str, rate: float, capacity: float, timeout: float | None = None
+    ) -> float:
+        """Takes a token from a bucket, waiting until one is available.
+
+        Args:
+            bucket: Name of the bucket, e.g. a model name.
+            rate: Tokens added per second.
+            capacity: Maximum number of tokens, i.e. of calls in a burst.
+            timeout: Maximum number of seconds to wait, unbounded if None.
+
+        Returns:
+            The number of seconds waited.
+
+        Raises:
+            TimeoutError: If no token would be available within the timeout.
+        """
+        start = time.monotonic()
+        while (wait := self._take(bucket, rate, capacity)) > 0:
+            if timeout is not None and time.monotonic() + wait - start > timeout:
+                raise TimeoutError(f"No {bucket} quota within {timeout:.1f} s")
+            time.sleep(wait)
+        return time.monotonic() - start
+
+    @abstractmethod
+    def _take(self, bucket: str, rate: float, capacity: float) -> float:
+        """Takes a token if available and returns 0, else the seconds until one is."""
+
+
+def _refill(tokens, updated_at, now, rate, capacity):
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Buckets of the current process only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def _take(self, bucket, rate, capacity):
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at = self._buckets.get(bucket, (capacity, now))
+            tokens = _refill(tokens, updated_at, now, rate, capacity)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[bucket] = (tokens - 1 if wait == 0 else tokens, now)
+            return wait
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteRateLimiter(RateLimiter):
+    """Buckets in a SQLite file, shared by the processes of a host.
+
+    Args:
+        path: Path to the SQLite file, created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _take(self, bucket, rate, capacity):
+        with contextlib.closing(self._connect()) as conn:
+            # Takes the write lock upfront, so that two processes never take the
+            # same token.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Wall clock time, the monotonic clock is not shared by processes.
+                now = time.time()
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM buckets WHERE name = ?", (bucket,)
+                ).fetchone()
+                tokens, updated_at = row if row else (capacity, now)
+                tokens = _refill(tokens, updated_at, now, rate, capacity)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) "
+                    "VALUES (?, ?, ?)",
+                    (bucket, tokens - 1 if wait == 0 else tokens, now),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+
+@functools.cache
+def get_rate_limiter() -> RateLimiter:
+    """Gets the limiter of `settings.rate_limit_db_path`, in memory if blank."""
+    if not settings.rate_limit_db_path:
+        return MemoryRateLimiter()
+    return SQLiteRateLimiter(settings.rate_limit_db_path)
+
+
+def wait_for_quota(model: str) -> None:
+    """Waits for a call of a model to be within its rate limit, if it has one.
+
+    Args:
+        model: Model name, looked up in `settings.model_rate_limits`.
+
+    Raises:
+        TimeoutError: If the call would not be within the limit before the current
+            deadline, see `utils/deadline.py`.
+    """
+    requests_per_minute = settings.model_rate_limits.get(model)
+    if not requests_per_minute:
+        return
+
+    rate = requests_per_minute / 60
+    capacity = max(1.0, rate * settings.rate_limit_burst_seconds)
+    with span("ratelimit.wait", bucket=model) as s:
+        waited = get_rate_limiter().acquire(model, rate, capacity, remaining())
+        s.set_attribute("wait_seconds", round(waited, 3))
+    if waited > 0:
+        logger.debug("Waited %.2f s for the rate limit of %s", waited, model)
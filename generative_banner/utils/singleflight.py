@@ -0,0 +1,93 @@
+"""Utility - Coalescing of Identical Concurrent Calls.
+
+Several users generating visuals of the same segment at the same time send identical
+prompts to Gemini and Imagen. A function decorated with :func:`single_flight` runs
+once for concurrent calls with the same arguments, the callers arriving while it runs
+wait for it and share its result or its exception. Calls made after it returns run
+again, nothing is cached.
+
+.. code-block:: python
+    @single_flight(normalize={"prompt": normalize_prompt})
+    def generate(prompt: str, n: int = 1) -> list[Image.Image]: ...
+"""
+
+import functools
+import inspect
+import json
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapses whitespace, which does not change the meaning of a prompt."""
+    return " ".join(prompt.split())
+
+
+class SingleFlight:
+    """Group of calls, each key running at most once at a time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """Calls a function, or waits for the call in flight with the same key.
+
+        Returns:
+            The result of the call, shared with the other callers of the key.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            logger.debug("Waiting for the identical call in flight of %s", fn.__name__)
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+def single_flight(normalize: dict[str, Callable] | None = None):
+    """Decorates a function so that identical concurrent calls share one call.
+
+    Args:
+        normalize: Functions by argument name, applied to the argument before
+            comparing calls, e.g. :func:`normalize_prompt`.
+    """
+    normalize = normalize or {}
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        group = SingleFlight()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {
+                name: normalize[name](value) if name in normalize else value
+                for name, value in bound.arguments.items()
+            }
+            # Arguments such as model configurations are compared by their repr.
+            key = json.dumps(arguments, sort_keys=True, default=repr)
+            return group.do(key, fn, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,341 @@
+"""Utility - Storage Backends.
+
+Files are addressed by `/` separated keys relative to the root of a storage, and read
+and written as bytes or streams, so that generated images and banners go straight to
+their destination whether it is a local folder or a GCS bucket.
+"""
+
+import io
+import mimetypes
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from typing import BinaryIO
+
+from google.api_core.exceptions import NotFound
+
+import generative_banner.constants as C
+from generative_banner.config import settings
+from generative_banner.utils.gcs import delete_blobs_in_gcs_bucket, get_storage_client
+
+
+class Storage(ABC):
+    """Backend-agnostic file storage."""
+
+    @abstractmethod
+    def read_bytes(self, key: str) -> bytes:
+        """Reads a file, raising `FileNotFoundError` if it does not exist."""
+
+    @abstractmethod
+    def write_bytes(self, key: str, data: bytes) -> None:
+        """Writes a file, overwriting it if it exists."""
+
+    @abstractmethod
+    def open(self, key: str, mode: str = "rb") -> BinaryIO:
+        """Opens a file as a binary stream, `mode` is either `rb` or `wb`."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Checks whether a file exists."""
+
+    @abstractmethod
+    def list_files(self, prefix: str = "") -> list[str]:
+        """Lists the keys of all files starting with a prefix, recursively."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Deletes a file, ignoring it if it does not exist."""
+
+    def delete_many(self, keys: list[str]) -> None:
+        """Deletes files, ignoring the missing ones."""
+        for key in keys:
+            self.delete(key)
+
+    def local_path(self, key: str) -> str | None:
+        """Returns the path of a file on the local filesystem, None if it has none."""
+        return None
+
+
+def _tmp_path(path: str) -> str:
+    # Hidden, in the same folder so that the rename is atomic.
+    writer = f"{os.getpid()}-{threading.get_ident()}"
+    return os.path.join(
+        os.path.dirname(path), f".{os.path.basename(path)}.{writer}.tmp"
+    )
+
+
+class AtomicWriter(io.FileIO):
+    """Local file written to a temporary file, renamed to its path once closed.
+
+    A reader never gets a partial file, even if the writer is killed. The temporary
+    file is removed instead if its `with` block raises.
+
+    Args:
+        path: Path of the file.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._discard = False
+        super().__init__(_tmp_path(path), "wb")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._discard = exc_type is not None
+        return super().__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        if self._discard:
+            os.remove(self.name)
+        else:
+            os.replace(self.name, self._path)
+
+
+class LocalStorage(Storage):
+    """Storage in a local folder."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def read_bytes(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def write_bytes(self, key, data):
+        with self.open(key, "wb") as f:
+            f.write(data)
+
+    def open(self, key, mode="rb"):
+        path = self._path(key)
+        if "w" in mode:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return AtomicWriter(path)
+        return open(path, mode)
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def list_files(self, prefix=""):
+        # Only walk the deepest folder covering the prefix.
+        folder = self._path(prefix.rpartition("/")[0])
+        keys = []
+        for root, _, filenames in os.walk(folder):
+            for filename in filenames:
+                if filename.startswith(".") and filename.endswith(".tmp"):
+                    continue  # Being written, see `AtomicWriter`.
+                path = os.path.relpath(os.path.join(root, filename), self.root)
+                key = path.replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        return self._path(key)
+
+
+class GCSStorage(Storage):
+    """Storage in a folder of a GCS bucket."""
+
+    def __init__(self, bucket_name: str, prefix: str = "", project_id=None):
+        self.bucket_name = bucket_name
+        self.prefix = f"{prefix.strip('/')}/" if prefix.strip("/") else ""
+        self.project_id = project_id
+        self.bucket = get_storage_client(project_id).bucket(bucket_name)
+
+    def _blob(self, key: str):
+        return self.bucket.blob(self.prefix + key)
+
+    def read_bytes(self, key):
+        try:
+            return self._blob(key).download_as_bytes()
+        except NotFound as e:
+            raise FileNotFoundError(
+                f"gs://{self.bucket_name}/{self.prefix}{key}"
+            ) from e
+
+    def write_bytes(self, key, data):
+        content_type, _ = mimetypes.guess_type(key)
+        self._blob(key).upload_from_string(
+            data, content_type=content_type or "application/octet-stream"
+        )
+
+    def open(self, key, mode="rb"):
+        try:
+            return self._blob(key).open(mode)
+        except NotFound as e:
+            raise FileNotFoundError(
+                f"gs://{self.bucket_name}/{self.prefix}{key}"
+            ) from e
+
+    def exists(self, key):
+        return self._blob(key).exists()
+
+    def list_files(self, prefix=""):
+        blobs = self.bucket.list_blobs(
+            prefix=self.prefix + prefix, fields="items(name),nextPageToken"
+        )
+        return [
+            blob.name.removeprefix(self.prefix)
+            for blob in blobs
+            if not blob.name.endswith("/")
+        ]
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def delete_many(self, keys):
+        delete_blobs_in_gcs_bucket(
+            self.bucket_name, [self.prefix + key for key in keys], self.project_id
+        )
+
+
+class _MemoryWriter(io.BytesIO):
+    def __init__(self, storage: "MemoryStorage", key: str):
+        super().__init__()
+        self._storage, self._key = storage, key
+
+    def close(self):
+        if not self.closed:
+            self._storage.write_bytes(self._key, self.getvalue())
+        super().close()
+
+
+class MemoryStorage(Storage):
+    """Storage in memory, e.g. to test without any filesystem or bucket."""
+
+    def __init__(self):
+        self.files: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def read_bytes(self, key):
+        with self._lock:
+            if key not in self.files:
+                raise FileNotFoundError(key)
+            return self.files[key]
+
+    def write_bytes(self, key, data):
+        with self._lock:
+            self.files[key] = bytes(data)
+
+    def open(self, key, mode="rb"):
+        if "w" in mode:
+            return _MemoryWriter(self, key)
+        return io.BytesIO(self.read_bytes(key))
+
+    def exists(self, key):
+        with self._lock:
+            return key in self.files
+
+    def list_files(self, prefix=""):
+        with self._lock:
+            return sorted(key for key in self.files if key.startswith(prefix))
+
+    def delete(self, key):
+        with self._lock:
+            self.files.pop(key, None)
+
+
+def move_file(src: Storage, src_key: str, dst: Storage, dst_key: str) -> None:
+    """Moves a file, without any copy through memory between local folders.
+
+    Args:
+        src: Storage to move from.
+        src_key: Key of the file in `src`.
+        dst: Storage to move to.
+        dst_key: Key of the file in `dst`.
+    """
+    src_path, dst_path = src.local_path(src_key), dst.local_path(dst_key)
+    if src_path is not None and dst_path is not None:
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        shutil.move(src_path, dst_path)
+    elif (
+        isinstance(src, GCSStorage)
+        and isinstance(dst, GCSStorage)
+        and src.project_id == dst.project_id
+    ):
+        # Server-side copy, the content never leaves GCS.
+        src.bucket.copy_blob(src._blob(src_key), dst.bucket, dst.prefix + dst_key)
+        src.delete(src_key)
+    else:
+        with src.open(src_key, "rb") as f_src, dst.open(dst_key, "wb") as f_dst:
+            shutil.copyfileobj(f_src, f_dst)
+        src.delete(src_key)
+
+
+def local_copy(storage: Storage, key: str, root: str) -> str:
+    """Returns a path of a file on the local filesystem, downloading it if needed.
+
+    Files of a storage without local paths are downloaded once under a local
+    folder, e.g. actors read by the background removal and the renderer.
+
+    Args:
+        storage: Storage of the file.
+        key: Key of the file.
+        root: Local folder of the downloaded files, at the same keys.
+
+    Returns:
+        Path of the file, or of its local copy.
+    """
+    path = storage.local_path(key)
+    if path is not None:
+        return path
+    path = os.path.join(root, *key.split("/"))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with storage.open(key, "rb") as f_src, AtomicWriter(path) as f_dst:
+            shutil.copyfileobj(f_src, f_dst)
+    return path
+
+
+def save_local_copy(storage: Storage, key: str, path: str) -> None:
+    """Writes a file created at a path from :func:`local_copy` to its storage.
+
+    Args:
+        storage: Storage of the file.
+        key: Key of the file.
+        path: Path of the local file, written in place if it is the storage's own.
+    """
+    if storage.local_path(key) is None:
+        with open(path, "rb") as f_src, storage.open(key, "wb") as f_dst:
+            shutil.copyfileobj(f_src, f_dst)
+
+
+_storages: dict[str, Storage] = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(root: str) -> Storage:
+    """Returns the shared storage of a root folder for `settings.storage_backend`.
+
+    Args:
+        root: Local folder such as `settings.local_artefacts_dir`. The GCS backend
+            maps it to a folder of the same name in `settings.storage_bucket`.
+
+    Returns:
+        Storage rooted at the folder.
+    """
+    with _storages_lock:
+        if root not in _storages:
+            backend = C.StorageBackend(settings.storage_backend)
+            if backend == C.StorageBackend.GCS:
+                if not settings.storage_bucket:
+                    raise ValueError("The GCS storage backend requires STORAGE_BUCKET.")
+                prefix = os.path.normpath(root).strip(os.sep)
+                _storages[root] = GCSStorage(settings.storage_bucket, prefix)
+            elif backend == C.StorageBackend.MEMORY:
+                _storages[root] = MemoryStorage()
+            else:
+                _storages[root] = LocalStorage(root)
+        return _storages[root]
@@ -0,0 +1,230 @@
+"""Utility - Incremental Two-Way Sync Between a Local Folder and GCS.
+
+The state of the last sync is persisted in a JSON file inside the local folder. A
+file changed locally if its size or mtime differs from the state and its CRC32C
+does too (so only touched files get hashed), and an object changed remotely if its
+generation differs. Only the changed side is transferred, and a sync with nothing to
+do costs a single listing call.
+"""
+
+import base64
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Literal
+
+import google_crc32c
+from google.api_core.exceptions import GoogleAPICallError
+from google.cloud.storage import transfer_manager
+
+from generative_banner.config import settings
+from generative_banner.utils.gcs import delete_blobs_in_gcs_bucket, get_storage_client
+
+logger = logging.getLogger(__name__)
+
+SYNC_STATE_FILENAME = ".gcs-sync-state.json"
+
+
+def _crc32c(path: str) -> str:
+    """Computes the CRC32C of a file, base64 encoded as in GCS object metadata."""
+    checksum = google_crc32c.Checksum()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode("utf-8")
+
+
+def _list_local_files(local_folder_path: str) -> dict[str, os.stat_result]:
+    files = {}
+    for root, _, filenames in os.walk(local_folder_path):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, local_folder_path).replace(os.sep, "/")
+            if name != SYNC_STATE_FILENAME:
+                files[name] = os.stat(path)
+    return files
+
+
+def _load_state(state_path: str) -> dict[str, dict]:
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, "r") as f:
+        return json.load(f)
+
+
+def _save_state(state_path: str, state: dict[str, dict]) -> None:
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def _local_state(path: str, stat: os.stat_result, crc32c: str, generation) -> dict:
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "crc32c": crc32c,
+        "generation": generation,
+    }
+
+
+def sync_folder_with_gcs_bucket(
+    local_folder_path: str,
+    bucket_name: str,
+    gcs_folder: str = "",
+    project_id: str | None = None,
+    conflict: Literal["newer", "local", "remote"] = "newer",
+    propagate_deletes: bool = True,
+    max_workers: int | None = None,
+) -> dict[str, list[str]]:
+    """Syncs a local folder and a GCS folder both ways, transferring only the delta.
+
+    Args:
+        local_folder_path: Local folder to sync.
+        bucket_name: Name of the bucket.
+        gcs_folder: Folder in the bucket to sync.
+        project_id: GCP project, defaults to `settings.gcp_project`.
+        conflict: Side that wins when a file changed on both sides, `newer` compares
+            the local mtime with the object update time.
+        propagate_deletes: Whether a file deleted on one side since the last sync is
+            deleted on the other side, rather than restored.
+        max_workers: Number of concurrent transfers, defaults to
+            `settings.gcs_max_workers`.
+
+    Returns:
+        Dict of action (`uploaded`, `downloaded`, `deleted_local`, `deleted_remote`)
+        -> file names relative to the synced folders.
+    """
+    os.makedirs(local_folder_path, exist_ok=True)
+    prefix = f"{gcs_folder.rstrip('/')}/" if gcs_folder else ""
+    state_path = os.path.join(local_folder_path, SYNC_STATE_FILENAME)
+    max_workers = max_workers or settings.gcs_max_workers
+
+    bucket = get_storage_client(project_id).bucket(bucket_name)
+    remote = {
+        blob.name.removeprefix(prefix): blob
+        for blob in bucket.list_blobs(
+            prefix=prefix or None,
+            fields="items(name,size,crc32c,generation,updated),nextPageToken",
+        )
+        if not blob.name.endswith("/")  # folder placeholders
+    }
+    local = _list_local_files(local_folder_path)
+    state = _load_state(state_path)
+
+    new_state = {}
+    uploads, downloads, deleted_local, deleted_remote = [], [], [], []
+    for name in sorted(set(local) | set(remote) | set(state)):
+        path = os.path.join(local_folder_path, name)
+        stat, blob, previous = local.get(name), remote.get(name), state.get(name)
+
+        crc32c = None
+        local_changed = False
+        if stat is not None:
+            if (
+                previous is not None
+                and stat.st_size == previous["size"]
+                and stat.st_mtime_ns == previous["mtime_ns"]
+            ):
+                crc32c = previous["crc32c"]
+            else:
+                crc32c = _crc32c(path)
+                local_changed = previous is None or crc32c != previous["crc32c"]
+        remote_changed = blob is not None and (
+            previous is None or blob.generation != previous["generation"]
+        )
+
+        if stat is not None and blob is not None:
+            if crc32c == blob.crc32c:
+                new_state[name] = _local_state(path, stat, crc32c, blob.generation)
+                continue
+            if local_changed and remote_changed:
+                if conflict == "newer":
+                    local_updated = datetime.fromtimestamp(
+                        stat.st_mtime_ns / 1e9, tz=timezone.utc
+                    )
+                    upload = local_updated > blob.updated
+                else:
+                    upload = conflict == "local"
+            else:
+                upload = local_changed
+            (uploads if upload else downloads).append(name)
+        elif stat is not None:
+            if previous is not None and not local_changed and propagate_deletes:
+                deleted_local.append(name)
+            else:
+                uploads.append(name)
+        elif blob is not None:
+            if previous is not None and not remote_changed and propagate_deletes:
+                deleted_remote.append(name)
+            else:
+                downloads.append(name)
+        # Otherwise deleted on both sides, simply dropped from the state.
+
+    upload_pairs = [
+        (os.path.join(local_folder_path, name), bucket.blob(prefix + name))
+        for name in uploads
+    ]
+    download_pairs = [
+        (remote[name], os.path.join(local_folder_path, name)) for name in downloads
+    ]
+    for _, path in download_pairs:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Thread workers share the blob objects, which get their new metadata in place.
+    upload_results = transfer_manager.upload_many(
+        upload_pairs, worker_type=transfer_manager.THREAD, max_workers=max_workers
+    )
+    download_results = transfer_manager.download_many(
+        download_pairs, worker_type=transfer_manager.THREAD, max_workers=max_workers
+    )
+    failed = set()
+    if deleted_remote:
+        try:
+            delete_blobs_in_gcs_bucket(
+                bucket_name, [prefix + name for name in deleted_remote], project_id
+            )
+        except GoogleAPICallError as e:
+            logger.warning("Failed to delete blobs: %s", e)
+            failed.update(deleted_remote)
+    for name in deleted_local:
+        os.remove(os.path.join(local_folder_path, name))
+
+    for name, (path, blob), result in zip(uploads, upload_pairs, upload_results):
+        if isinstance(result, Exception):
+            logger.warning("Failed to upload %s: %s", name, result)
+            failed.add(name)
+            continue
+        new_state[name] = _local_state(
+            path, os.stat(path), blob.crc32c, blob.generation
+        )
+    for name, (blob, path), result in zip(downloads, download_pairs, download_results):
+        if isinstance(result, Exception):
+            logger.warning("Failed to download %s: %s", name, result)
+            failed.add(name)
+            continue
+        new_state[name] = _local_state(
+            path, os.stat(path), blob.crc32c, blob.generation
+        )
+
+    # Failed transfers and deletes keep their previous state, retried by the next sync.
+    for name in failed:
+        if name in state:
+            new_state[name] = state[name]
+    _save_state(state_path, new_state)
+
+    report = {
+        "uploaded": [name for name in uploads if name not in failed],
+        "downloaded": [name for name in downloads if name not in failed],
+        "deleted_local": deleted_local,
+        "deleted_remote": [name for name in deleted_remote if name not in failed],
+    }
+    logger.info(
+        "Synced %s with gs://%s/%s: %s",
+        local_folder_path,
+        bucket_name,
+        prefix,
+        ", ".join(f"{len(names)} {action}" for action, names in report.items()),
+    )
+    return report
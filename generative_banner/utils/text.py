@@ -9,6 +9,8 @@ from vertexai.generative_models import (
 
 from generative_banner.config import settings
 from generative_banner.model import Offer
+from generative_banner.utils.ratelimit import wait_for_quota
+from generative_banner.utils.singleflight import normalize_prompt, single_flight
 
 system_instructions = {
     "sms": "You are a Telco marketing expert that specializes in creating short, sincere, and concise marketing message in SMS format.",
@@ -24,6 +26,7 @@ user_profiles = {
 }
 
 
+@single_flight(normalize={"prompt": normalize_prompt})
 def invoke_gemini_for_text(
     prompt: str,
     model: str | None = None,
@@ -32,6 +35,7 @@ def invoke_gemini_for_text(
     if model is None:
         model = settings.text_model
 
+    wait_for_quota(model)
     gemini_model = GenerativeModel(model, generation_config=config)
     response = gemini_model.generate_content(prompt, generation_config=config)
     return response.text
@@ -82,6 +86,7 @@ def batch_generate_marketing_contents(
     results = {}
     for segment, user_profile in user_profiles.items():
         prompt = _prompt(offer, user_profile, n=n)
+        wait_for_quota(model_name)
         response = gemini_model.generate_content(prompt)
         results[segment] = response.text
 
@@ -0,0 +1,184 @@
+"""Utility - Timing Spans of the Generation Workflow.
+
+Stages are wrapped in spans with an OpenTelemetry-like API, exported according to
+`settings.tracing_exporter`:
+
+- `none`: the default, spans are no-ops.
+- `console`: one human-readable line per span, indented by depth.
+- `json`: one JSON line per span, e.g. to be loaded with `pandas.read_json(lines=True)`.
+- `otel`: spans are created by the OpenTelemetry tracer, which must be installed and
+  configured with a `TracerProvider` by the deployment.
+
+.. code-block:: python
+    with span("imagen.generate", model=model) as s:
+        images = generate_imagen_outputs(...)
+        s.set_attribute("n_images", len(images))
+"""
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
+
+import generative_banner.constants as C
+from generative_banner.config import settings
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_NOOP_CONTEXT = contextlib.nullcontext(_NOOP_SPAN)
+
+
+@dataclass
+class Span:
+    """Span recorded by the built-in exporters."""
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    depth: int
+    attributes: dict = field(default_factory=dict)
+    start_ns: int = field(default_factory=time.time_ns)
+    duration_ns: int = 0
+    status: str = "OK"
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time_ns": self.start_ns,
+            "duration_ms": round(self.duration_ns / 1e6, 3),
+            "status": self.status,
+            "thread": threading.current_thread().name,
+            "attributes": self.attributes,
+        }
+
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+_output_lock = threading.Lock()
+
+
+def _export(span: Span, exporter: C.TracingExporter) -> None:
+    if exporter == C.TracingExporter.JSON:
+        line = json.dumps(span.to_dict(), default=str)
+    else:
+        attributes = " ".join(f"{k}={v}" for k, v in span.attributes.items())
+        line = (
+            f"[trace {span.trace_id[:8]}] {'  ' * span.depth}{span.name} "
+            f"{span.duration_ns / 1e6:.1f} ms {span.status} {attributes}".rstrip()
+        )
+
+    with _output_lock:
+        if settings.tracing_file:
+            with open(settings.tracing_file, "a") as f:
+                f.write(line + "\n")
+        else:
+            print(line, file=sys.stderr)
+
+
+@contextlib.contextmanager
+def _builtin_span(name: str, attributes: dict, exporter: C.TracingExporter):
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        trace_id=parent.trace_id if parent else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent else None,
+        depth=parent.depth + 1 if parent else 0,
+        attributes=attributes,
+    )
+    token = _current_span.set(current)
+    start = time.perf_counter_ns()
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "ERROR"
+        current.set_attribute("exception.type", type(e).__name__)
+        current.set_attribute("exception.message", str(e))
+        raise
+    finally:
+        current.duration_ns = time.perf_counter_ns() - start
+        _current_span.reset(token)
+        _export(current, exporter)
+
+
+@functools.cache
+def _otel_tracer():
+    try:
+        from opentelemetry import trace
+    except ImportError as e:
+        raise ImportError(
+            "The `otel` tracing exporter requires the `opentelemetry-api` package."
+        ) from e
+    return trace.get_tracer("generative_banner")
+
+
+def span(name: str, **attributes):
+    """Times a stage of the workflow.
+
+    Args:
+        name: Name of the stage, dot separated from the most general, e.g.
+            `render.layer`.
+        **attributes: Attributes of the span, more can be set on the yielded span.
+
+    Returns:
+        Context manager yielding the span.
+    """
+    exporter = settings.tracing_exporter
+    if exporter == C.TracingExporter.NONE:
+        return _NOOP_CONTEXT
+    if exporter == C.TracingExporter.OTEL:
+        return _otel_tracer().start_as_current_span(name, attributes=attributes)
+    return _builtin_span(name, attributes, C.TracingExporter(exporter))
+
+
+def traced(name: str | None = None):
+    """Decorates a function to run within a span, named after the function if None.
+
+    A coroutine function is decorated into one that awaits it within the span.
+    """
+
+    def decorator(fn):
+        span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def submit_in_context(executor: Executor, fn, *args, **kwargs) -> Future:
+    """Submits a function to an executor, within the current span."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
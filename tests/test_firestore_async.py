@@ -0,0 +1,193 @@
+"""Tests of the async document helpers, against SQLite and an in-memory Firestore."""
+
+import tempfile
+import unittest
+
+import generative_banner.constants as C
+from generative_banner.utils.documents import (
+    FirestoreDocumentStore,
+    SQLiteDocumentStore,
+)
+from generative_banner.utils.firestore import (
+    add_or_update_bannertemplate_async,
+    add_or_update_visual_segment_async,
+    fetch_visual_segment_names_async,
+    get_bannertemplate_list_async,
+    get_template_configuration_async,
+    get_visual_segment_config_by_name_async,
+)
+
+SEGMENT = {
+    "visualsegment": "Gen Z Gamer",
+    "subject": "A young gamer",
+    "age": "20",
+}
+TEMPLATE = {
+    "bannertemplate": "Template1",
+    "background_size": {"width": 1200, "height": 628},
+    "actor_position": {"x": 10, "y": 20, "width": 300, "height": 400},
+    "logo_position": {"x": 900, "y": 10, "width": 100, "height": 50, "color": "red"},
+}
+
+
+class _Snapshot:
+    def __init__(self, id, data):
+        self.id = id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _DocumentRef:
+    def __init__(self, documents, id):
+        self._documents = documents
+        self.id = id
+
+    async def get(self):
+        return _Snapshot(self.id, self._documents.get(self.id))
+
+    async def set(self, data):
+        self._documents[self.id] = dict(data)
+
+    async def update(self, data):
+        self._documents[self.id].update(data)
+
+
+class _CollectionRef:
+    def __init__(self, documents, filter=None):
+        self._documents = documents
+        self._filter = filter
+
+    def document(self, id):
+        return _DocumentRef(self._documents, id)
+
+    def where(self, filter):
+        return _CollectionRef(self._documents, filter)
+
+    async def stream(self):
+        for id, data in list(self._documents.items()):
+            if self._filter is None or (
+                self._filter.op_string == "=="
+                and data.get(self._filter.field_path) == self._filter.value
+            ):
+                yield _Snapshot(id, data)
+
+
+class FakeAsyncClient:
+    """In-memory stand-in of the Firestore async client, for the calls of the store."""
+
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name):
+        return _CollectionRef(
+            self.collections.setdefault(getattr(name, "value", name), {})
+        )
+
+
+def _firestore_store() -> FirestoreDocumentStore:
+    # Without connecting, the async methods only use the async client.
+    store = FirestoreDocumentStore.__new__(FirestoreDocumentStore)
+    store.async_client = FakeAsyncClient()
+    return store
+
+
+class _AsyncHelpersTests:
+    """Tests run against the store returned by `make_store`.
+
+    Subclasses are test cases defining `make_store`, which returns a new store.
+    """
+
+    def setUp(self):
+        self.db = self.make_store()
+
+    async def test_fetch_visual_segment_names(self):
+        self.assertEqual(await fetch_visual_segment_names_async(self.db), [])
+        await self.db.set_async(C.DocKey.SEGMENT, SEGMENT["visualsegment"], SEGMENT)
+        self.assertEqual(
+            await fetch_visual_segment_names_async(self.db), ["Gen Z Gamer"]
+        )
+
+    async def test_get_visual_segment_config_by_name(self):
+        await self.db.set_async(C.DocKey.SEGMENT, "Other", {"visualsegment": "Other"})
+        await self.db.set_async(C.DocKey.SEGMENT, SEGMENT["visualsegment"], SEGMENT)
+        config = await get_visual_segment_config_by_name_async(self.db, "Gen Z Gamer")
+        self.assertEqual(config, SEGMENT)
+
+    async def test_get_visual_segment_config_by_name_missing(self):
+        with self.assertRaises(IndexError):
+            await get_visual_segment_config_by_name_async(self.db, "Missing")
+
+    async def test_add_or_update_visual_segment(self):
+        result = await add_or_update_visual_segment_async(self.db, SEGMENT)
+        self.assertEqual(result, "created")
+        self.assertEqual(
+            await self.db.get_async(C.DocKey.SEGMENT, "Gen Z Gamer"), SEGMENT
+        )
+
+        update = {"visualsegment": "Gen Z Gamer", "age": "25"}
+        result = await add_or_update_visual_segment_async(self.db, update)
+        self.assertEqual(result, "updated")
+        # Only the given fields are replaced.
+        self.assertEqual(
+            await self.db.get_async(C.DocKey.SEGMENT, "Gen Z Gamer"),
+            {**SEGMENT, "age": "25"},
+        )
+
+    async def test_add_or_update_bannertemplate(self):
+        result = await add_or_update_bannertemplate_async(self.db, TEMPLATE)
+        self.assertEqual(result, "created")
+        self.assertEqual(await get_bannertemplate_list_async(self.db), ["Template1"])
+
+        update = {"bannertemplate": "Template1", "logo_position": {"x": 0, "y": 0}}
+        result = await add_or_update_bannertemplate_async(self.db, update)
+        self.assertEqual(result, "updated")
+        template = await self.db.get_async(C.DocKey.TEMPLATE, "Template1")
+        self.assertEqual(template["logo_position"], {"x": 0, "y": 0})
+        self.assertEqual(template["actor_position"], TEMPLATE["actor_position"])
+
+    async def test_get_template_configuration(self):
+        await self.db.set_async(C.DocKey.TEMPLATE, "Template1", TEMPLATE)
+        boxes = await get_template_configuration_async(self.db, "Template1")
+        self.assertEqual(
+            boxes,
+            [
+                {
+                    "label": "actor_position",
+                    "xmin": 10,
+                    "ymin": 20,
+                    "xmax": 310,
+                    "ymax": 420,
+                    "color": (52, 168, 83),
+                },
+                {
+                    "label": "logo_position",
+                    "xmin": 900,
+                    "ymin": 10,
+                    "xmax": 1000,
+                    "ymax": 60,
+                    "color": "red",
+                },
+            ],
+        )
+        # The stored template is left as is.
+        template = await self.db.get_async(C.DocKey.TEMPLATE, "Template1")
+        self.assertEqual(template, TEMPLATE)
+
+
+class SQLiteAsyncHelpersTests(_AsyncHelpersTests, unittest.IsolatedAsyncioTestCase):
+    def make_store(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        return SQLiteDocumentStore(f"{tmp_dir.name}/documents.sqlite3")
+
+
+class FirestoreAsyncHelpersTests(_AsyncHelpersTests, unittest.IsolatedAsyncioTestCase):
+    def make_store(self):
+        return _firestore_store()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Tests of the actor index over a storage without local paths."""
+
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from generative_banner.utils.phash import ActorIndex
+from generative_banner.utils.storage import MemoryStorage
+
+
+def _png(pixels: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class ActorIndexSyncTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.root = os.path.join(tmp_dir.name, "artefacts")
+        self.storage = MemoryStorage()
+        self.index = ActorIndex(
+            os.path.join(tmp_dir.name, "index.sqlite3"),
+            self.storage,
+            self.root,
+            "Actors",
+            max_distance=6,
+        )
+
+        rng = np.random.default_rng(0)
+        original = rng.integers(0, 255, (64, 64, 3), dtype=np.uint8)
+        near = original.copy()
+        near[0, 0] = 0
+        self.storage.write_bytes("Actors/seg/a.png", _png(original))
+        self.storage.write_bytes("Actors/seg/b.png", _png(near))
+        self.storage.write_bytes(
+            "Actors/seg/c.png",
+            _png(rng.integers(0, 255, (64, 64, 3), dtype=np.uint8)),
+        )
+        self.storage.write_bytes("Actors/seg/notes.txt", b"not an actor")
+
+    def path(self, key: str) -> str:
+        return os.path.normpath(os.path.join(self.root, *key.split("/")))
+
+    def test_sync_indexes_the_actors_of_the_storage(self):
+        duplicates = self.index.sync()
+        expected = {self.path("Actors/seg/b.png"): self.path("Actors/seg/a.png")}
+        self.assertEqual(duplicates, expected)
+        self.assertEqual(self.index.duplicates(), expected)
+
+    def test_sync_keeps_actors_without_local_copies(self):
+        self.index.sync()
+        # Another host, or a cleared cache, only has some of the actors locally.
+        os.remove(self.path("Actors/seg/a.png"))
+        os.remove(self.path("Actors/seg/b.png"))
+
+        self.assertEqual(self.index.sync(), {})
+        self.assertEqual(
+            self.index.duplicates(),
+            {self.path("Actors/seg/b.png"): self.path("Actors/seg/a.png")},
+        )
+        self.assertFalse(os.path.exists(self.path("Actors/seg/a.png")))
+
+    def test_sync_forgets_actors_deleted_from_the_storage(self):
+        self.index.sync()
+        self.storage.delete("Actors/seg/a.png")
+
+        self.index.sync()
+        # The duplicate of the deleted actor becomes an original.
+        self.assertEqual(self.index.duplicates(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()